@@ -0,0 +1,198 @@
+# Player authentication. The client sends the SHA-256 hex digest of the password it was given; the server
+# only ever stores a salted PBKDF2 hash of that digest, so a leaked store does not hand out logins.
+#
+# The slow hash is the point and also the danger: at a couple of hundred milliseconds of CPU each, a few
+# hundred players reconnecting at once would freeze the event loop for a minute. Hashes therefore run in
+# a thread pool (hashlib releases the GIL while it hashes), logins already in flight for the same
+# credentials share one hash, and a successful login hands out a session token that later connections
+# can present instead of the password, which costs a dict lookup.
+#
+# Users are added from the command line:
+#
+#     python -m assets.code.auth users.db add alice
+#     python -m assets.code.auth users.db remove alice
+import asyncio
+import collections
+import concurrent.futures
+import hashlib
+import hmac
+import os
+import secrets
+import sqlite3
+import threading
+import time
+
+HASH_NAME = "sha256"
+DEFAULT_ITERATIONS = 200_000
+SALT_BYTES = 16
+
+def hashSecret(secret:str, salt:bytes, iterations:int) -> bytes:
+    return hashlib.pbkdf2_hmac(HASH_NAME, secret.encode("utf-8"), salt, iterations)
+
+def clientDigest(password:str) -> str:
+    # What pongClient sends in place of the password
+    return hashlib.sha256(password.encode()).hexdigest()
+
+class CredentialStore:
+    # Keeps (salt, hash, iterations) per username. This one keeps them in memory, which suits tests and
+    # benchmarks; SqliteCredentialStore keeps them on disk. Any class with lookup, save and delete works.
+    def __init__(self) -> None:
+        self.users = {}
+
+    def lookup(self, username:str) -> tuple:
+        # (salt, hash, iterations), or None for an unknown user
+        return self.users.get(username)
+
+    def save(self, username:str, salt:bytes, digest:bytes, iterations:int) -> None:
+        self.users[username] = (salt, digest, iterations)
+
+    def delete(self, username:str) -> bool:
+        return self.users.pop(username, None) is not None
+
+    def addUser(self, username:str, secret:str, iterations:int=DEFAULT_ITERATIONS) -> None:
+        salt = os.urandom(SALT_BYTES)
+        self.save(username, salt, hashSecret(secret, salt, iterations), iterations)
+
+    def close(self) -> None:
+        pass
+
+class SqliteCredentialStore(CredentialStore):
+    # Lookups come from the verification threads, so the one connection is shared behind a lock. Each
+    # query is a primary key read that takes microseconds next to the hash.
+    def __init__(self, path:str) -> None:
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        with self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS users (username TEXT PRIMARY KEY, salt BLOB NOT NULL, "
+                            "hash BLOB NOT NULL, iterations INTEGER NOT NULL)")
+
+    def lookup(self, username:str) -> tuple:
+        with self.lock:
+            return self.db.execute("SELECT salt, hash, iterations FROM users WHERE username = ?", (username,)).fetchone()
+
+    def save(self, username:str, salt:bytes, digest:bytes, iterations:int) -> None:
+        with self.lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO users VALUES (?, ?, ?, ?)", (username, salt, digest, iterations))
+
+    def delete(self, username:str) -> bool:
+        with self.lock, self.db:
+            return self.db.execute("DELETE FROM users WHERE username = ?", (username,)).rowcount > 0
+
+    def close(self) -> None:
+        with self.lock:
+            self.db.close()
+
+class SessionCache:
+    # Session token -> username, least recently used first. Using a token extends its life by ttl, so
+    # the order of use is also the order of expiry and expired tokens are always found at the front.
+    def __init__(self, capacity:int, ttl:float, clock=time.monotonic) -> None:
+        self.capacity = capacity
+        self.ttl = ttl
+        self.clock = clock
+        self.sessions = collections.OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.sessions)
+
+    def _expire(self, now:float) -> None:
+        sessions = self.sessions
+        while sessions:
+            token, (_, expires) = next(iter(sessions.items()))
+            if expires > now:
+                break
+            del sessions[token]
+
+    def add(self, username:str) -> str:
+        now = self.clock()
+        self._expire(now)
+        token = secrets.token_hex(16)
+        self.sessions[token] = (username, now + self.ttl)
+        while len(self.sessions) > self.capacity:
+            self.sessions.popitem(last=False)
+        return token
+
+    def get(self, token:str) -> str:
+        # The username the token was issued to, or None if it is unknown or has expired
+        now = self.clock()
+        self._expire(now)
+        entry = self.sessions.get(token)
+        if entry is None:
+            return None
+        self.sessions[token] = (entry[0], now + self.ttl)
+        self.sessions.move_to_end(token)
+        return entry[0]
+
+    def discard(self, token:str) -> None:
+        self.sessions.pop(token, None)
+
+class Authenticator:
+    # Checks logins against a CredentialStore without blocking the event loop and issues session tokens
+    def __init__(self, store:CredentialStore, workers:int=4, sessions:SessionCache=None) -> None:
+        self.store = store
+        self.pool = concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix="auth")
+        self.sessions = sessions or SessionCache(100_000, 3600)
+        # Verifications being computed, by credentials, so a burst of identical logins hashes once
+        self.pending = {}
+        # Stands in for an unknown user's hash, so that a wrong username costs as long as a wrong password
+        self.dummy = (os.urandom(SALT_BYTES), b"", DEFAULT_ITERATIONS)
+
+    def _verify(self, username:str, secret:str) -> bool:
+        # Runs in the pool
+        record = self.store.lookup(username)
+        salt, expected, iterations = record if record is not None else self.dummy
+        actual = hashSecret(secret, salt, iterations)
+        return record is not None and hmac.compare_digest(actual, expected)
+
+    async def login(self, username:str, secret:str) -> str:
+        # A new session token, or None if the username and password do not match
+        if not isinstance(username, str) or not isinstance(secret, str):
+            return None
+        key = (username, secret)
+        future = self.pending.get(key)
+        if future is None:
+            future = asyncio.get_running_loop().run_in_executor(self.pool, self._verify, username, secret)
+            self.pending[key] = future
+            future.add_done_callback(lambda _: self.pending.pop(key, None))
+        if not await asyncio.shield(future):
+            return None
+        return self.sessions.add(username)
+
+    def resume(self, token:str) -> str:
+        # The username holding session token, or None
+        if not isinstance(token, str):
+            return None
+        return self.sessions.get(token)
+
+    def close(self) -> None:
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        self.store.close()
+
+def _main() -> None:
+    import argparse
+    import getpass
+
+    parser = argparse.ArgumentParser(description="Manage the users in a pong credential store")
+    parser.add_argument("database", help="SQLite file, created if missing")
+    parser.add_argument("action", choices=("add", "remove", "list"))
+    parser.add_argument("username", nargs="?")
+    parser.add_argument("--iterations", type=int, default=DEFAULT_ITERATIONS)
+    args = parser.parse_args()
+
+    store = SqliteCredentialStore(args.database)
+    try:
+        if args.action == "list":
+            for username, iterations in store.db.execute("SELECT username, iterations FROM users ORDER BY username"):
+                print(f"{username} ({iterations} iterations)")
+        elif not args.username:
+            parser.error(f"{args.action} needs a username")
+        elif args.action == "add":
+            password = getpass.getpass(f"Password for {args.username}: ")
+            store.addUser(args.username, clientDigest(password), args.iterations)
+        elif not store.delete(args.username):
+            print(f"no user {args.username}")
+    finally:
+        store.close()
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,261 @@
+# Every room's game state in NumPy arrays, stepped for all rooms at once. It runs the rules of
+# simulation.GameWorld (and so of helperCode.Ball and Paddle) as masked array operations: one step costs a
+# few dozen array operations whatever the number of rooms, instead of a Python call chain per room.
+#
+# Each room gets a slot, one column of the arrays, and a RoomWorld that answers the same calls the server
+# makes on a GameWorld. checkParity() steps both side by side and insists on identical results; run this
+# module to check it and to compare their speed.
+import collections
+import random
+import time
+
+import numpy as np
+
+from assets.code.protocol import EVENT_BOUNCE, EVENT_POINT, STATE_FIELDS
+from assets.code.simulation import BALL_SIZE, DOWN, INPUT_BACKLOG, MAX_SCORE, PADDLE_HEIGHT, PADDLE_SPEED, PADDLE_WIDTH, UP
+
+# Rows of BatchWorld.data, in protocol.STATE_FIELDS order so a state is one column
+LEFT_Y, RIGHT_Y, BALL_X, BALL_Y, X_VEL, Y_VEL, L_SCORE, R_SCORE, P1_SEQ, P2_SEQ = range(len(STATE_FIELDS))
+PADDLE_ROWS = {"player1": LEFT_Y, "player2": RIGHT_Y}
+SEQ_ROWS = {"player1": P1_SEQ, "player2": P2_SEQ}
+# The velocity helperCode.Ball.reset gives the ball
+BALL_SPEED = 5
+WALL_HEIGHT = 10
+
+def collides(x, y, w:int, h:int, otherX, otherY, otherW:int, otherH:int):
+    # helperCode.Rect.colliderect for arrays of rects with non-zero sizes
+    return (x < otherX + otherW) & (y < otherY + otherH) & (x + w > otherX) & (y + h > otherY)
+
+class RoomWorld:
+    # One room's view of a BatchWorld, with the parts of the GameWorld interface the server uses
+    def __init__(self, batch:"BatchWorld", slot:int) -> None:
+        self.batch = batch
+        self.slot = slot
+        self.pendingInputs = {"player1": collections.deque(), "player2": collections.deque()}
+        self.receivedSeq = {"player1": 0, "player2": 0}
+
+    @property
+    def tick(self) -> int:
+        return int(self.batch.ticks[self.slot])
+
+    @property
+    def lScore(self) -> int:
+        return int(self.batch.data[L_SCORE, self.slot])
+
+    @property
+    def rScore(self) -> int:
+        return int(self.batch.data[R_SCORE, self.slot])
+
+    def queueInputs(self, playerId:str, firstSeq:int, moves:list) -> None:
+        # The same filtering as GameWorld.queueInputs; the batch applies them on its next step
+        pending = self.pendingInputs[playerId]
+        received = self.receivedSeq[playerId]
+        for seq, move in enumerate(moves, firstSeq):
+            if seq > received:
+                pending.append((seq, move))
+                received = seq
+        self.receivedSeq[playerId] = received
+        if pending:
+            self.batch.withInputs.add(self)
+
+    def isOver(self) -> bool:
+        return self.lScore > MAX_SCORE or self.rScore > MAX_SCORE
+
+    def state(self) -> tuple:
+        return tuple(self.batch.rows()[self.slot])
+
+class BatchWorld:
+    def __init__(self, screenWidth:int, screenHeight:int, capacity:int=64) -> None:
+        self.screenWidth = screenWidth
+        self.screenHeight = screenHeight
+        self.ballStartX = screenWidth//2
+        self.ballStartY = screenHeight//2
+        self.paddleStartY = (screenHeight//2)-(PADDLE_HEIGHT//2)
+        self.rightPaddleX = screenWidth-20
+
+        self.data = np.zeros((len(STATE_FIELDS), 0), np.int64)
+        self.ticks = np.zeros(0, np.int64)
+        # Slots whose room has started; only those are stepped
+        self.active = np.zeros(0, bool)
+        self.freeSlots = []
+        self._grow(capacity)
+        # Rooms holding inputs that have not been applied yet
+        self.withInputs = set()
+        self._rows = None
+
+    def _grow(self, capacity:int) -> None:
+        old = self.ticks.size
+        self.data = np.concatenate((self.data, np.zeros((len(STATE_FIELDS), capacity - old), np.int64)), axis=1)
+        self.ticks = np.concatenate((self.ticks, np.zeros(capacity - old, np.int64)))
+        self.active = np.concatenate((self.active, np.zeros(capacity - old, bool)))
+        # Hand out low slots first
+        self.freeSlots.extend(range(capacity - 1, old - 1, -1))
+
+    def add(self) -> RoomWorld:
+        # A new room in its starting position, not stepped until start() is called for it
+        if not self.freeSlots:
+            self._grow(self.ticks.size * 2)
+        slot = self.freeSlots.pop()
+        column = self.data[:, slot]
+        column[:] = 0
+        column[LEFT_Y] = column[RIGHT_Y] = self.paddleStartY
+        column[BALL_X], column[BALL_Y] = self.ballStartX, self.ballStartY
+        column[X_VEL] = -BALL_SPEED
+        self.ticks[slot] = 0
+        self._rows = None
+        return RoomWorld(self, slot)
+
+    def start(self, world:RoomWorld) -> None:
+        self.active[world.slot] = True
+
+    def remove(self, world:RoomWorld) -> None:
+        self.active[world.slot] = False
+        self.withInputs.discard(world)
+        self.freeSlots.append(world.slot)
+
+    def rows(self) -> list:
+        # Every slot's state as a list of Python ints, converted once per step however many rooms read it
+        if self._rows is None:
+            self._rows = self.data.T.tolist()
+        return self._rows
+
+    def _applyInputs(self) -> None:
+        # Pops the inputs each room applies this step exactly as GameWorld.applyInputs does, then moves
+        # the paddles in rounds: round i applies the i-th input of every paddle that has one
+        rounds = []
+        for world in list(self.withInputs):
+            if not self.active[world.slot]:
+                continue
+            for playerId, pending in world.pendingInputs.items():
+                if not pending:
+                    continue
+                for i in range(max(1, len(pending) - INPUT_BACKLOG + 1)):
+                    seq, move = pending.popleft()
+                    if i == len(rounds):
+                        rounds.append(([], [], [], []))
+                    rows, slots, moves, seqs = rounds[i]
+                    rows.append(PADDLE_ROWS[playerId])
+                    slots.append(world.slot)
+                    moves.append(move)
+                    seqs.append((SEQ_ROWS[playerId], seq))
+            if not world.pendingInputs["player1"] and not world.pendingInputs["player2"]:
+                self.withInputs.discard(world)
+
+        data = self.data
+        bottomLimit = self.screenHeight - WALL_HEIGHT
+        for rows, slots, moves, seqs in rounds:
+            # Each paddle appears at most once per round, so the fancy-indexed writes never collide
+            y = data[rows, slots]
+            moves = np.array(moves)
+            down = (moves == DOWN) & (y + PADDLE_HEIGHT < bottomLimit)
+            up = (moves == UP) & (y > WALL_HEIGHT)
+            data[rows, slots] = y + PADDLE_SPEED * (down.astype(np.int64) - up)
+            seqRows, seqValues = zip(*seqs)
+            data[list(seqRows), slots] = seqValues
+
+    def step(self) -> np.ndarray:
+        # Advances every started room by one tick. Returns the EVENT_* mask of every slot; slots that
+        # were not stepped report 0.
+        data = self.data
+        active = self.active
+        self.ticks += active
+        self._rows = None
+        self._applyInputs()
+
+        running = active & (data[L_SCORE] <= MAX_SCORE) & (data[R_SCORE] <= MAX_SCORE)
+        xVel, yVel = data[X_VEL], data[Y_VEL]
+        ballX = np.where(running, data[BALL_X] + xVel, data[BALL_X])
+        ballY = np.where(running, data[BALL_Y] + yVel, data[BALL_Y])
+
+        # Past either edge of the screen: a point, and the ball starts over heading away from the scorer
+        leftPoint = running & (ballX > self.screenWidth)
+        rightPoint = running & ~leftPoint & (ballX < 0)
+        point = leftPoint | rightPoint
+        data[L_SCORE] += leftPoint
+        data[R_SCORE] += rightPoint
+        ballX = np.where(point, self.ballStartX, ballX)
+        ballY = np.where(point, self.ballStartY, ballY)
+        xVel = np.where(leftPoint, -BALL_SPEED, np.where(rightPoint, BALL_SPEED, xVel))
+        yVel = np.where(point, 0, yVel)
+
+        # Paddles: the left one is checked first, as in GameWorld.step
+        leftY, rightY = data[LEFT_Y], data[RIGHT_Y]
+        hitLeft = running & collides(ballX, ballY, BALL_SIZE, BALL_SIZE, 10, leftY, PADDLE_WIDTH, PADDLE_HEIGHT)
+        hitRight = running & ~hitLeft & collides(ballX, ballY, BALL_SIZE, BALL_SIZE, self.rightPaddleX, rightY, PADDLE_WIDTH, PADDLE_HEIGHT)
+        hitPaddle = hitLeft | hitRight
+        paddleCenter = np.where(hitLeft, leftY, rightY) + PADDLE_HEIGHT//2
+        xVel = np.where(hitPaddle, -xVel, xVel)
+        yVel = np.where(hitPaddle, (ballY + BALL_SIZE//2 - paddleCenter)//2, yVel)
+
+        # A fast ball can pass a wall between two ticks, so this is a full overlap test like the paddles'
+        wallWidth = self.screenWidth + 20
+        hitWall = running & (collides(ballX, ballY, BALL_SIZE, BALL_SIZE, -10, 0, wallWidth, WALL_HEIGHT)
+                             | collides(ballX, ballY, BALL_SIZE, BALL_SIZE, -10, self.screenHeight - WALL_HEIGHT, wallWidth, WALL_HEIGHT))
+        yVel = np.where(hitWall, -yVel, yVel)
+
+        data[BALL_X], data[BALL_Y], data[X_VEL], data[Y_VEL] = ballX, ballY, xVel, yVel
+        return np.where(point, EVENT_POINT, 0) | np.where(hitPaddle | hitWall, EVENT_BOUNCE, 0)
+
+def checkParity(rooms:int=200, ticks:int=3000, screenWidth:int=640, screenHeight:int=480, seed:int=1) -> int:
+    # Steps GameWorlds and a BatchWorld through the same random inputs, including bursts that exercise
+    # the input backlog and repeated inputs, and raises AssertionError at the first tick where any room's
+    # events or state differ. Returns the number of room ticks compared.
+    from assets.code.simulation import GameWorld
+
+    rng = random.Random(seed)
+    batch = BatchWorld(screenWidth, screenHeight, capacity=8)
+    pairs = []
+    for _ in range(rooms):
+        world = batch.add()
+        batch.start(world)
+        pairs.append((GameWorld(screenWidth, screenHeight), world))
+    nextSeq = [{"player1": 1, "player2": 1} for _ in range(rooms)]
+
+    for tick in range(1, ticks + 1):
+        for room, (reference, world) in enumerate(pairs):
+            for playerId in ("player1", "player2"):
+                count = rng.choice((0, 1, 1, 1, 1, 2, 6))
+                if not count:
+                    continue
+                # Start a little before the next new seq, as a resent input message would
+                firstSeq = max(1, nextSeq[room][playerId] - rng.randint(0, 2))
+                moves = [rng.choice((UP, DOWN, DOWN, UP, 0)) for _ in range(count)]
+                reference.queueInputs(playerId, firstSeq, moves)
+                world.queueInputs(playerId, firstSeq, moves)
+                nextSeq[room][playerId] = max(nextSeq[room][playerId], firstSeq + count)
+
+        events = batch.step().tolist()
+        for room, (reference, world) in enumerate(pairs):
+            expected = (reference.step(), reference.tick, reference.state())
+            actual = (events[world.slot], world.tick, world.state())
+            if expected != actual:
+                raise AssertionError(f"room {room} differs at tick {tick}: GameWorld gave {expected}, BatchWorld gave {actual}")
+    return rooms * ticks
+
+def _timeSteps(step, ticks:int) -> float:
+    started = time.perf_counter()
+    for _ in range(ticks):
+        step()
+    return (time.perf_counter() - started) / ticks
+
+def benchmark(rooms:int, ticks:int=200) -> tuple:
+    # Seconds per tick for stepping every room with GameWorld objects and with one BatchWorld
+    from assets.code.simulation import GameWorld
+
+    worlds = [GameWorld(640, 480) for _ in range(rooms)]
+    batch = BatchWorld(640, 480, capacity=rooms)
+    for _ in range(rooms):
+        batch.start(batch.add())
+
+    def stepObjects():
+        for world in worlds:
+            world.step()
+    return _timeSteps(stepObjects, ticks), _timeSteps(batch.step, ticks)
+
+if __name__ == "__main__":
+    for width, height in ((640, 480), (800, 600)):
+        compared = checkParity(screenWidth=width, screenHeight=height, seed=width)
+        print(f"parity at {width}x{height}: {compared} room ticks identical")
+    for rooms in (10, 100, 1000, 10000):
+        objects, batched = benchmark(rooms)
+        print(f"{rooms:>6} rooms: GameWorld {objects * 1000:8.3f} ms/tick, BatchWorld {batched * 1000:8.3f} ms/tick ({objects / batched:.1f}x)")
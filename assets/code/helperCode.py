@@ -1,39 +1,110 @@
 # You don't need to edit this file at all unless you really want to
-import pygame
+#
+# Nothing here loads pygame: the server, the bots and the replay tool step the physics with these
+# classes and never pay for SDL. Drawing, the score included, is up to assets/code/renderer.py.
 
-# This draws the score to the screen
-def updateScore(lScore:int, rScore:int, screen:pygame.surface.Surface, color, scoreFont:pygame.font.Font) -> pygame.Rect:
-    textSurface = scoreFont.render(f"{lScore}   {rScore}", False, color)
-    textRect = textSurface.get_rect()
-    screenWidth = screen.get_width()
-    textRect.center = ((screenWidth/2)+5, 50)
-    return screen.blit(textSurface, textRect)
+class Rect:
+    # The parts of pygame.Rect the game rules use, in plain Python. It is a sequence of (x, y, w, h), so
+    # pygame.Rect(rect) turns one into the real thing for drawing. Unlike pygame.Rect it keeps whatever
+    # numbers it is given; the simulation only ever gives it ints.
+    __slots__ = ("x", "y", "w", "h")
+
+    def __init__(self, x, y, w, h) -> None:
+        self.x = x
+        self.y = y
+        self.w = w
+        self.h = h
+
+    def __len__(self) -> int:
+        return 4
+
+    def __getitem__(self, i:int):
+        return (self.x, self.y, self.w, self.h)[i]
+
+    def __eq__(self, other) -> bool:
+        return tuple(self) == tuple(other)
+
+    def __repr__(self) -> str:
+        return f"<Rect({self.x}, {self.y}, {self.w}, {self.h})>"
+
+    @property
+    def width(self):
+        return self.w
+
+    @property
+    def height(self):
+        return self.h
+
+    @property
+    def left(self):
+        return self.x
+
+    @property
+    def top(self):
+        return self.y
+
+    @property
+    def right(self):
+        return self.x + self.w
+
+    @property
+    def bottom(self):
+        return self.y + self.h
+
+    @property
+    def centerx(self):
+        return self.x + self.w // 2
+
+    @property
+    def centery(self):
+        return self.y + self.h // 2
+
+    @property
+    def center(self) -> tuple:
+        return (self.x + self.w // 2, self.y + self.h // 2)
+
+    def colliderect(self, other:"Rect") -> bool:
+        # Same answer as pygame: touching edges do not overlap, and an empty rect overlaps nothing
+        return (self.x < other.x + other.w and self.x + self.w > other.x and
+                self.y < other.y + other.h and self.y + self.h > other.y and
+                self.w > 0 and self.h > 0 and other.w > 0 and other.h > 0)
+
+    def collidelist(self, rects:list) -> int:
+        # Index of the first of rects this one overlaps, or -1
+        for i, rect in enumerate(rects):
+            if self.colliderect(rect):
+                return i
+        return -1
 
 class Paddle:
-    def __init__(self, rect: pygame.Rect) -> None:
+    __slots__ = ("rect", "moving", "speed")
+
+    def __init__(self, rect: Rect) -> None:
         self.rect = rect
         self.moving = ""
         self.speed = 5
 
 class Ball:
-    def __init__(self, rect:pygame.Rect, startXvel:int, startYvel:int) -> None:
+    __slots__ = ("rect", "xVel", "yVel", "startXpos", "startYpos")
+
+    def __init__(self, rect:Rect, startXvel:int, startYvel:int) -> None:
         self.rect = rect
         self.xVel = startXvel
         self.yVel = startYvel
         self.startXpos = rect.x
         self.startYpos = rect.y
-    
+
     def updatePos(self) -> None:
         self.rect.x += self.xVel
         self.rect.y += self.yVel
-    
+
     def hitPaddle(self, paddleCenter:int) -> None:
         self.xVel *= -1
-        self.yVel = (self.rect.center[1] - paddleCenter)//2
-    
+        self.yVel = (self.rect.centery - paddleCenter)//2
+
     def hitWall(self) -> None:
         self.yVel *= -1
-    
+
     def reset(self, nowGoing:str) -> None:
         # nowGoing  The direction the ball should be going after the reset
         self.rect.x = self.startXpos
@@ -0,0 +1,170 @@
+# Counters, gauges and histograms for a running server, rendered in the Prometheus text format, plus
+# profiling hooks that can be switched on for a few seconds on a live process.
+#
+# Recording is a dict update or a short loop over bucket bounds, cheap enough for the per-message path.
+import bisect
+import collections
+import cProfile
+import io
+import pstats
+import sys
+import threading
+
+def _labelText(labelNames:tuple, labelValues:tuple) -> str:
+    if not labelNames:
+        return ""
+    pairs = ",".join(f'{name}="{value}"' for name, value in zip(labelNames, labelValues))
+    return "{" + pairs + "}"
+
+class Counter:
+    def __init__(self, name:str, help:str, labelNames:tuple=()) -> None:
+        self.name = name
+        self.help = help
+        self.labelNames = labelNames
+        self.values = collections.defaultdict(float)
+
+    def inc(self, amount:float=1, labels:tuple=()) -> None:
+        self.values[labels] += amount
+
+    def total(self) -> float:
+        return sum(self.values.values())
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self.values.items()):
+            lines.append(f"{self.name}{_labelText(self.labelNames, labels)} {value:g}")
+        return lines
+
+class Gauge:
+    # Either set explicitly or read from a callable at render time
+    def __init__(self, name:str, help:str, read=None) -> None:
+        self.name = name
+        self.help = help
+        self.read = read
+        self.value = 0
+
+    def set(self, value:float) -> None:
+        self.value = value
+
+    def get(self) -> float:
+        return self.read() if self.read is not None else self.value
+
+    def render(self) -> list:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {self.get():g}"]
+
+class Histogram:
+    def __init__(self, name:str, help:str, buckets:tuple) -> None:
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        # One count per bucket plus the overflow (+Inf) bucket; not cumulative until rendered
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value:float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q:float) -> float:
+        # Upper bound of the bucket holding the q-th observation, good enough for a log line
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return float("inf")
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{{le="{bound:g}"}} {cumulative}')
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {self.count}')
+        lines.append(f"{self.name}_sum {self.sum:g}")
+        lines.append(f"{self.name}_count {self.count}")
+        return lines
+
+# Bucket bounds in seconds for things that should take well under a tick
+TIME_BUCKETS = (0.00001, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+# Bucket bounds in bytes for queued output
+BYTE_BUCKETS = (0, 64, 256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self.metrics = []
+
+    def _add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name:str, help:str, labelNames:tuple=()) -> Counter:
+        return self._add(Counter(name, help, labelNames))
+
+    def gauge(self, name:str, help:str, read=None) -> Gauge:
+        return self._add(Gauge(name, help, read))
+
+    def histogram(self, name:str, help:str, buckets:tuple=TIME_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+class CallProfiler:
+    # cProfile for a bounded window. It only sees calls made on the thread that calls start(), which for
+    # the server is the event loop thread doing all the work.
+    def __init__(self, sortBy:str="cumulative", limit:int=40) -> None:
+        self.sortBy = sortBy
+        self.limit = limit
+        self.profiler = cProfile.Profile()
+
+    def start(self) -> None:
+        self.profiler.enable()
+
+    def stop(self) -> str:
+        self.profiler.disable()
+        out = io.StringIO()
+        pstats.Stats(self.profiler, stream=out).sort_stats(self.sortBy).print_stats(self.limit)
+        return out.getvalue()
+
+class StackSampler:
+    # A sampling profiler: a background thread periodically records the stack of the target thread.
+    # The result is in the folded format flame graph tools read ("outer;inner;leaf count"), and costs
+    # the profiled thread nothing but the GIL hand-offs.
+    def __init__(self, threadId:int=None, interval:float=0.005) -> None:
+        self.threadId = threadId if threadId is not None else threading.main_thread().ident
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.threadId)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{code.co_firstlineno})")
+                frame = frame.f_back
+            self.stacks[";".join(reversed(names))] += 1
+            self.samples += 1
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> str:
+        self._stop.set()
+        self._thread.join()
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
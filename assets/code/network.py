@@ -0,0 +1,271 @@
+# Client side networking. A background thread owns all reads from the server so the render loop never
+# waits on the network: it sends inputs as they happen and reads whatever state arrived most recently.
+#
+# When the server uses the UDP transport, inputs, acknowledgements and states travel as datagrams while
+# the stream keeps carrying the reliable events. Every input datagram repeats the inputs the server has
+# not confirmed yet, so a lost datagram is covered by the next one.
+#
+# If the stream breaks during a match, or nothing arrives for STALL_TIMEOUT, the network thread connects
+# again and asks for its seat back with the resume token from the handshake. It does not wait for the
+# answer: the parameters, score and a keyframe come back on the new stream like any other read, so play
+# carries on one round trip after the new connection is up.
+import collections
+import selectors
+import socket
+import threading
+import time
+
+from assets.code import protocol
+
+class ClientConnection:
+    # How often to repeat the UDP hello until the server starts sending datagrams
+    HELLO_INTERVAL = 0.1
+    # Most unconfirmed inputs repeated in one datagram
+    MAX_REDUNDANT_INPUTS = 32
+    # The server sends a state every tick while the ball moves, and answers a ping when things go quiet,
+    # so this long without hearing from it means the link is gone even if no error says so
+    STALL_TIMEOUT = 1.0
+    # Longest wait for one connection attempt, and the pause between attempts, while reconnecting
+    CONNECT_TIMEOUT = 0.5
+    RETRY_INTERVAL = 0.1
+
+    def __init__(self, sock:socket.socket, codec:str=protocol.CODEC_BINARY,
+                 decoder:protocol.FrameDecoder=None, pending:list=None,
+                 playerId:str=None, udpAddr:tuple=None, udpToken:int=None,
+                 resumeRequest:dict=None, reconnectGrace:float=0) -> None:
+        # decoder and pending carry over any bytes the handshake already read past the parameters frame.
+        # udpAddr and udpToken come from the handshake when the server uses the UDP transport.
+        # resumeRequest is the get_parameters request that asks for the seat back, which the server
+        # holds for reconnectGrace seconds after the stream breaks; without one a broken stream ends
+        # the game.
+        self.sock = sock
+        self.serverAddr = sock.getpeername()
+        self.resumeRequest = resumeRequest
+        self.reconnectGrace = reconnectGrace
+        self.codec = codec
+        self.decoder = decoder or protocol.FrameDecoder()
+        self.pending = pending if pending is not None else []
+        self.snapshots = protocol.SnapshotTracker(codec)
+
+        # Written only by the network thread and read by the render loop without locking. latest is
+        # replaced as a whole tuple, (tick, state) from protocol.SnapshotTracker, so readers always see a
+        # consistent state. The counters only ever grow; the reader compares them with the last values
+        # it saw to find out whether something happened.
+        self.latest = None
+        # (arrival time, tick, state) for the recent states, for interpolation. Only appended to here;
+        # the render loop copies it with list(), which is atomic, before reading it.
+        self.history = collections.deque(maxlen=64)
+        self.score = (0, 0)
+        self.bounces = 0
+        self.points = 0
+        self.error = None
+        # Times the stream was replaced by a new one; the render loop drops its unconfirmed predictions
+        # when this changes, since the inputs sent while the link was down were lost
+        self.reconnects = 0
+        # Frames' worth of inputs to batch into one message, as the server asks when our link is congested
+        self.inputInterval = 1
+        self.lastReceived = time.monotonic()
+        self.pingedAt = 0.0
+
+        self.started = threading.Event()
+        self.closed = threading.Event()
+        # Inputs come from the render loop and acknowledgements from the network thread
+        self._sendLock = threading.Lock()
+
+        self.udp = None
+        # Reused for every datagram; the frames parsed out of it are copies
+        self.datagramBuffer = bytearray(65536)
+        self.udpAddr = udpAddr
+        self.udpToken = udpToken
+        self.udpHello = protocol.encode(protocol.UDP_HELLO, (udpToken,)) if udpAddr is not None else None
+        self.udpConfirmed = False
+        # (seq, move) inputs sent over UDP that no state has confirmed yet
+        self.unconfirmed = collections.deque()
+        self._inputSeqIndex = protocol.STATE_FIELDS.index(f"{playerId}_input") if playerId else None
+        if udpAddr is not None:
+            self.udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.udp.connect(udpAddr)
+
+        # Reads block in the network thread, so it no longer needs the handshake timeout
+        self.sock.settimeout(None)
+        self._thread = threading.Thread(target=self._run, name="pong-network", daemon=True)
+        self._thread.start()
+
+    def _sendStream(self, frame:bytes) -> None:
+        with self._sendLock:
+            try:
+                self.sock.sendall(frame)
+            except OSError:
+                # The network thread notices the broken stream and reconnects if it can. What was being
+                # sent is lost, like a dropped datagram would be.
+                if self.resumeRequest is None:
+                    raise
+
+    def send(self, msgType:int, values:tuple=()) -> None:
+        self._sendStream(protocol.encode(msgType, values, self.codec))
+
+    def sendState(self, msgType:int, values:tuple=()) -> None:
+        # Sends a message that belongs on the state channel: UDP if the server uses it, else the stream
+        if self.udp is None:
+            self.send(msgType, values)
+        else:
+            self.udp.send(protocol.encode(msgType, values, self.codec))
+
+    def sendReady(self) -> None:
+        self.send(protocol.READY)
+
+    def sendInputs(self, firstSeq:int, moves:list) -> None:
+        if self.udp is None:
+            self._sendStream(protocol.encodeInputs(firstSeq, moves, self.codec))
+            return
+
+        with self._sendLock:
+            unconfirmed = self.unconfirmed
+            unconfirmed.extend(enumerate(moves, firstSeq))
+            while len(unconfirmed) > self.MAX_REDUNDANT_INPUTS:
+                unconfirmed.popleft()
+            frame = protocol.encodeInputs(unconfirmed[0][0], [move for _, move in unconfirmed], self.codec)
+        try:
+            self.udp.send(frame)
+        except OSError:
+            # Datagrams may be refused while the network is down; the next input repeats this one
+            pass
+
+    def close(self) -> None:
+        self.closed.set()
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+        if self.udp is not None:
+            self.udp.close()
+
+    def _handle(self, msgType:int, payload:bytes) -> None:
+        if msgType == protocol.SNAPSHOT or msgType == protocol.DELTA:
+            ackTick, events = self.snapshots.receive(msgType, payload)
+            # Acknowledge every state we rebuild so the server can delta against it
+            self.sendState(protocol.ACK, (ackTick,))
+            if events & protocol.EVENT_POINT:
+                self.points += 1
+            elif events & protocol.EVENT_BOUNCE:
+                self.bounces += 1
+            latest = self.latest
+            if self.snapshots.state is not None and (latest is None or self.snapshots.tick > latest[0]):
+                self.latest = (self.snapshots.tick, self.snapshots.state)
+                self.history.append((time.monotonic(), self.snapshots.tick, self.snapshots.state))
+                if self.unconfirmed:
+                    self._confirmInputs(self.snapshots.state[self._inputSeqIndex])
+        elif msgType == protocol.SCORE_UPDATE:
+            self.score = protocol.decode(msgType, payload, self.codec)
+        elif msgType == protocol.GAME_START:
+            self.started.set()
+        elif msgType == protocol.RATE:
+            self.inputInterval, = protocol.decode(msgType, payload, self.codec)
+        elif msgType == protocol.PARAMETERS:
+            # Only sent again in answer to a resume request
+            response = protocol.decodeJson(payload)
+            if "error" in response:
+                raise ConnectionError(f"could not rejoin the match: {response['error']}")
+            if self.udp is not None and isinstance(response.get("udp_token"), int):
+                self.udpToken = response["udp_token"]
+                self.udpHello = protocol.encode(protocol.UDP_HELLO, (self.udpToken,))
+                self.udpConfirmed = False
+
+    def _confirmInputs(self, appliedSeq:int) -> None:
+        with self._sendLock:
+            unconfirmed = self.unconfirmed
+            while unconfirmed and unconfirmed[0][0] <= appliedSeq:
+                unconfirmed.popleft()
+
+    def _readStream(self) -> None:
+        self.pending.extend(self.decoder.readFrom(self.sock))
+        self.lastReceived = time.monotonic()
+
+    def _readDatagram(self) -> None:
+        try:
+            size = self.udp.recv_into(self.datagramBuffer)
+        except ConnectionRefusedError:
+            # An ICMP error for an earlier datagram; the stream tells us if the server is really gone
+            return
+        try:
+            frames = protocol.parseDatagram(memoryview(self.datagramBuffer)[:size])
+        except protocol.ProtocolError:
+            return
+        self.udpConfirmed = True
+        self.lastReceived = time.monotonic()
+        self.pending.extend(frames)
+
+    def _reconnect(self, selector:selectors.BaseSelector, cause:Exception) -> None:
+        # Replaces the broken stream with a new one that asks for the seat back, or raises cause if the
+        # server does not take a connection within the grace period
+        if self.resumeRequest is None or self.closed.is_set():
+            raise cause
+        selector.unregister(self.sock)
+        self.sock.close()
+        request = protocol.encodeJson(protocol.GET_PARAMETERS, self.resumeRequest)
+        deadline = time.monotonic() + self.reconnectGrace
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self.closed.is_set():
+                raise cause
+            try:
+                sock = socket.create_connection(self.serverAddr, timeout=min(remaining, self.CONNECT_TIMEOUT))
+                sock.sendall(request)
+                break
+            except OSError:
+                time.sleep(min(remaining, self.RETRY_INTERVAL))
+        sock.settimeout(None)
+        with self._sendLock:
+            self.sock = sock
+        # Whatever was left of a frame on the old stream will never be completed
+        self.decoder = protocol.FrameDecoder()
+        self.lastReceived = time.monotonic()
+        self.reconnects += 1
+        selector.register(sock, selectors.EVENT_READ, self._readStream)
+
+    def _run(self) -> None:
+        selector = selectors.DefaultSelector()
+        selector.register(self.sock, selectors.EVENT_READ, self._readStream)
+        if self.udp is not None:
+            selector.register(self.udp, selectors.EVENT_READ, self._readDatagram)
+        try:
+            while not self.closed.is_set():
+                while self.pending:
+                    self._handle(*self.pending.pop(0))
+                timeout = None
+                if self.resumeRequest is not None and self.started.is_set():
+                    idle = time.monotonic() - self.lastReceived
+                    if idle >= self.STALL_TIMEOUT:
+                        self._reconnect(selector, ConnectionError("lost contact with the server"))
+                        continue
+                    if idle < self.STALL_TIMEOUT / 2:
+                        timeout = self.STALL_TIMEOUT / 2 - idle
+                    else:
+                        if self.pingedAt < self.lastReceived:
+                            # Quiet, e.g. once the match is over; a ping shows whether the server is there
+                            self.pingedAt = time.monotonic()
+                            self.send(protocol.PING, (time.perf_counter(),))
+                        timeout = self.STALL_TIMEOUT - idle
+                if self.udp is not None and not self.udpConfirmed:
+                    # Keep saying hello until the first datagram shows the server knows our address
+                    try:
+                        self.udp.send(self.udpHello)
+                    except ConnectionRefusedError:
+                        pass
+                    timeout = self.HELLO_INTERVAL if timeout is None else min(timeout, self.HELLO_INTERVAL)
+                for key, _ in selector.select(timeout):
+                    try:
+                        key.data()
+                    except OSError as e:
+                        if key.fileobj is not self.sock:
+                            raise
+                        self._reconnect(selector, e)
+        except Exception as e:
+            if not self.closed.is_set():
+                self.error = e
+        finally:
+            selector.close()
+            self.closed.set()
+            # Unblock anyone still waiting for the game to start
+            self.started.set()
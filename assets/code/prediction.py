@@ -0,0 +1,93 @@
+# Client-side prediction and interpolation. The local paddle moves as soon as a key is pressed and is
+# corrected whenever the server reports which of our inputs it has applied. The opponent paddle and the
+# ball are drawn slightly in the past, interpolated between two buffered server states, so they move
+# smoothly however unevenly the states arrive.
+import collections
+
+from assets.code.helperCode import Paddle
+from assets.code.simulation import MOVING, movePaddle
+
+# Indexes into a protocol.STATE_FIELDS state
+LEFT_Y, RIGHT_Y, BALL_X, BALL_Y = 0, 1, 2, 3
+SCORES = slice(6, 8)
+INPUT_SEQ = {"player1": 8, "player2": 9}
+PADDLE_Y = {"player1": LEFT_Y, "player2": RIGHT_Y}
+
+class PaddlePredictor:
+    def __init__(self, paddle:Paddle, screenHeight:int) -> None:
+        self.paddle = paddle
+        self.screenHeight = screenHeight
+        # (seq, move) inputs applied locally that the server has not confirmed yet
+        self.pending = collections.deque()
+
+    def apply(self, seq:int, move:int) -> None:
+        # Moves the paddle right away, using the same rules the server will apply to this input
+        saved = self.paddle.moving
+        self.paddle.moving = MOVING.get(move, "")
+        movePaddle(self.paddle, self.screenHeight)
+        self.paddle.moving = saved
+        self.pending.append((seq, move))
+
+    def reconcile(self, appliedSeq:int, serverY:int) -> None:
+        # Rewinds to the server's position after input appliedSeq and replays the inputs after it
+        pending = self.pending
+        while pending and pending[0][0] <= appliedSeq:
+            pending.popleft()
+
+        paddle = self.paddle
+        saved = paddle.moving
+        paddle.rect.y = serverY
+        for seq, move in pending:
+            paddle.moving = MOVING.get(move, "")
+            movePaddle(paddle, self.screenHeight)
+        paddle.moving = saved
+
+class SnapshotInterpolator:
+    def __init__(self, tickRate:int, delay:float) -> None:
+        self.tickInterval = 1 / tickRate
+        self.delay = delay
+        # Estimate of (local clock - server clock), where the server clock is tick * tickInterval
+        self.offset = None
+        self.newestTick = -1
+
+    def _updateOffset(self, arrival:float, tick:int) -> None:
+        sample = arrival - tick * self.tickInterval
+        if self.offset is None or sample < self.offset:
+            # The least delayed state seen is the best estimate, take it at once
+            self.offset = sample
+        else:
+            # Drift up slowly so a lasting increase in latency is eventually followed
+            self.offset += (sample - self.offset) * 0.01
+
+    def sample(self, history:collections.deque, now:float) -> tuple:
+        # history holds (arrival time, tick, state) entries in tick order. Returns the state as it was
+        # delay seconds ago on the server clock, or None before anything has arrived.
+        entries = list(history)
+        if not entries:
+            return None
+        for arrival, tick, state in entries:
+            if tick > self.newestTick:
+                self._updateOffset(arrival, tick)
+                self.newestTick = tick
+
+        renderTick = (now - self.offset - self.delay) / self.tickInterval
+        if renderTick <= entries[0][1]:
+            return entries[0][2]
+        for i in range(len(entries) - 1, 0, -1):
+            olderTick = entries[i-1][1]
+            if olderTick <= renderTick:
+                newerTick, newer = entries[i][1], entries[i][2]
+                if renderTick >= newerTick:
+                    return newer
+                return interpolate(entries[i-1][2], newer, (renderTick - olderTick) / (newerTick - olderTick))
+        return entries[-1][2]
+
+def interpolate(older:tuple, newer:tuple, t:float) -> tuple:
+    # Blends the paddle and ball positions; everything else comes from the newer state
+    if older[SCORES] != newer[SCORES]:
+        # Someone scored in between and the ball was reset, so there is nothing to slide between
+        return newer
+    state = list(newer)
+    for i in (LEFT_Y, RIGHT_Y, BALL_X, BALL_Y):
+        state[i] = round(older[i] + (newer[i] - older[i]) * t)
+    return tuple(state)
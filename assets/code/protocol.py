@@ -0,0 +1,346 @@
+# Wire protocol shared by the client and the server.
+#
+# Every message travels as a frame:
+#
+#     +----------------+---------+------+-------------------+
+#     | payload length | version | type | payload           |
+#     | uint16         | uint8   | uint8| <length> bytes    |
+#     +----------------+---------+------+-------------------+
+#
+# Hot-path messages (inputs, snapshots and score updates) have fixed struct layouts. The handshake is
+# always JSON since it is sent once and carries strings. A client can ask for JSON payloads on every
+# message during the handshake, which is handy when debugging with a packet capture.
+#
+# The same frames are used over UDP when the server runs with the UDP transport; a datagram then
+# carries one or more whole frames.
+import json
+import operator
+import struct
+
+PROTOCOL_VERSION = 5
+HEADER = struct.Struct("!HBB")
+MAX_PAYLOAD = 0xFFFF
+
+CODEC_BINARY = "binary"
+CODEC_JSON = "json"
+
+# Message types
+GET_PARAMETERS = 1
+PARAMETERS = 2
+READY = 3
+GAME_START = 4
+INPUT = 5
+SNAPSHOT = 6
+SCORE_UPDATE = 7
+DELTA = 8
+ACK = 9
+UDP_HELLO = 10
+PING = 11
+PONG = 12
+RATE = 13
+
+# Message type names for logs and metrics
+MESSAGE_NAMES = {
+    GET_PARAMETERS: "get_parameters", PARAMETERS: "parameters", READY: "ready", GAME_START: "game_start",
+    INPUT: "input", SNAPSHOT: "snapshot", SCORE_UPDATE: "score_update", DELTA: "delta", ACK: "ack",
+    UDP_HELLO: "udp_hello", PING: "ping", PONG: "pong", RATE: "rate",
+}
+
+# paddle_position the handshake gives someone who asked to spectate a room instead of playing
+SPECTATOR = "spectator"
+
+# Bits of the events field in snapshots and deltas, used by clients to play sounds
+EVENT_BOUNCE = 1
+EVENT_POINT = 2
+
+# The world state carried by snapshots and deltas, quantized to whole pixels. Each field is sized to its
+# range so a delta only spends the bytes its changed fields need. The *_input fields are the sequence
+# number of the last input the server applied for each player, which clients use to reconcile their
+# predicted paddle.
+STATE_FIELDS = ("left_y", "right_y", "ball_x", "ball_y", "ball_x_vel", "ball_y_vel", "player1_score", "player2_score",
+                "player1_input", "player2_input")
+STATE_FORMATS = "hhhhbbBBII"
+# Acknowledging this tick tells the server the client has no usable baseline and needs a keyframe
+NO_BASELINE = 0xFFFFFFFF
+# A delta names its baseline as a number of ticks back from its own tick, so older baselines need a keyframe
+MAX_BASELINE_AGE = 0xFF
+
+# Struct layout and field names for every fixed-layout message. The field names are only used by the
+# JSON codec, so both codecs carry exactly the same values.
+LAYOUTS = {
+    READY: (struct.Struct("!"), ()),
+    GAME_START: (struct.Struct("!"), ()),
+    # Server -> client: the whole world after tick, plus the EVENT_* bits raised during it
+    SNAPSHOT: (struct.Struct("!I" + STATE_FORMATS + "B"), ("tick",) + STATE_FIELDS + ("events",)),
+    SCORE_UPDATE: (struct.Struct("!BB"), ("player1_score", "player2_score")),
+    # Client -> server: the newest snapshot tick the client has reconstructed
+    ACK: (struct.Struct("!I"), ("tick",)),
+    # Client -> server over UDP: binds the datagram address to the player the token was issued to
+    UDP_HELLO: (struct.Struct("!Q"), ("token",)),
+    # Round trip measurement: the server echoes the client's timestamp back in a PONG
+    PING: (struct.Struct("!d"), ("sent",)),
+    PONG: (struct.Struct("!d"), ("sent",)),
+    # Server -> client: states now come at most every interval ticks, so inputs may be batched to match
+    RATE: (struct.Struct("!B"), ("interval",)),
+}
+
+# DELTA payload: tick, ticks back to the baseline, EVENT_* bits, mask of changed fields, then one value
+# per set bit of the mask in STATE_FIELDS order
+DELTA_HEADER = struct.Struct("!IBBH")
+_FIELD_BITS = tuple(1 << i for i in range(len(STATE_FIELDS)))
+
+# Header and payload of each fixed-layout message as one struct, so a binary frame takes a single pack
+_FRAME_STRUCTS = {msgType: struct.Struct(HEADER.format + layout.format[1:]) for msgType, (layout, _) in LAYOUTS.items()}
+
+class _DeltaLayout:
+    # Everything needed to encode or decode a binary delta carrying one particular set of fields
+    __slots__ = ("indices", "frame", "fields", "values")
+
+    def __init__(self, mask: int) -> None:
+        self.indices = tuple(i for i in range(len(STATE_FIELDS)) if mask & _FIELD_BITS[i])
+        fieldFormats = "".join(STATE_FORMATS[i] for i in self.indices)
+        self.frame = struct.Struct(HEADER.format + DELTA_HEADER.format[1:] + fieldFormats)
+        self.values = struct.Struct("!" + fieldFormats)
+        if len(self.indices) > 1:
+            self.fields = operator.itemgetter(*self.indices)
+        elif self.indices:
+            index, = self.indices
+            self.fields = lambda state: (state[index],)
+        else:
+            self.fields = lambda state: ()
+
+# By field mask, built on first use; there are only 2**len(STATE_FIELDS) of them
+_deltaLayouts = {}
+
+def _deltaLayout(mask: int) -> _DeltaLayout:
+    layout = _deltaLayouts.get(mask)
+    if layout is None:
+        layout = _deltaLayouts[mask] = _DeltaLayout(mask)
+    return layout
+
+class ProtocolError(Exception):
+    pass
+
+def _frame(msgType: int, payload: bytes) -> bytes:
+    if len(payload) > MAX_PAYLOAD:
+        raise ProtocolError(f"payload of {len(payload)} bytes is too large for message type {msgType}")
+    return HEADER.pack(len(payload), PROTOCOL_VERSION, msgType) + payload
+
+def encode(msgType: int, values: tuple = (), codec: str = CODEC_BINARY) -> bytes:
+    # Builds a complete frame for a fixed-layout message
+    layout, names = LAYOUTS[msgType]
+    if codec == CODEC_JSON:
+        return _frame(msgType, json.dumps(dict(zip(names, values))).encode('utf-8'))
+    return _FRAME_STRUCTS[msgType].pack(layout.size, PROTOCOL_VERSION, msgType, *values)
+
+def decode(msgType: int, payload: bytes, codec: str = CODEC_BINARY) -> tuple:
+    # Returns the values of a fixed-layout message as a tuple, in layout order
+    try:
+        layout, names = LAYOUTS[msgType]
+    except KeyError:
+        raise ProtocolError(f"unknown message type {msgType}") from None
+    try:
+        if codec == CODEC_JSON:
+            message = json.loads(payload)
+            return tuple(message[name] for name in names)
+        return layout.unpack(payload)
+    except (struct.error, ValueError, KeyError) as e:
+        raise ProtocolError(f"malformed payload for message type {msgType}: {e}") from None
+
+def encodeJson(msgType: int, message: dict) -> bytes:
+    # Builds a frame whose payload is a JSON object (used for the handshake)
+    return _frame(msgType, json.dumps(message).encode('utf-8'))
+
+def decodeJson(payload: bytes) -> dict:
+    try:
+        message = json.loads(payload)
+    except ValueError as e:
+        raise ProtocolError(f"malformed JSON payload: {e}") from None
+    if not isinstance(message, dict):
+        raise ProtocolError("JSON payload is not an object")
+    return message
+
+# INPUT payload (client -> server): the sequence number of the first input and how many follow, then one
+# paddle move per input (-1 up, 1 down). Each input moves the paddle for exactly one tick.
+INPUT_HEADER = struct.Struct("!IB")
+MAX_INPUTS = 0xFF
+
+def encodeInputs(firstSeq: int, moves: list, codec: str = CODEC_BINARY) -> bytes:
+    if codec == CODEC_JSON:
+        return _frame(INPUT, json.dumps({"seq": firstSeq, "moves": list(moves)}).encode('utf-8'))
+    return _frame(INPUT, INPUT_HEADER.pack(firstSeq, len(moves)) + struct.pack(f"!{len(moves)}b", *moves))
+
+def decodeInputs(payload: bytes, codec: str = CODEC_BINARY) -> tuple:
+    # Returns (firstSeq, moves)
+    try:
+        if codec == CODEC_JSON:
+            message = json.loads(payload)
+            return message["seq"], [int(move) for move in message["moves"]]
+        firstSeq, count = INPUT_HEADER.unpack_from(payload)
+        return firstSeq, list(struct.unpack_from(f"!{count}b", payload, INPUT_HEADER.size))
+    except (struct.error, ValueError, KeyError, TypeError) as e:
+        raise ProtocolError(f"malformed input: {e}") from None
+
+def deltaMask(base: tuple, state: tuple) -> int:
+    # Bit i is set when STATE_FIELDS[i] differs between the two states
+    mask = 0
+    for bit, old, new in zip(_FIELD_BITS, base, state):
+        if old != new:
+            mask |= bit
+    return mask
+
+def encodeDelta(tick: int, baseTick: int, events: int, mask: int, state: tuple, codec: str = CODEC_BINARY) -> bytes:
+    if codec == CODEC_JSON:
+        fields = {STATE_FIELDS[i]: state[i] for i in range(len(STATE_FIELDS)) if mask & (1 << i)}
+        message = {"tick": tick, "base": baseTick, "events": events, "fields": fields}
+        return _frame(DELTA, json.dumps(message).encode('utf-8'))
+
+    layout = _deltaLayout(mask)
+    frame = layout.frame
+    return frame.pack(frame.size - HEADER.size, PROTOCOL_VERSION, DELTA, tick, tick - baseTick, events, mask, *layout.fields(state))
+
+def decodeDelta(payload: bytes, base: dict, codec: str = CODEC_BINARY) -> tuple:
+    # Returns (tick, baseTick, events, state). base maps ticks to the states the caller still holds; if
+    # the delta's baseline is not among them the returned state is None.
+    try:
+        if codec == CODEC_JSON:
+            message = json.loads(payload)
+            tick, baseTick, events = message["tick"], message["base"], message["events"]
+            baseState = base.get(baseTick)
+            if baseState is None:
+                return tick, baseTick, events, None
+            state = list(baseState)
+            for name, value in message["fields"].items():
+                state[STATE_FIELDS.index(name)] = value
+            return tick, baseTick, events, tuple(state)
+
+        tick, age, events, mask = DELTA_HEADER.unpack_from(payload)
+        baseState = base.get(tick - age)
+        if baseState is None:
+            return tick, tick - age, events, None
+        state = list(baseState)
+        if mask >> len(STATE_FIELDS):
+            raise ProtocolError(f"delta mask {mask:#x} names unknown fields")
+        layout = _deltaLayout(mask)
+        for i, value in zip(layout.indices, layout.values.unpack_from(payload, DELTA_HEADER.size)):
+            state[i] = value
+        return tick, tick - age, events, tuple(state)
+    except (struct.error, ValueError, KeyError, TypeError) as e:
+        raise ProtocolError(f"malformed delta: {e}") from None
+
+class SnapshotTracker:
+    # Client side of delta compression. Keeps the recent states the server may use as baselines and turns
+    # SNAPSHOT and DELTA frames back into full states.
+    def __init__(self, codec: str = CODEC_BINARY) -> None:
+        self.codec = codec
+        self.states = {}
+        self.tick = -1
+        self.state = None
+
+    def receive(self, msgType: int, payload: bytes) -> tuple:
+        # Returns (tick to acknowledge, events). The tick is NO_BASELINE when a delta arrived for a
+        # baseline we no longer have, which asks the server for a keyframe.
+        if msgType == SNAPSHOT:
+            values = decode(msgType, payload, self.codec)
+            tick, state, events = values[0], values[1:-1], values[-1]
+        else:
+            tick, baseTick, events, state = decodeDelta(payload, self.states, self.codec)
+            if state is None:
+                return NO_BASELINE, events
+
+        self.states[tick] = state
+        if tick > self.tick:
+            self.tick = tick
+            self.state = state
+        # Keep a window of baselines; the server never references anything older than it can encode.
+        # Ticks arrive in increasing order, so the oldest entries are at the front of the dict.
+        oldest = self.tick - MAX_BASELINE_AGE
+        while self.states and next(iter(self.states)) < oldest:
+            del self.states[next(iter(self.states))]
+        return tick, events
+
+def _splitFrames(buffer, offset: int, end: int, frames: list) -> int:
+    # Appends every whole frame in buffer[offset:end] to frames as (type, payload) and returns the offset
+    # of the first byte not consumed
+    unpackHeader = HEADER.unpack_from
+    while end - offset >= HEADER.size:
+        length, version, msgType = unpackHeader(buffer, offset)
+        if version != PROTOCOL_VERSION:
+            raise ProtocolError(f"unsupported protocol version {version}")
+        start = offset + HEADER.size
+        if end - start < length:
+            break
+        frames.append((msgType, bytes(buffer[start:start + length])))
+        offset = start + length
+    return offset
+
+class FrameDecoder:
+    # Reassembles frames from a byte stream. TCP may merge or split writes arbitrarily, so bytes are
+    # buffered until a whole frame is available. The buffer is allocated once and reused: readFrom(), or
+    # anything that reads into receiveBuffer(), receives straight into it, and consumed bytes are dropped
+    # by moving the unfinished frame, if any, back to the front. It only grows for a frame that does not fit.
+    __slots__ = ("buffer", "view", "end")
+
+    def __init__(self, size: int = 4096) -> None:
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.end = 0
+
+    def _reserve(self, needed: int) -> None:
+        # Makes room for needed more bytes after the buffered ones
+        if len(self.buffer) - self.end >= needed:
+            return
+        # A bytearray cannot be resized while a memoryview of it exists
+        self.view.release()
+        self.buffer.extend(bytes(max(needed, len(self.buffer))))
+        self.view = memoryview(self.buffer)
+
+    def _frames(self) -> list:
+        frames = []
+        offset = _splitFrames(self.view, 0, self.end, frames)
+        if offset:
+            rest = self.end - offset
+            if rest:
+                self.view[:rest] = self.view[offset:self.end]
+            self.end = rest
+        return frames
+
+    def feed(self, data: bytes) -> list:
+        # Adds received bytes and returns every frame completed by them as (type, payload) pairs
+        size = len(data)
+        self._reserve(size)
+        self.view[self.end:self.end + size] = data
+        self.end += size
+        return self._frames()
+
+    def receiveBuffer(self) -> memoryview:
+        # The free space after the buffered bytes, for a read to fill. Report what it filled with received().
+        self._reserve(1)
+        return self.view[self.end:]
+
+    def received(self, size: int) -> list:
+        # Adds the size bytes just read into receiveBuffer() and returns every frame completed by them
+        self.end += size
+        return self._frames()
+
+    def readFrom(self, sock) -> list:
+        # One recv_into() from a blocking socket straight into the buffer; returns the frames it completed
+        received = sock.recv_into(self.receiveBuffer())
+        if not received:
+            raise ConnectionError("connection closed by server")
+        return self.received(received)
+
+def parseDatagram(data) -> list:
+    # Splits a datagram into its (type, payload) frames. Unlike a stream, a datagram always holds whole
+    # frames, so a truncated one means the datagram is corrupt.
+    frames = []
+    if _splitFrames(data, 0, len(data), frames) != len(data):
+        raise ProtocolError("datagram ends in a partial frame")
+    return frames
+
+def recvFrame(sock, decoder: FrameDecoder, pending: list) -> tuple:
+    # Blocking read of the next frame from a socket. Frames that arrived together with it are kept in
+    # pending for the following calls.
+    while not pending:
+        pending.extend(decoder.readFrom(sock))
+    return pending.pop(0)
@@ -0,0 +1,267 @@
+# Match recordings. The simulation is deterministic, so a match is fully described by the inputs the
+# server queued and the tick at which it queued them; replaying those into a GameWorld reproduces every
+# tick. Keyframes with the complete world every few seconds let a replay start near any tick instead of
+# from the beginning, and let it check that re-simulating still produces what the server saw.
+#
+# File layout, all big-endian:
+#
+#     header    FILE_HEADER
+#     records   RECORD_HEADER + payload, in the order they happened:
+#                 INPUTS    queued after the given tick was stepped: player, then a protocol INPUT payload
+#                 KEYFRAME  the world right after the given tick was stepped
+#     index     INDEX_ENTRY (tick, file offset) per keyframe, in tick order
+#     trailer   TRAILER
+#
+# The index and trailer are written when the recording is closed. A recording cut short, e.g. by a
+# crash, has neither; reading it rebuilds the index by scanning the records.
+import bisect
+import mmap
+import os
+import struct
+import time
+
+from assets.code import protocol
+
+MAGIC = b"PONGREC1"
+INDEX_MAGIC = b"PONGIDX1"
+# Magic, format version, screen size, tick rate, keyframe interval, room id, start time
+FILE_HEADER = struct.Struct("!8sHHHHIId")
+RECORD_HEADER = struct.Struct("!BIH")
+INDEX_ENTRY = struct.Struct("!IQ")
+TRAILER = struct.Struct("!QI8s")
+
+# Record kinds
+INPUTS = 1
+KEYFRAME = 2
+
+PLAYERS = ("player1", "player2")
+# Tick, the protocol state, the newest input seq received from each player and how many inputs each has
+# waiting, followed by that many (seq, move) pairs
+KEYFRAME_HEADER = struct.Struct("!I" + protocol.STATE_FORMATS + "IIHH")
+PENDING_INPUT = struct.Struct("!Ib")
+
+def checkSettings(screenWidth:int, screenHeight:int, tickRate:int, keyframeInterval:int) -> None:
+    # Raises ValueError for settings FILE_HEADER cannot hold or a recorder cannot keyframe with, so a
+    # server can refuse them at startup rather than lose a match when its recording opens
+    for name, value in (("screen width", screenWidth), ("screen height", screenHeight), ("tick rate", tickRate)):
+        if not 0 < value <= 0xFFFF:
+            raise ValueError(f"{name} {value} cannot be recorded, expected 1 to 65535")
+    if not 0 < keyframeInterval <= 0xFFFFFFFF:
+        raise ValueError(f"keyframe interval {keyframeInterval} cannot be recorded, expected 1 to 4294967295")
+
+class MatchRecorder:
+    # Appends one room's match to a file. It only ever writes sequentially through a large buffer, so
+    # recording costs the tick loop a few struct packs and memory copies.
+    def __init__(self, path:str, screenWidth:int, screenHeight:int, tickRate:int, keyframeInterval:int, roomId:int=0) -> None:
+        self.path = path
+        self.keyframeInterval = keyframeInterval
+        self.file = open(path, "wb", buffering=1 << 16)
+        self.file.write(FILE_HEADER.pack(MAGIC, 1, screenWidth, screenHeight, tickRate, keyframeInterval, roomId, time.time()))
+        self.offset = FILE_HEADER.size
+        # (tick, offset) of every keyframe written
+        self.index = []
+
+    def _write(self, kind:int, tick:int, payload:bytes) -> None:
+        self.file.write(RECORD_HEADER.pack(kind, tick, len(payload)))
+        self.file.write(payload)
+        self.offset += RECORD_HEADER.size + len(payload)
+
+    def recordInputs(self, tick:int, playerId:str, firstSeq:int, moves:list) -> None:
+        # tick is the world's tick when the inputs were queued, i.e. the last one stepped before them
+        payload = bytes((PLAYERS.index(playerId),)) + protocol.encodeInputs(firstSeq, moves)[protocol.HEADER.size:]
+        self._write(INPUTS, tick, payload)
+
+    def recordTick(self, world) -> None:
+        # Called after every step (and once before the first); writes a keyframe every keyframeInterval ticks
+        tick = world.tick
+        if tick % self.keyframeInterval == 0:
+            self.index.append((tick, self.offset))
+            self._write(KEYFRAME, tick, encodeKeyframe(world))
+            # Reaches the disk a keyframe at a time, so a server that dies mid-match leaves a recording that
+            # can be replayed up to its last keyframe
+            self.file.flush()
+
+    def close(self, world=None) -> None:
+        # Ends the recording, with a last keyframe for where world stopped if it is not on one already
+        if self.file.closed:
+            return
+        if world is not None and (not self.index or self.index[-1][0] != world.tick):
+            self.index.append((world.tick, self.offset))
+            self._write(KEYFRAME, world.tick, encodeKeyframe(world))
+        indexOffset = self.offset
+        for tick, offset in self.index:
+            self.file.write(INDEX_ENTRY.pack(tick, offset))
+        self.file.write(TRAILER.pack(indexOffset, len(self.index), INDEX_MAGIC))
+        self.file.close()
+
+def encodeKeyframe(world) -> bytes:
+    # Works for a simulation.GameWorld and for a batchSimulation.RoomWorld
+    pending = [world.pendingInputs[playerId] for playerId in PLAYERS]
+    parts = [KEYFRAME_HEADER.pack(world.tick, *world.state(), world.receivedSeq["player1"], world.receivedSeq["player2"],
+                                  len(pending[0]), len(pending[1]))]
+    for inputs in pending:
+        for seq, move in inputs:
+            parts.append(PENDING_INPUT.pack(seq, move))
+    return b"".join(parts)
+
+def loadKeyframe(world, payload) -> None:
+    # Puts a simulation.GameWorld into the state a keyframe describes
+    values = KEYFRAME_HEADER.unpack_from(payload)
+    tick, state, received, counts = values[0], values[1:11], values[11:13], values[13:15]
+    leftY, rightY, ballX, ballY, xVel, yVel, lScore, rScore, applied1, applied2 = state
+    world.tick = tick
+    world.leftPaddle.rect.y = leftY
+    world.rightPaddle.rect.y = rightY
+    world.ball.rect.x, world.ball.rect.y = ballX, ballY
+    world.ball.xVel, world.ball.yVel = xVel, yVel
+    world.lScore, world.rScore = lScore, rScore
+    world.appliedSeq = {"player1": applied1, "player2": applied2}
+    world.receivedSeq = {"player1": received[0], "player2": received[1]}
+    offset = KEYFRAME_HEADER.size
+    for playerId, count in zip(PLAYERS, counts):
+        pending = world.pendingInputs[playerId]
+        pending.clear()
+        for _ in range(count):
+            pending.append(PENDING_INPUT.unpack_from(payload, offset))
+            offset += PENDING_INPUT.size
+
+class RecordingError(Exception):
+    pass
+
+class _IndexColumn:
+    # One column of the on-disk keyframe index read straight from the memory map, so bisecting it
+    # touches only the entries the search visits
+    def __init__(self, data:mmap.mmap, offset:int, count:int, column:int) -> None:
+        self.data = data
+        self.offset = offset
+        self.count = count
+        self.column = column
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, i:int) -> int:
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError("keyframe index out of range")
+        return INDEX_ENTRY.unpack_from(self.data, self.offset + i * INDEX_ENTRY.size)[self.column]
+
+class Recording:
+    # Read access to a recording through a memory map, so seeking costs nothing but the pages touched
+    def __init__(self, path:str) -> None:
+        self.path = path
+        with open(path, "rb") as file:
+            if os.fstat(file.fileno()).st_size < FILE_HEADER.size:
+                raise RecordingError("too short to be a recording")
+            self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.screenWidth, self.screenHeight, self.tickRate, self.keyframeInterval, self.roomId, self.startedAt = FILE_HEADER.unpack_from(self.data)
+        if magic != MAGIC or version != 1:
+            raise RecordingError("not a version 1 pong recording")
+
+        self.end = len(self.data)
+        self.complete = False
+        if self.end >= FILE_HEADER.size + TRAILER.size:
+            indexOffset, count, indexMagic = TRAILER.unpack_from(self.data, self.end - TRAILER.size)
+            if indexMagic == INDEX_MAGIC:
+                self.complete = True
+                self.end = indexOffset
+                self.keyframeTicks = _IndexColumn(self.data, indexOffset, count, 0)
+                self.keyframeOffsets = _IndexColumn(self.data, indexOffset, count, 1)
+        if not self.complete:
+            self._rebuildIndex()
+        if not len(self.keyframeTicks):
+            raise RecordingError("holds no keyframe")
+
+    def _rebuildIndex(self) -> None:
+        self.keyframeTicks = []
+        self.keyframeOffsets = []
+        for offset, kind, tick, _ in self.records(FILE_HEADER.size):
+            if kind == KEYFRAME:
+                self.keyframeTicks.append(tick)
+                self.keyframeOffsets.append(offset)
+
+    def close(self) -> None:
+        self.data.close()
+
+    def __enter__(self) -> "Recording":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def records(self, offset:int):
+        # Yields (offset, kind, tick, payload) from offset on. A record cut off at the end is left out.
+        data, end = self.data, self.end
+        while offset + RECORD_HEADER.size <= end:
+            kind, tick, length = RECORD_HEADER.unpack_from(data, offset)
+            start = offset + RECORD_HEADER.size
+            if start + length > end:
+                return
+            yield offset, kind, tick, data[start:start + length]
+            offset = start + length
+
+    def inputs(self, offset:int):
+        # Yields (tick, playerId, firstSeq, moves) for every input record from offset on
+        for _, kind, tick, payload in self.records(offset):
+            if kind == INPUTS:
+                firstSeq, moves = protocol.decodeInputs(payload[1:])
+                yield tick, PLAYERS[payload[0]], firstSeq, moves
+
+    @property
+    def lastTick(self) -> int:
+        # A closed recording ends on a keyframe. One cut short is only known up to its last record.
+        last = self.keyframeTicks[-1]
+        if not self.complete:
+            for _, _, tick, _ in self.records(self.keyframeOffsets[-1]):
+                last = max(last, tick)
+        return last
+
+    def keyframeBefore(self, tick:int) -> int:
+        # Position in the index of the last keyframe at or before tick, by binary search
+        position = bisect.bisect_right(self.keyframeTicks, tick) - 1
+        if position < 0:
+            raise RecordingError(f"tick {tick} is before the first keyframe at {self.keyframeTicks[0]}")
+        return position
+
+    def newWorld(self):
+        from assets.code.simulation import GameWorld
+        return GameWorld(self.screenWidth, self.screenHeight)
+
+    def seek(self, tick:int, world=None):
+        # A GameWorld as it was right after tick was stepped: loaded from the nearest keyframe, then
+        # re-simulated with the recorded inputs
+        position = self.keyframeBefore(tick)
+        world = world or self.newWorld()
+        offset = self.keyframeOffsets[position]
+        _, _, _, payload = next(self.records(offset))
+        loadKeyframe(world, payload)
+        for recordTick, playerId, firstSeq, moves in self.inputs(offset):
+            if recordTick >= tick:
+                break
+            while world.tick < recordTick:
+                world.step()
+            world.queueInputs(playerId, firstSeq, moves)
+        while world.tick < tick:
+            world.step()
+        return world
+
+    def verify(self) -> tuple:
+        # Re-simulates the whole match from the first keyframe and compares the world with every later
+        # keyframe. Returns (ticks simulated, None) or, at the first difference, (tick, (expected, actual)).
+        world = self.newWorld()
+        records = self.records(self.keyframeOffsets[0])
+        _, _, _, payload = next(records)
+        loadKeyframe(world, payload)
+        for _, kind, tick, payload in records:
+            while world.tick < tick:
+                world.step()
+            if kind == INPUTS:
+                firstSeq, moves = protocol.decodeInputs(payload[1:])
+                world.queueInputs(PLAYERS[payload[0]], firstSeq, moves)
+            elif kind == KEYFRAME:
+                expected = bytes(payload)
+                actual = encodeKeyframe(world)
+                if actual != expected:
+                    return tick, (expected, actual)
+        return world.tick - self.keyframeTicks[0], None
@@ -0,0 +1,99 @@
+# Draws the game with dirty rectangles. The walls and the center line never change, so they are drawn
+# once onto a cached background. Every frame only the places where the ball and the paddles were and
+# now are get restored from that background, redrawn and sent to the display.
+import pygame
+
+BLACK = (0,0,0)
+WHITE = (255,255,255)
+
+class Renderer:
+    def __init__(self, screen:pygame.Surface, scoreFont:pygame.font.Font, winFont:pygame.font.Font, color=WHITE) -> None:
+        self.screen = screen
+        self.scoreFont = scoreFont
+        self.winFont = winFont
+        self.color = color
+
+        screenWidth, screenHeight = screen.get_size()
+        self.background = pygame.Surface((screenWidth, screenHeight)).convert(screen)
+        self.background.fill(BLACK)
+        pygame.draw.rect(self.background, color, pygame.Rect(-10, 0, screenWidth+20, 10))
+        pygame.draw.rect(self.background, color, pygame.Rect(-10, screenHeight-10, screenWidth+20, 10))
+        for i in range(0, screenHeight, 10):
+            pygame.draw.rect(self.background, color, pygame.Rect((screenWidth/2)-5, i, 5, 5))
+
+        # Rendered text by content; there are only a few dozen possible scores in a game
+        self.textCache = {}
+        self.scoreText = None
+        self.scoreRect = pygame.Rect(0,0,0,0)
+        self.messageText = None
+        self.messageRect = pygame.Rect(0,0,0,0)
+        # Where the moving objects were drawn last frame
+        self.lastRects = []
+
+        screen.blit(self.background, (0,0))
+        pygame.display.flip()
+
+    def _text(self, text:str, font:pygame.font.Font, background=None) -> pygame.Surface:
+        key = (text, font, background)
+        surface = self.textCache.get(key)
+        if surface is None:
+            surface = font.render(text, False, self.color, background)
+            self.textCache[key] = surface
+        return surface
+
+    def _placeText(self, surface:pygame.Surface, center:tuple) -> pygame.Rect:
+        rect = surface.get_rect()
+        rect.center = center
+        return rect
+
+    def draw(self, rects:list, lScore:int, rScore:int, message:str=None) -> None:
+        # rects are the moving objects in their positions for this frame, in the same order every frame so
+        # each can be matched with where it was last frame. message is drawn in the middle of the
+        # screen, e.g. the win message.
+        screen = self.screen
+        background = self.background
+        screenWidth, screenHeight = screen.get_size()
+
+        # Erase the moving objects from last frame
+        erased = self.lastRects
+        for rect in erased:
+            screen.blit(background, rect, rect)
+
+        dirty = []
+        scoreText = f"{lScore}   {rScore}"
+        scoreChanged = scoreText != self.scoreText
+        messageChanged = message != self.messageText
+        if scoreChanged:
+            screen.blit(background, self.scoreRect, self.scoreRect)
+            dirty.append(self.scoreRect)
+            self.scoreText = scoreText
+            self.scoreRect = self._placeText(self._text(scoreText, self.scoreFont), ((screenWidth/2)+5, 50))
+        if messageChanged:
+            screen.blit(background, self.messageRect, self.messageRect)
+            dirty.append(self.messageRect)
+            self.messageText = message
+            self.messageRect = pygame.Rect(0,0,0,0)
+            if message:
+                self.messageRect = self._placeText(self._text(message, self.winFont, BLACK), ((screenWidth/2), screenHeight/2))
+
+        # Text only has to be drawn again when it changed or an erased object had been drawn over it
+        scoreRect = self.scoreRect
+        if scoreChanged or scoreRect.collidelist(erased) != -1 or scoreRect.collidelist(rects) != -1:
+            screen.blit(self._text(scoreText, self.scoreFont), scoreRect)
+            dirty.append(scoreRect)
+        messageRect = self.messageRect
+        if message and (messageChanged or messageRect.collidelist(erased) != -1 or messageRect.collidelist(rects) != -1):
+            screen.blit(self._text(message, self.winFont, BLACK), messageRect)
+            dirty.append(messageRect)
+
+        current = []
+        for i, rect in enumerate(rects):
+            rect = pygame.Rect(rect)
+            pygame.draw.rect(screen, self.color, rect)
+            current.append(rect)
+            # Each object only needs the area covering both where it was and where it is now
+            dirty.append(rect.union(erased[i]) if i < len(erased) else rect)
+        dirty.extend(erased[len(rects):])
+
+        self.lastRects = current
+        pygame.display.update(dirty)
@@ -0,0 +1,131 @@
+# The authoritative game simulation. The server steps one GameWorld per room at a fixed tick rate and
+# clients only render what it produces. The rules are the ones the client used to run in playGame.
+import collections
+
+from assets.code.helperCode import Ball, Paddle, Rect
+from assets.code.protocol import EVENT_BOUNCE, EVENT_POINT
+
+PADDLE_WIDTH = 10
+PADDLE_HEIGHT = 50
+# helperCode.Paddle.speed, for the code that moves paddles without a Paddle (BatchWorld, the bots)
+PADDLE_SPEED = 5
+BALL_SIZE = 5
+# A player wins once their score goes past this
+MAX_SCORE = 4
+
+# Paddle directions as they travel on the wire
+UP = -1
+STILL = 0
+DOWN = 1
+MOVING = {UP: "up", STILL: "", DOWN: "down"}
+
+# Every input moves a paddle for one tick. When more than this many are waiting (the client runs ahead of
+# the server clock) the extra ones are applied in the same tick so input latency cannot build up.
+INPUT_BACKLOG = 3
+
+def movePaddle(paddle:Paddle, screenHeight:int) -> None:
+    # Shared with the client, which predicts its own paddle with exactly these rules
+    if paddle.moving == "down":
+        if paddle.rect.bottom < screenHeight-10:
+            paddle.rect.y += paddle.speed
+    elif paddle.moving == "up":
+        if paddle.rect.top > 10:
+            paddle.rect.y -= paddle.speed
+
+class GameWorld:
+    __slots__ = ("screenWidth", "screenHeight", "topWall", "bottomWall", "leftPaddle", "rightPaddle", "ball",
+                 "lScore", "rScore", "tick", "pendingInputs", "receivedSeq", "appliedSeq")
+
+    def __init__(self, screenWidth:int, screenHeight:int) -> None:
+        self.screenWidth = screenWidth
+        self.screenHeight = screenHeight
+        self.topWall = Rect(-10, 0, screenWidth+20, 10)
+        self.bottomWall = Rect(-10, screenHeight-10, screenWidth+20, 10)
+
+        paddleStartPosY = (screenHeight//2)-(PADDLE_HEIGHT//2)
+        self.leftPaddle = Paddle(Rect(10, paddleStartPosY, PADDLE_WIDTH, PADDLE_HEIGHT))
+        self.rightPaddle = Paddle(Rect(screenWidth-20, paddleStartPosY, PADDLE_WIDTH, PADDLE_HEIGHT))
+        self.ball = Ball(Rect(screenWidth//2, screenHeight//2, BALL_SIZE, BALL_SIZE), -5, 0)
+
+        self.lScore = 0
+        self.rScore = 0
+        self.tick = 0
+
+        # (seq, move) inputs received but not applied yet, and the newest seq received and applied
+        self.pendingInputs = {"player1": collections.deque(), "player2": collections.deque()}
+        self.receivedSeq = {"player1": 0, "player2": 0}
+        self.appliedSeq = {"player1": 0, "player2": 0}
+
+    def paddle(self, playerId:str) -> Paddle:
+        return self.leftPaddle if playerId == "player1" else self.rightPaddle
+
+    def queueInputs(self, playerId:str, firstSeq:int, moves:list) -> None:
+        # Inputs may be repeated across messages, so anything at or below the newest seq seen is dropped
+        pending = self.pendingInputs[playerId]
+        received = self.receivedSeq[playerId]
+        for seq, move in enumerate(moves, firstSeq):
+            if seq > received:
+                pending.append((seq, move))
+                received = seq
+        self.receivedSeq[playerId] = received
+
+    def applyInputs(self, playerId:str) -> None:
+        pending = self.pendingInputs[playerId]
+        if not pending:
+            return
+        paddle = self.paddle(playerId)
+        for _ in range(max(1, len(pending) - INPUT_BACKLOG + 1)):
+            seq, move = pending.popleft()
+            paddle.moving = MOVING.get(move, "")
+            movePaddle(paddle, self.screenHeight)
+            self.appliedSeq[playerId] = seq
+        paddle.moving = ""
+
+    def isOver(self) -> bool:
+        return self.lScore > MAX_SCORE or self.rScore > MAX_SCORE
+
+    def step(self) -> int:
+        # Advances the game by one tick and returns a mask of the protocol EVENT_* bits that happened during it
+        self.tick += 1
+        events = 0
+
+        self.applyInputs("player1")
+        self.applyInputs("player2")
+
+        if self.isOver():
+            return events
+
+        ball = self.ball
+        ball.updatePos()
+
+        # If the ball makes it past the edge of the screen, update score, etc.
+        if ball.rect.x > self.screenWidth:
+            self.lScore += 1
+            events |= EVENT_POINT
+            ball.reset(nowGoing="left")
+        elif ball.rect.x < 0:
+            self.rScore += 1
+            events |= EVENT_POINT
+            ball.reset(nowGoing="right")
+
+        # If the ball hits a paddle
+        if ball.rect.colliderect(self.leftPaddle.rect):
+            events |= EVENT_BOUNCE
+            ball.hitPaddle(self.leftPaddle.rect.centery)
+        elif ball.rect.colliderect(self.rightPaddle.rect):
+            events |= EVENT_BOUNCE
+            ball.hitPaddle(self.rightPaddle.rect.centery)
+
+        # If the ball hits a wall
+        if ball.rect.colliderect(self.topWall) or ball.rect.colliderect(self.bottomWall):
+            events |= EVENT_BOUNCE
+            ball.hitWall()
+
+        return events
+
+    def state(self) -> tuple:
+        # The world state in protocol.STATE_FIELDS order
+        ball = self.ball
+        return (self.leftPaddle.rect.y, self.rightPaddle.rect.y, ball.rect.x, ball.rect.y,
+                ball.xVel, ball.yVel, self.lScore, self.rScore,
+                self.appliedSeq["player1"], self.appliedSeq["player2"])
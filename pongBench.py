@@ -0,0 +1,641 @@
+# =================================================================================================
+# Date:                     2026 October 18
+# Purpose:                  benchmarks for the server's hot paths
+# Misc:                     Released under GNU GPL v3.0
+# =================================================================================================
+#
+# Most benchmarks run the code in process, without sockets, so the numbers show the cost of the code
+# itself rather than of the network; loopback runs a real server against bots for the whole path, e.g.
+#
+#     python pongBench.py gc --rooms 500 --ticks 3000
+#     python pongBench.py login --users 500
+#     python pongBench.py physics
+#     python pongBench.py codec
+#     python pongBench.py render
+#     python pongBench.py loopback --rooms 20
+#     python pongBench.py startup
+#
+# suite runs startup, physics, codec, render and loopback at sizes that take about half a minute. Any report can
+# be saved as a baseline and a later run compared with it; the comparison lists every rate (*_per_s,
+# higher is better) and time (*_ms, lower is better) that moved, and the exit status is 1 if any got
+# worse by more than the tolerance:
+#
+#     python pongBench.py --json --save-baseline baseline.json suite       on the commit to compare with
+#     python pongBench.py --json --baseline baseline.json suite            on the change
+#
+# Baselines are only comparable on the same machine.
+
+import argparse
+import asyncio
+import collections
+import gc
+import json
+import math
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import urllib.request
+
+import pongBot
+import pongServer
+from assets.code import protocol
+from assets.code.auth import Authenticator, SessionCache, SqliteCredentialStore, clientDigest
+from assets.code.simulation import BALL_SIZE, DOWN, PADDLE_HEIGHT, PADDLE_WIDTH, STILL, UP, GameWorld
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+class _SinkTransport:
+    def get_write_buffer_size(self) -> int:
+        return 0
+
+class _SinkWriter:
+    # Stands in for a player's asyncio.StreamWriter and throws away what is written
+    def __init__(self) -> None:
+        self.transport = _SinkTransport()
+        self.written = 0
+
+    def write(self, data: bytes) -> None:
+        self.written += len(data)
+
+    def is_closing(self) -> bool:
+        return False
+
+    def close(self) -> None:
+        pass
+
+def _makeRooms(config: pongServer.ServerConfig, rooms: int) -> tuple:
+    matchmaker = pongServer.Matchmaker(config)
+    metrics = pongServer.ServerMetrics(matchmaker)
+    connections = []
+    for _ in range(2 * rooms):
+        connection = pongServer.PlayerConnection(_SinkWriter(), metrics)
+        connection.room, connection.player_id = matchmaker.join(connection)
+        connections.append(connection)
+    for room in matchmaker.rooms.values():
+        room.start()
+    return matchmaker, connections
+
+def _runTicks(rooms: int, ticks: int, warmup: int, ackLag: int, seed: int, traceMemory: bool) -> tuple:
+    config = pongServer.ServerConfig()
+    matchmaker, connections = _makeRooms(config, rooms)
+
+    # Client messages are encoded up front so only the server's side of the work is measured
+    rng = random.Random(seed)
+    inputs = [[protocol.encodeInputs(tick, [rng.choice((UP, STILL, DOWN))])[protocol.HEADER.size:]
+               for tick in range(1, warmup + ticks + 1)] for _ in range(4)]
+    acks = [protocol.encode(protocol.ACK, (max(tick - ackLag, 0),))[protocol.HEADER.size:] for tick in range(warmup + ticks + 1)]
+
+    pauses = []
+    started = [0.0]
+    def onGc(phase: str, info: dict) -> None:
+        if phase == "start":
+            started[0] = time.perf_counter()
+        else:
+            pauses.append((info["generation"], time.perf_counter() - started[0]))
+
+    tickTimes = []
+    # Largest amount of memory allocated at once during a tick, above what was live when it began
+    peaks = []
+    gc.collect()
+    gc.callbacks.append(onGc)
+    if traceMemory:
+        tracemalloc.start()
+    try:
+        for tick in range(1, warmup + ticks + 1):
+            if tick == warmup + 1:
+                pauses.clear()
+                tickTimes.clear()
+                peaks.clear()
+            if traceMemory:
+                tracemalloc.reset_peak()
+                before = tracemalloc.get_traced_memory()[0]
+            begin = time.perf_counter()
+            for i, connection in enumerate(connections):
+                connection.handle_state_message(protocol.INPUT, inputs[i % 4][tick - 1])
+                connection.handle_state_message(protocol.ACK, acks[tick - 1])
+            for room in matchmaker.rooms.values():
+                room.tick()
+            tickTimes.append(time.perf_counter() - begin)
+            if traceMemory:
+                peaks.append(tracemalloc.get_traced_memory()[1] - before)
+    finally:
+        gc.callbacks.remove(onGc)
+        if traceMemory:
+            tracemalloc.stop()
+    return tickTimes, pauses, peaks
+
+def benchGc(rooms: int, ticks: int, warmup: int = 200, ackLag: int = 6, seed: int = 1) -> dict:
+    # Steps every room as tick_loop does and feeds each player the input and acknowledgement frames a
+    # client would send, acknowledging ackLag ticks late as a client about 100 ms away would. Reports the
+    # tick time, how often the garbage collector ran and how long it paused, and in a second run under
+    # tracemalloc, the most memory a tick had allocated at once.
+    tickTimes, pauses, _ = _runTicks(rooms, ticks, warmup, ackLag, seed, traceMemory=False)
+    _, _, peaks = _runTicks(rooms, min(ticks, 500), warmup, ackLag, seed, traceMemory=True)
+
+    tickTimes.sort()
+    byGeneration = [[pause for generation, pause in pauses if generation == g] for g in range(3)]
+    return {
+        "rooms": rooms,
+        "ticks": ticks,
+        "tick_ms": {"mean": sum(tickTimes) / len(tickTimes) * 1000, "p99": tickTimes[int(len(tickTimes) * 0.99)] * 1000},
+        "collections_per_1000_ticks": [len(paused) * 1000 / ticks for paused in byGeneration],
+        "gc_pause_ms": {"total": sum(pause for _, pause in pauses) * 1000,
+                        "max": max((pause for _, pause in pauses), default=0) * 1000},
+        "tick_peak_kib": {"mean": sum(peaks) / len(peaks) / 1024, "max": max(peaks) / 1024},
+    }
+
+async def _loginHerd(auth: Authenticator, metrics: pongServer.ServerMetrics, requests: list) -> dict:
+    # Sends every handshake request at once, as players all reconnecting after an outage would, and
+    # measures how long each took and how late a 1 ms timer on the event loop fired meanwhile
+    loop = asyncio.get_running_loop()
+    stalls = []
+    done = asyncio.Event()
+
+    async def watchLoop() -> None:
+        while not done.is_set():
+            before = loop.time()
+            await asyncio.sleep(0.001)
+            stalls.append(loop.time() - before - 0.001)
+
+    async def handshake(request: dict) -> tuple:
+        started = time.perf_counter()
+        token = await pongServer.authenticate(request, auth, metrics)
+        return token, time.perf_counter() - started
+
+    watcher = asyncio.create_task(watchLoop())
+    started = time.perf_counter()
+    results = await asyncio.gather(*(handshake(request) for request in requests))
+    elapsed = time.perf_counter() - started
+    done.set()
+    await watcher
+
+    latencies = sorted(latency for _, latency in results)
+    return {
+        "logins": len(requests),
+        "accepted": sum(token is not None for token, _ in results),
+        "logins_per_s": len(requests) / elapsed,
+        "latency_ms": {"p50": latencies[len(latencies) // 2] * 1000, "p99": latencies[int(len(latencies) * 0.99)] * 1000},
+        "loop_stall_ms": {"max": max(stalls, default=0) * 1000},
+        "tokens": [token for token, _ in results],
+    }
+
+def benchLogin(users: int, iterations: int = 200_000, workers: int = 4) -> dict:
+    # Logs users in from a fresh SQLite store all at once, then has them all reconnect at once with the
+    # session tokens they got, then once more with their passwords as if the tokens had been lost. The
+    # loop stall shows whether the hashing stayed off the event loop.
+    with tempfile.TemporaryDirectory() as directory:
+        store = SqliteCredentialStore(os.path.join(directory, "users.db"))
+        passwords = [clientDigest(f"password{i}") for i in range(users)]
+        started = time.perf_counter()
+        for i, password in enumerate(passwords):
+            store.addUser(f"user{i}", password, iterations)
+        hashSeconds = (time.perf_counter() - started) / users
+
+        auth = Authenticator(store, workers, SessionCache(users, 3600))
+        metrics = pongServer.ServerMetrics(pongServer.Matchmaker(pongServer.ServerConfig()))
+        logins = [{"username": f"user{i}", "password": password} for i, password in enumerate(passwords)]
+        try:
+            cold = asyncio.run(_loginHerd(auth, metrics, logins))
+            resumed = asyncio.run(_loginHerd(auth, metrics, [{"session": token} for token in cold.pop("tokens")]))
+            herd = asyncio.run(_loginHerd(auth, metrics, logins))
+        finally:
+            auth.close()
+    resumed.pop("tokens")
+    herd.pop("tokens")
+    return {"users": users, "iterations": iterations, "workers": workers, "hash_ms": hashSeconds * 1000,
+            "password": cold, "session": resumed, "password_again": herd}
+
+def _bestRate(work, operations: int, repeats: int = 5) -> float:
+    # Operations per second of the fastest of repeats runs of work(), which performs operations of them.
+    # The fastest, since every slower run was slowed by something other than the code.
+    best = float("inf")
+    for _ in range(repeats):
+        started = time.perf_counter()
+        work()
+        best = min(best, time.perf_counter() - started)
+    return operations / best
+
+def _playedStates(ticks: int, seed: int) -> list:
+    # (tick, state) after every tick of a match between two random players
+    rng = random.Random(seed)
+    config = pongServer.ServerConfig()
+    world = GameWorld(config.x_res, config.y_res)
+    states = []
+    for tick in range(1, ticks + 1):
+        for playerId in ("player1", "player2"):
+            world.queueInputs(playerId, tick, [rng.choice((UP, STILL, DOWN))])
+        world.step()
+        states.append((world.tick, world.state()))
+    return states
+
+def benchPhysics(balls: int = 100, rooms: int = 100, ticks: int = 1000, seed: int = 1) -> dict:
+    # Ball movement and collisions on their own, as helperCode.Ball and Rect do them; whole GameWorld
+    # ticks with an input for each player; and, when numpy is installed, the same rooms stepped together
+    # by the batch simulation
+    from assets.code.helperCode import Ball, Rect
+
+    config = pongServer.ServerConfig()
+    width, height = config.x_res, config.y_res
+    world = GameWorld(width, height)
+    walls = (world.topWall, world.bottomWall)
+    paddles = (world.leftPaddle.rect, world.rightPaddle.rect)
+    rng = random.Random(seed)
+    ballList = [Ball(Rect(width // 2, rng.randrange(20, height - 20), BALL_SIZE, BALL_SIZE),
+                     rng.choice((-5, 5)), rng.randrange(-5, 6)) for _ in range(balls)]
+
+    def stepBalls() -> None:
+        for _ in range(ticks):
+            for ball in ballList:
+                ball.updatePos()
+                rect = ball.rect
+                if rect.x > width or rect.x < 0:
+                    ball.reset("left" if rect.x > width else "right")
+                for paddle in paddles:
+                    if rect.colliderect(paddle):
+                        ball.hitPaddle(paddle.centery)
+                        break
+                if rect.collidelist(walls) != -1:
+                    ball.hitWall()
+
+    moves = [[rng.choice((UP, STILL, DOWN)) for _ in range(ticks)] for _ in range(2)]
+    def stepWorlds() -> None:
+        worlds = [GameWorld(width, height) for _ in range(rooms)]
+        for tick in range(ticks):
+            for world in worlds:
+                world.queueInputs("player1", tick + 1, [moves[0][tick]])
+                world.queueInputs("player2", tick + 1, [moves[1][tick]])
+                world.step()
+
+    report = {
+        "balls": balls,
+        "rooms": rooms,
+        "ticks": ticks,
+        "ball_steps_per_s": _bestRate(stepBalls, balls * ticks),
+        "world_ticks_per_s": _bestRate(stepWorlds, rooms * ticks),
+    }
+    try:
+        from assets.code.batchSimulation import BatchWorld
+    except ImportError:
+        return report
+
+    def stepBatch() -> None:
+        batch = BatchWorld(width, height, rooms)
+        worlds = [batch.add() for _ in range(rooms)]
+        for world in worlds:
+            batch.start(world)
+        for tick in range(ticks):
+            for world in worlds:
+                world.queueInputs("player1", tick + 1, [moves[0][tick]])
+                world.queueInputs("player2", tick + 1, [moves[1][tick]])
+            batch.step()
+    report["batch_world_ticks_per_s"] = _bestRate(stepBatch, rooms * ticks)
+    return report
+
+def benchCodec(messages: int = 20000, seed: int = 1) -> dict:
+    # Encoding and decoding, per codec, of the messages every tick carries: an input each way, a state as
+    # a keyframe and as a delta, plus the game start signal, and splitting a stream of them into frames
+    states = _playedStates(messages + 1, seed)
+    moves = random.Random(seed).choices((UP, DOWN), k=messages)
+    report = {"messages": messages}
+    for codec in (protocol.CODEC_BINARY, protocol.CODEC_JSON):
+        start = [protocol.encode(protocol.GAME_START, (), codec)]
+        inputs = [protocol.encodeInputs(seq, [move], codec) for seq, move in enumerate(moves, 1)]
+        snapshots = [protocol.encode(protocol.SNAPSHOT, (tick,) + state + (0,), codec) for tick, state in states[1:]]
+        masks = [protocol.deltaMask(old, new) for (_, old), (_, new) in zip(states, states[1:])]
+        deltas = [protocol.encodeDelta(tick, tick - 1, 0, mask, state, codec) for (tick, state), mask in zip(states[1:], masks)]
+        baselines = [{tick: state} for tick, state in states]
+        header = protocol.HEADER.size
+
+        def encodeStart() -> None:
+            for _ in range(messages):
+                protocol.encode(protocol.GAME_START, (), codec)
+
+        def decodeStart() -> None:
+            payload = start[0][header:]
+            for _ in range(messages):
+                protocol.decode(protocol.GAME_START, payload, codec)
+
+        def encodeInput() -> None:
+            for seq, move in enumerate(moves, 1):
+                protocol.encodeInputs(seq, [move], codec)
+
+        def decodeInput() -> None:
+            for frame in inputs:
+                protocol.decodeInputs(frame[header:], codec)
+
+        def encodeSnapshot() -> None:
+            for tick, state in states[1:]:
+                protocol.encode(protocol.SNAPSHOT, (tick,) + state + (0,), codec)
+
+        def decodeSnapshot() -> None:
+            for frame in snapshots:
+                protocol.decode(protocol.SNAPSHOT, frame[header:], codec)
+
+        def encodeDelta() -> None:
+            # As the server does it: find the changed fields, then encode them
+            for (_, old), (tick, state) in zip(states, states[1:]):
+                protocol.encodeDelta(tick, tick - 1, 0, protocol.deltaMask(old, state), state, codec)
+
+        def decodeDelta() -> None:
+            for frame, base in zip(deltas, baselines):
+                protocol.decodeDelta(frame[header:], base, codec)
+
+        stream = b"".join(frame for pair in zip(inputs, deltas) for frame in pair)
+        def splitFrames() -> None:
+            decoder = protocol.FrameDecoder()
+            for offset in range(0, len(stream), 4096):
+                decoder.feed(stream[offset:offset + 4096])
+
+        report[codec] = {
+            "game_start_encode_per_s": _bestRate(encodeStart, messages),
+            "game_start_decode_per_s": _bestRate(decodeStart, messages),
+            "input_encode_per_s": _bestRate(encodeInput, messages),
+            "input_decode_per_s": _bestRate(decodeInput, messages),
+            "snapshot_encode_per_s": _bestRate(encodeSnapshot, messages),
+            "snapshot_decode_per_s": _bestRate(decodeSnapshot, messages),
+            "delta_encode_per_s": _bestRate(encodeDelta, messages),
+            "delta_decode_per_s": _bestRate(decodeDelta, messages),
+            "frame_split_per_s": _bestRate(splitFrames, 2 * messages),
+            "delta_bytes_mean": sum(map(len, deltas)) / messages,
+        }
+    return report
+
+def benchRender(frames: int = 2000, seed: int = 1) -> dict:
+    # playGame's drawing with the SDL dummy video driver, so it runs without a display: interpolate the
+    # state to show from the buffered ones, then draw it with the Renderer. Only the CPU side of drawing
+    # is measured; nothing reaches a screen.
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+    # pygame greets stdout on import, which would corrupt --json output
+    os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+    import pygame
+    from assets.code.prediction import SnapshotInterpolator
+    from assets.code.renderer import Renderer
+
+    config = pongServer.ServerConfig()
+    pygame.init()
+    try:
+        screen = pygame.display.set_mode((config.x_res, config.y_res))
+        fonts = os.path.join(ROOT, "assets", "fonts")
+        renderer = Renderer(screen, pygame.font.Font(os.path.join(fonts, "pong-score.ttf"), 32),
+                            pygame.font.Font(os.path.join(fonts, "visitor.ttf"), 48))
+        states = _playedStates(frames, seed)
+        interpolator = SnapshotInterpolator(config.tick_rate, 0.1)
+        history = collections.deque(maxlen=64)
+        leftPaddle = pygame.Rect(10, 0, PADDLE_WIDTH, PADDLE_HEIGHT)
+        rightPaddle = pygame.Rect(config.x_res - 20, 0, PADDLE_WIDTH, PADDLE_HEIGHT)
+        ball = pygame.Rect(0, 0, BALL_SIZE, BALL_SIZE)
+
+        frameTimes = []
+        for frame, (tick, state) in enumerate(states):
+            # States arrive on time and frames are drawn at the tick rate, on a clock of their own
+            now = frame / config.tick_rate
+            history.append((now, tick, state))
+            begin = time.perf_counter()
+            shown = interpolator.sample(history, now)
+            leftPaddle.y, rightPaddle.y, ball.x, ball.y = shown[0], shown[1], shown[2], shown[3]
+            renderer.draw([leftPaddle, rightPaddle, ball], shown[6], shown[7])
+            frameTimes.append(time.perf_counter() - begin)
+    finally:
+        pygame.quit()
+
+    frameTimes.sort()
+    return {
+        "frames": frames,
+        "frames_per_s": len(frameTimes) / sum(frameTimes),
+        "frame_ms": {"p50": frameTimes[len(frameTimes) // 2] * 1000, "p99": frameTimes[int(len(frameTimes) * 0.99)] * 1000},
+    }
+
+def _freePorts(count: int) -> list:
+    sockets = [socket.socket() for _ in range(count)]
+    try:
+        for sock in sockets:
+            sock.bind(("127.0.0.1", 0))
+        return [sock.getsockname()[1] for sock in sockets]
+    finally:
+        for sock in sockets:
+            sock.close()
+
+def _scrape(port: int, timeout: float = 10) -> dict:
+    # The server's metrics as {line name with labels: value}, waiting for the endpoint to come up
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=1) as response:
+                text = response.read().decode()
+            break
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+    values = {}
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            name, _, value = line.rpartition(" ")
+            values[name] = float(value)
+    return values
+
+def _tickTimes(before: dict, after: dict) -> dict:
+    # Mean tick time and the histogram bucket holding the 99th percentile, between two scrapes
+    count = after["pong_tick_seconds_count"] - before["pong_tick_seconds_count"]
+    total = after["pong_tick_seconds_sum"] - before["pong_tick_seconds_sum"]
+    prefix = 'pong_tick_seconds_bucket{le="'
+    buckets = sorted((float(name[len(prefix):-2]), after[name] - before.get(name, 0)) for name in after if name.startswith(prefix))
+    p99 = next((bound for bound, seen in buckets if seen >= 0.99 * count), float("inf"))
+    return {"ticks": count, "tick_ms": {"mean": total / count * 1000 if count else float("nan"), "p99_bound": p99 * 1000}}
+
+def benchLoopback(rooms: int = 10, duration: float = 5, transport: str = "tcp") -> dict:
+    # A real server process with rooms full of pongBot bots playing over loopback. The tick times come
+    # from the server's own metrics; the round trips and state rate from the bots. Bots and server share
+    # the machine, so on few cores the bots' work shows up in the tick times too.
+    port, udpPort, metricsPort = _freePorts(3)
+    server = subprocess.Popen([sys.executable, os.path.join(ROOT, "pongServer.py"), "--host", "127.0.0.1", "--port", str(port),
+                               "--udp-port", str(udpPort), "--metrics-port", str(metricsPort), "--transport", transport],
+                              cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        before = _scrape(metricsPort)
+        started = time.perf_counter()
+        results = asyncio.run(pongBot.runLoad("127.0.0.1", port, 2 * rooms, duration, 0, "track", protocol.CODEC_BINARY))
+        elapsed = time.perf_counter() - started
+        after = _scrape(metricsPort)
+    finally:
+        server.terminate()
+        server.wait()
+    bots = pongBot.summarize(results, elapsed)
+    report = {"rooms": rooms, "duration_s": duration, "transport": transport, "connected": bots["connected"], "errors": bots["errors"]}
+    report.update(_tickTimes(before, after))
+    report["states_received_per_s"] = bots["states_received"] / duration
+    report["rtt_ms"] = {"p50": bots["rtt_ms"]["p50"], "p99": bots["rtt_ms"]["p99"]}
+    report["tick_jitter_ms"] = bots["tick_jitter_ms"]
+    return report
+
+# Entry points whose start-up time is measured, and pygame itself for comparison
+STARTUP_MODULES = ("pongServer", "pongBot", "pongReplay", "pongClient", "pygame")
+# Modules an entry point should only load when it really needs them
+HEAVY_MODULES = ("pygame", "tkinter", "numpy")
+
+def benchStartup(repeats: int = 5) -> dict:
+    # How long a fresh interpreter takes to import each entry point, beyond starting up at all, and which
+    # heavy modules the import pulled in. Worker processes and tools pay this every time they start.
+    def timeImport(code: str) -> tuple:
+        best = float("inf")
+        for _ in range(repeats):
+            started = time.perf_counter()
+            output = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True).stdout
+            best = min(best, time.perf_counter() - started)
+        return best, output
+
+    bare, _ = timeImport("pass")
+    report = {"repeats": repeats, "interpreter_ms": bare * 1000}
+    for module in STARTUP_MODULES:
+        seconds, output = timeImport(f"import sys, {module}\n"
+                                     f"print('loaded', *[name for name in {HEAVY_MODULES!r} if name in sys.modules])")
+        loaded = output.splitlines()[-1].split()[1:]
+        report[module] = {"import_ms": (seconds - bare) * 1000, "loaded": loaded}
+    return report
+
+def benchSuite() -> dict:
+    return {
+        "environment": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "startup": benchStartup(),
+        "physics": benchPhysics(),
+        "codec": benchCodec(),
+        "render": benchRender(),
+        "loopback": benchLoopback(),
+    }
+
+def _flatten(report: dict, prefix: str = "") -> dict:
+    # Every number in a report by its dotted path; anything else, like the modules an import loaded, is
+    # left out
+    values = {}
+    for key, value in report.items():
+        path = prefix + key
+        if isinstance(value, dict):
+            values.update(_flatten(value, path + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[path] = value
+    return values
+
+def _direction(path: str) -> int:
+    # 1 if a larger value is better, -1 if smaller is, 0 for values that are not a measurement
+    for name in reversed(path.split(".")):
+        if name.endswith("_per_s"):
+            return 1
+        if name.endswith("_ms"):
+            return -1
+    return 0
+
+def compareReports(report: dict, baseline: dict, tolerance: float) -> dict:
+    # Every rate and time present in both reports with its relative change. Those that got worse by more
+    # than tolerance are listed as regressions.
+    current, previous = _flatten(report), _flatten(baseline)
+    metrics = {}
+    regressions = []
+    for path, value in current.items():
+        old = previous.get(path)
+        direction = _direction(path)
+        if not direction or old is None or not old or math.isnan(old) or math.isnan(value):
+            continue
+        change = (value - old) / old
+        metrics[path] = {"baseline": old, "current": value, "change": change}
+        if change * direction < -tolerance:
+            regressions.append(path)
+    return {"tolerance": tolerance, "regressions": regressions, "metrics": metrics}
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmarks for the pong server")
+    commands = parser.add_subparsers(dest="command", required=True)
+    gcParser = commands.add_parser("gc", help="garbage collections and pauses of the server tick path")
+    gcParser.add_argument("--rooms", type=int, default=500)
+    gcParser.add_argument("--ticks", type=int, default=3000)
+    gcParser.add_argument("--ack-lag", type=int, default=6, help="ticks between a state going out and its acknowledgement")
+    loginParser = commands.add_parser("login", help="login throughput when every player reconnects at once")
+    loginParser.add_argument("--users", type=int, default=500)
+    loginParser.add_argument("--iterations", type=int, default=200_000, help="PBKDF2 iterations per password hash")
+    loginParser.add_argument("--workers", type=int, default=4, help="threads computing password hashes")
+    physicsParser = commands.add_parser("physics", help="ball and world stepping throughput")
+    physicsParser.add_argument("--balls", type=int, default=100)
+    physicsParser.add_argument("--rooms", type=int, default=100)
+    physicsParser.add_argument("--ticks", type=int, default=1000)
+    codecParser = commands.add_parser("codec", help="message encoding and decoding throughput, per codec")
+    codecParser.add_argument("--messages", type=int, default=20000)
+    renderParser = commands.add_parser("render", help="client frame drawing on the SDL dummy driver")
+    renderParser.add_argument("--frames", type=int, default=2000)
+    loopbackParser = commands.add_parser("loopback", help="server tick cost with bots playing over loopback")
+    loopbackParser.add_argument("--rooms", type=int, default=10)
+    loopbackParser.add_argument("--duration", type=float, default=5)
+    loopbackParser.add_argument("--transport", choices=("tcp", "udp"), default="tcp")
+    startupParser = commands.add_parser("startup", help="import time of each entry point in a fresh interpreter")
+    startupParser.add_argument("--repeats", type=int, default=5)
+    commands.add_parser("suite", help="startup, physics, codec, render and loopback together")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    parser.add_argument("--save-baseline", metavar="FILE", help="write the report to FILE for later comparisons")
+    parser.add_argument("--baseline", metavar="FILE", help="compare the report with one saved by --save-baseline")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="relative change that counts as a regression")
+    args = parser.parse_args()
+
+    if args.command == "login":
+        report = benchLogin(args.users, args.iterations, args.workers)
+    elif args.command == "gc":
+        report = benchGc(args.rooms, args.ticks, ackLag=args.ack_lag)
+    elif args.command == "physics":
+        report = benchPhysics(args.balls, args.rooms, args.ticks)
+    elif args.command == "codec":
+        report = benchCodec(args.messages)
+    elif args.command == "render":
+        report = benchRender(args.frames)
+    elif args.command == "loopback":
+        report = benchLoopback(args.rooms, args.duration, args.transport)
+    elif args.command == "startup":
+        report = benchStartup(args.repeats)
+    else:
+        report = benchSuite()
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as file:
+            json.dump(report, file, indent=2)
+    comparison = None
+    if args.baseline:
+        with open(args.baseline) as file:
+            comparison = compareReports(report, json.load(file), args.tolerance)
+    if args.json:
+        if comparison is not None:
+            report = dict(report, comparison=comparison)
+        print(json.dumps(report, indent=2))
+    elif args.command in ("gc", "login"):
+        _printReport(args.command, report)
+    else:
+        for path, value in _flatten(report).items():
+            print(f"{path:<44} {value:,.3f}" if isinstance(value, float) else f"{path:<44} {value}")
+    if comparison is not None:
+        if not args.json:
+            print(f"\ncompared with {args.baseline} (tolerance {args.tolerance:.0%})")
+            for path, change in comparison["metrics"].items():
+                flag = "  REGRESSION" if path in comparison["regressions"] else ""
+                print(f"{path:<44} {change['baseline']:,.3f} -> {change['current']:,.3f} ({change['change']:+.1%}){flag}")
+        sys.exit(1 if comparison["regressions"] else 0)
+
+def _printReport(command: str, report: dict) -> None:
+    if command == "login":
+        print(f"{report['users']} users, {report['iterations']} iterations, {report['workers']} hashing threads, "
+              f"{report['hash_ms']:.1f} ms per hash")
+        for name, label in (("password", "password logins"), ("session", "session resumes"), ("password_again", "password again")):
+            herd = report[name]
+            print(f"{label:<20} {herd['logins_per_s']:9.0f}/s, {herd['accepted']}/{herd['logins']} accepted, "
+                  f"p50 {herd['latency_ms']['p50']:.1f} ms, p99 {herd['latency_ms']['p99']:.1f} ms, "
+                  f"loop stall max {herd['loop_stall_ms']['max']:.1f} ms")
+        return
+    print(f"{report['rooms']} rooms, {report['ticks']} ticks")
+    print(f"tick time            mean {report['tick_ms']['mean']:.3f} ms, p99 {report['tick_ms']['p99']:.3f} ms")
+    gen0, gen1, gen2 = report["collections_per_1000_ticks"]
+    print(f"collections          {gen0:.1f} / {gen1:.1f} / {gen2:.1f} per 1000 ticks (generation 0 / 1 / 2)")
+    print(f"gc pauses            {report['gc_pause_ms']['total']:.1f} ms total, max {report['gc_pause_ms']['max']:.3f} ms")
+    print(f"allocated per tick   mean peak {report['tick_peak_kib']['mean']:.1f} KiB, max {report['tick_peak_kib']['max']:.1f} KiB")
+
+if __name__ == "__main__":
+    main()
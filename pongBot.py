@@ -0,0 +1,426 @@
+# =================================================================================================
+# Date:                     2026 October 18
+# Purpose:                  headless bot clients and a load generator for the server
+# Misc:                     Released under GNU GPL v3.0
+# =================================================================================================
+#
+# Each bot speaks the same protocol as pongClient (handshake, ready, inputs, acknowledgements) without
+# opening a window, and moves its paddle with a simple AI. Run many of them against a server to see
+# how it holds up, e.g.
+#
+#     python pongBot.py --bots 500 --duration 30 --connect-rate 200
+#
+# Bots are paired into rooms in the order they connect, so an even number of bots fills every room.
+
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import random
+import statistics
+import time
+
+from assets.code import protocol
+from assets.code.simulation import PADDLE_HEIGHT, PADDLE_SPEED
+
+PING_INTERVAL = 0.5
+
+class BotStats:
+    # Raw measurements from one bot, merged by summarize()
+    def __init__(self) -> None:
+        self.connectTime = None
+        self.connectedAt = None
+        self.roomId = None
+        self.spectator = False
+        self.rtts = []
+        # State intervals the server asked for, in the order it asked
+        self.rates = []
+        # Seconds from dropping the stream on purpose to the first state on the one that replaced it
+        self.recoveries = []
+        # How far apart consecutive states arrived compared with the server ticks between them
+        self.jitter = []
+        self.states = 0
+        self.bytesIn = 0
+        self.bytesOut = 0
+        self.duration = 0
+        self.error = None
+
+class _DatagramReceiver(asyncio.DatagramProtocol):
+    def __init__(self, bot) -> None:
+        self.bot = bot
+
+    def datagram_received(self, data:bytes, addr:tuple) -> None:
+        self.bot.stats.bytesIn += len(data)
+        try:
+            frames = protocol.parseDatagram(data)
+        except protocol.ProtocolError:
+            return
+        self.bot.udpConfirmed.set()
+        for msgType, payload in frames:
+            self.bot.handle(msgType, payload)
+
+class Bot:
+    def __init__(self, host:str, port:int, ai:str="track", codec:str=protocol.CODEC_BINARY, name:str="bot", spectate:int=None,
+                 lag:float=0) -> None:
+        # With spectate set to a room id the bot watches that room instead of playing. lag holds back
+        # everything the bot sends by that many seconds, as a long or congested link would.
+        self.host = host
+        self.port = port
+        self.ai = ai
+        self.codec = codec
+        self.name = name
+        self.spectate = spectate
+        self.lag = lag
+        self.stats = BotStats()
+        self.stats.spectator = spectate is not None
+
+        self.writer = None
+        self.udp = None
+        self.udpConfirmed = asyncio.Event()
+        self.started = asyncio.Event()
+        self.snapshots = protocol.SnapshotTracker(codec)
+        self.playerId = None
+        self.tickRate = 60
+        self.paddleIndex = 0
+        self.sync = 0
+        self.inputInterval = 1
+        self.lastArrival = None
+        self.resumeRequest = None
+        self.droppedAt = None
+        self.helloTask = None
+
+    def _transmit(self, frame:bytes, datagram:bool) -> None:
+        self.stats.bytesOut += len(frame)
+        if self.lag:
+            asyncio.get_running_loop().call_later(self.lag, self._transmitNow, frame, datagram)
+        else:
+            self._transmitNow(frame, datagram)
+
+    def _transmitNow(self, frame:bytes, datagram:bool) -> None:
+        if datagram:
+            self.udp.sendto(frame)
+        elif not self.writer.is_closing():
+            self.writer.write(frame)
+
+    def _write(self, frame:bytes) -> None:
+        self._transmit(frame, False)
+
+    def sendState(self, frame:bytes) -> None:
+        # Inputs, acknowledgements and pings go over UDP when the server asked for it
+        self._transmit(frame, self.udp is not None)
+
+    def handle(self, msgType:int, payload:bytes) -> None:
+        if msgType == protocol.SNAPSHOT or msgType == protocol.DELTA:
+            now = time.perf_counter()
+            ackTick, _ = self.snapshots.receive(msgType, payload)
+            self.sendState(protocol.encode(protocol.ACK, (ackTick,), self.codec))
+            if ackTick == protocol.NO_BASELINE:
+                return
+            self.stats.states += 1
+            if self.droppedAt is not None:
+                self.stats.recoveries.append(now - self.droppedAt)
+                self.droppedAt = None
+            if self.lastArrival is not None and ackTick > self.lastArrival[1]:
+                lastTime, lastTick = self.lastArrival
+                self.stats.jitter.append(now - lastTime - (ackTick - lastTick) / self.tickRate)
+            self.lastArrival = (now, ackTick)
+        elif msgType == protocol.PONG:
+            sent, = protocol.decode(msgType, payload, self.codec)
+            self.stats.rtts.append(time.perf_counter() - sent)
+        elif msgType == protocol.GAME_START:
+            self.started.set()
+        elif msgType == protocol.RATE:
+            self.inputInterval, = protocol.decode(msgType, payload, self.codec)
+            self.stats.rates.append(self.inputInterval)
+        elif msgType == protocol.PARAMETERS:
+            # The answer to a resume request
+            params = protocol.decodeJson(payload)
+            if "error" in params:
+                raise ConnectionError(f"could not resume: {params['error']}")
+            if self.udp is not None:
+                self.udpConfirmed.clear()
+                self.helloTask = asyncio.ensure_future(self._hello(params["udp_token"]))
+
+    def chooseMove(self) -> int:
+        state = self.snapshots.state
+        if self.ai == "idle" or state is None:
+            return 0
+        if self.ai == "random":
+            return random.choice((-1, 0, 1))
+        # Tracking: keep the paddle centered on the ball
+        paddleCenter = state[self.paddleIndex] + PADDLE_HEIGHT // 2
+        ballY = state[3]
+        if ballY > paddleCenter + PADDLE_SPEED:
+            return 1
+        if ballY < paddleCenter - PADDLE_SPEED:
+            return -1
+        return 0
+
+    async def _readStream(self, reader:asyncio.StreamReader, decoder:protocol.FrameDecoder) -> None:
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                if self.droppedAt is None:
+                    raise ConnectionError("connection closed by server")
+                # Our own doing; come back on a new stream, sending the request before anything is read
+                reader, self.writer = await asyncio.open_connection(self.host, self.port)
+                self._write(protocol.encodeJson(protocol.GET_PARAMETERS, self.resumeRequest))
+                decoder = protocol.FrameDecoder()
+                continue
+            self.stats.bytesIn += len(data)
+            for msgType, payload in decoder.feed(data):
+                self.handle(msgType, payload)
+
+    async def _play(self) -> None:
+        interval = 1 / self.tickRate
+        nextPing = 0
+        unsent = []
+        while True:
+            move = self.chooseMove() if self.spectate is None else 0
+            if move:
+                self.sync += 1
+                unsent.append(move)
+            # Batched like the client does when the server says the link is congested
+            if unsent and (len(unsent) >= self.inputInterval or not move):
+                self.sendState(protocol.encodeInputs(self.sync - len(unsent) + 1, unsent, self.codec))
+                unsent = []
+            now = time.perf_counter()
+            if now >= nextPing:
+                nextPing = now + PING_INTERVAL
+                self.sendState(protocol.encode(protocol.PING, (now,), self.codec))
+            await asyncio.sleep(interval)
+
+    async def _drop(self, delay:float) -> None:
+        # Cuts the stream as a network outage would, to measure how long resuming the match takes
+        await asyncio.sleep(delay)
+        self.droppedAt = time.perf_counter()
+        self.writer.transport.abort()
+
+    async def _hello(self, token:int) -> None:
+        # Repeats the UDP hello until the first datagram shows the server knows our address
+        hello = protocol.encode(protocol.UDP_HELLO, (token,))
+        while not self.udpConfirmed.is_set():
+            self.sendState(hello)
+            try:
+                await asyncio.wait_for(self.udpConfirmed.wait(), 0.1)
+            except asyncio.TimeoutError:
+                pass
+
+    async def run(self, duration:float, dropAfter:float=0) -> BotStats:
+        # With dropAfter set, the bot cuts its stream that many seconds into the match and resumes
+        stats = self.stats
+        try:
+            start = time.perf_counter()
+            reader, self.writer = await asyncio.open_connection(self.host, self.port)
+            request = {"username": self.name, "password": "", "codec": self.codec}
+            if self.spectate is not None:
+                request["spectate"] = self.spectate
+            self._write(protocol.encodeJson(protocol.GET_PARAMETERS, request))
+
+            decoder = protocol.FrameDecoder()
+            pending = []
+            while not pending:
+                data = await reader.read(65536)
+                if not data:
+                    raise ConnectionError("connection closed during handshake")
+                stats.bytesIn += len(data)
+                pending.extend(decoder.feed(data))
+            msgType, payload = pending.pop(0)
+            if msgType != protocol.PARAMETERS:
+                raise protocol.ProtocolError(f"expected game parameters, got message type {msgType}")
+            params = protocol.decodeJson(payload)
+            if "error" in params:
+                raise ConnectionError(f"server refused: {params['error']}")
+            if "resume" in params:
+                self.resumeRequest = {"resume": params["resume"], "codec": self.codec}
+            stats.connectedAt = time.perf_counter()
+            stats.connectTime = stats.connectedAt - start
+            stats.roomId = params.get("room_id")
+            self.playerId = params["paddle_position"]
+            self.paddleIndex = protocol.STATE_FIELDS.index("left_y" if self.playerId == "player1" else "right_y")
+            self.tickRate = params.get("tick_rate", 60)
+            self.codec = params.get("codec", self.codec)
+            self.snapshots.codec = self.codec
+            for frame in pending:
+                self.handle(*frame)
+
+            tasks = [asyncio.ensure_future(self._readStream(reader, decoder))]
+            if params.get("transport") == "udp":
+                loop = asyncio.get_running_loop()
+                self.udp, _ = await loop.create_datagram_endpoint(
+                    lambda: _DatagramReceiver(self), remote_addr=(self.host, params["udp_port"]))
+                tasks.append(asyncio.ensure_future(self._hello(params["udp_token"])))
+
+            if self.spectate is None:
+                self._write(protocol.encode(protocol.READY, codec=self.codec))
+            await asyncio.wait([tasks[0], asyncio.ensure_future(self.started.wait())], return_when=asyncio.FIRST_COMPLETED)
+            tasks.append(asyncio.ensure_future(self._play()))
+            if dropAfter and self.resumeRequest is not None:
+                tasks.append(asyncio.ensure_future(self._drop(dropAfter)))
+            playStart = time.perf_counter()
+            try:
+                done, _ = await asyncio.wait(tasks, timeout=duration, return_when=asyncio.FIRST_EXCEPTION)
+                for task in done:
+                    try:
+                        task.result()
+                    except ConnectionError:
+                        # The other bot in the room finishing a moment earlier closes the room, which only
+                        # counts as an error when it cuts the game noticeably short. For a spectator it is just
+                        # the end of the match.
+                        if self.spectate is None and time.perf_counter() - playStart < 0.9 * duration:
+                            raise
+            finally:
+                stats.duration = time.perf_counter() - playStart
+                for task in tasks:
+                    task.cancel()
+                if self.helloTask is not None:
+                    self.helloTask.cancel()
+        except Exception as e:
+            stats.error = f"{type(e).__name__}: {e}"
+        finally:
+            if self.udp is not None:
+                self.udp.close()
+            if self.writer is not None:
+                self.writer.close()
+        return stats
+
+def percentile(values:list, fraction:float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def summarize(results:list, elapsed:float) -> dict:
+    connected = [s for s in results if s.connectTime is not None]
+    errors = [s.error for s in results if s.error is not None]
+    rtts = [rtt for s in results for rtt in s.rtts]
+    jitter = [abs(j) for s in results for j in s.jitter]
+    recoveries = [r for s in results for r in s.recoveries]
+    playing = [s for s in connected if not s.spectator]
+
+    # Accept rate is measured over the window in which connections were actually being accepted
+    acceptRate = 0.0
+    if connected:
+        firstStart = min(s.connectedAt - s.connectTime for s in connected)
+        lastAccept = max(s.connectedAt for s in connected)
+        acceptRate = len(connected) / max(lastAccept - firstStart, 1e-9)
+
+    rooms = {}
+    for s in connected:
+        if s.roomId is not None and s.duration and not s.spectator:
+            rooms.setdefault(s.roomId, []).append(s)
+    roomBandwidth = [sum((s.bytesIn + s.bytesOut) / s.duration for s in bots) for bots in rooms.values()]
+
+    return {
+        "bots": len(results),
+        "connected": len(connected),
+        "errors": len(errors),
+        "first_errors": errors[:5],
+        "elapsed_s": elapsed,
+        "accept_rate_per_s": acceptRate,
+        "connect_time_ms": {"p50": percentile([s.connectTime for s in connected], 0.5) * 1000,
+                            "p99": percentile([s.connectTime for s in connected], 0.99) * 1000},
+        "rtt_ms": {p: percentile(rtts, q) * 1000 for p, q in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99), ("max", 1.0))},
+        "tick_jitter_ms": {"mean": statistics.fmean(jitter) * 1000 if jitter else float("nan"),
+                           "p99": percentile(jitter, 0.99) * 1000},
+        "states_received": sum(s.states for s in results),
+        "reconnects": len(recoveries),
+        "reconnect_ms": {"p50": percentile(recoveries, 0.5) * 1000, "max": percentile(recoveries, 1.0) * 1000},
+        "rate_changes": sum(len(s.rates) for s in playing),
+        "send_interval": {"final_mean": statistics.fmean(s.rates[-1] if s.rates else 1 for s in playing) if playing else float("nan"),
+                          "peak": max((max(s.rates, default=1) for s in playing), default=1)},
+        "spectators": sum(s.spectator for s in connected),
+        "rooms": len(rooms),
+        "room_bandwidth_bytes_per_s": {"mean": statistics.fmean(roomBandwidth) if roomBandwidth else 0.0,
+                                       "max": max(roomBandwidth, default=0.0)},
+    }
+
+async def runLoad(host:str, port:int, bots:int, duration:float, connectRate:float, ai:str, codec:str, firstIndex:int=0,
+                  spectators:int=0, spectate:int=1, dropAfter:float=0, lag:float=0) -> list:
+    # Starts the bots, spreading the connections out at connectRate per second (0 connects them all at once),
+    # then the spectators of room spectate
+    tasks = []
+    for i in range(bots):
+        bot = Bot(host, port, ai, codec, name=f"bot{firstIndex + i}", lag=lag)
+        # Spread out so both players of a room are seldom away at once
+        drop = dropAfter + random.uniform(0, dropAfter / 2) if dropAfter else 0
+        tasks.append(asyncio.ensure_future(bot.run(duration, drop)))
+        if connectRate > 0:
+            await asyncio.sleep(1 / connectRate)
+    if spectators and bots:
+        # Gives the players time to open the room
+        await asyncio.sleep(0.5)
+    for i in range(spectators):
+        bot = Bot(host, port, ai, codec, name=f"spectator{firstIndex + i}", spectate=spectate)
+        tasks.append(asyncio.ensure_future(bot.run(duration)))
+        if connectRate > 0:
+            await asyncio.sleep(1 / connectRate)
+    return await asyncio.gather(*tasks)
+
+def _runLoadProcess(args:tuple) -> list:
+    return asyncio.run(runLoad(*args))
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Headless pong bots and load generator")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=12321)
+    parser.add_argument("--bots", type=int, default=2, help="number of bots, two per room")
+    parser.add_argument("--duration", type=float, default=10, help="seconds each bot plays for")
+    parser.add_argument("--connect-rate", type=float, default=0, help="new connections per second, 0 for all at once")
+    parser.add_argument("--ai", choices=("track", "random", "idle"), default="track")
+    parser.add_argument("--codec", choices=(protocol.CODEC_BINARY, protocol.CODEC_JSON), default=protocol.CODEC_BINARY)
+    parser.add_argument("--spectators", type=int, default=0, help="number of bots watching a room instead of playing")
+    parser.add_argument("--spectate", type=int, default=1, help="room the spectators watch")
+    parser.add_argument("--drop-after", type=float, default=0, help="cut each bot's stream once, about this many seconds in, and resume")
+    parser.add_argument("--lag", type=float, default=0, help="milliseconds to hold back everything the playing bots send")
+    parser.add_argument("--processes", type=int, default=1, help="spread the bots over this many processes")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.processes <= 1:
+        results = asyncio.run(runLoad(args.host, args.port, args.bots, args.duration, args.connect_rate, args.ai, args.codec,
+                                      spectators=args.spectators, spectate=args.spectate, dropAfter=args.drop_after,
+                                      lag=args.lag / 1000))
+    else:
+        # Split the bots as evenly as whole pairs allow, with an odd one out going to a process that got a
+        # pair fewer. This only balances the load: the server pairs bots in the order they arrive, so the two
+        # bots of a room can still come from different processes.
+        pairs, odd = divmod(args.bots, 2)
+        counts = [2 * (pairs // args.processes + (i < pairs % args.processes)) for i in range(args.processes)]
+        counts[pairs % args.processes] += odd
+        jobs = []
+        firstIndex = 0
+        for i, count in enumerate(counts):
+            spectators = args.spectators // args.processes + (i < args.spectators % args.processes)
+            if count == 0 and spectators == 0:
+                continue
+            rate = args.connect_rate / args.processes
+            jobs.append((args.host, args.port, count, args.duration, rate, args.ai, args.codec, firstIndex, spectators,
+                         args.spectate, args.drop_after, args.lag / 1000))
+            firstIndex += count
+        with concurrent.futures.ProcessPoolExecutor(max(len(jobs), 1)) as pool:
+            results = [stats for chunk in pool.map(_runLoadProcess, jobs) for stats in chunk]
+    report = summarize(results, time.perf_counter() - start)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print(f"bots connected       {report['connected']}/{report['bots']} ({report['errors']} errors, {report['spectators']} spectating)")
+    for error in report["first_errors"]:
+        print(f"  {error}")
+    print(f"accept rate          {report['accept_rate_per_s']:.1f} connections/s "
+          f"(connect p50 {report['connect_time_ms']['p50']:.1f} ms, p99 {report['connect_time_ms']['p99']:.1f} ms)")
+    rtt = report["rtt_ms"]
+    print(f"round trip           p50 {rtt['p50']:.2f} ms, p90 {rtt['p90']:.2f} ms, p99 {rtt['p99']:.2f} ms, max {rtt['max']:.2f} ms")
+    jitter = report["tick_jitter_ms"]
+    print(f"tick jitter          mean {jitter['mean']:.2f} ms, p99 {jitter['p99']:.2f} ms")
+    if report["reconnects"]:
+        print(f"resumed after drop   {report['reconnects']} times, p50 {report['reconnect_ms']['p50']:.2f} ms, max {report['reconnect_ms']['max']:.2f} ms")
+    interval = report["send_interval"]
+    print(f"state interval       {report['rate_changes']} changes, peak {interval['peak']} ticks, ending at mean {interval['final_mean']:.2f}")
+    bandwidth = report["room_bandwidth_bytes_per_s"]
+    print(f"room bandwidth       mean {bandwidth['mean']:.0f} B/s, max {bandwidth['max']:.0f} B/s over {report['rooms']} rooms")
+
+if __name__ == "__main__":
+    main()
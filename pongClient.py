@@ -6,30 +6,47 @@
 # Misc:                     Released under GNU GPL v3.0
 # =================================================================================================
 
-import pygame
-import tkinter as tk
+# pygame and tkinter take most of the client's start-up time, so each is imported where it is first
+# needed: tkinter for the start screen, pygame once a game begins
 import sys
 import socket
-import ssl
-import pdb
-import json
 import hashlib
+import os
+import time
 
 from assets.code.helperCode import *
+from assets.code.simulation import PADDLE_WIDTH, PADDLE_HEIGHT, BALL_SIZE, MAX_SCORE, UP, DOWN
+from assets.code.network import ClientConnection
+from assets.code.prediction import PaddlePredictor, SnapshotInterpolator, PADDLE_Y, INPUT_SEQ
+from assets.code import protocol
+
+# Payload encoding requested from the server. Set PONG_WIRE_CODEC=json to get human readable payloads
+# when debugging the protocol.
+WIRE_CODEC = os.environ.get("PONG_WIRE_CODEC", protocol.CODEC_BINARY)
+# How far in the past, in seconds, the opponent and the ball are drawn. It has to cover the gap between
+# server states plus network jitter; larger values are smoother but show the world later.
+INTERP_DELAY = float(os.environ.get("PONG_INTERP_DELAY", "0.1"))
+# Set PONG_SPECTATE to a room id to watch that room's match instead of joining one as a player
+SPECTATE_ROOM = os.environ.get("PONG_SPECTATE")
 
 # This is the main game loop.  For the most part, you will not need to modify this.  The sections
 # where you should add to the code are marked.  Feel free to change any part of this project
 # to suit your needs.
-def playGame(screenWidth:int, screenHeight:int, playerPaddle:str, client:socket.socket) -> None:
+def playGame(screenWidth:int, screenHeight:int, playerPaddle:str, connection:ClientConnection, tickRate:int=60) -> None:
+    import pygame
+    from assets.code.renderer import Renderer
+
+    # A spectator has no paddle of its own; both are drawn from the server's states like the ball
+    spectating = playerPaddle == protocol.SPECTATOR
+
     # Signal readiness to server
-    ready_message = json.dumps({'request': 'ready'})
-    client.sendall(ready_message.encode('utf-8'))
+    if not spectating:
+        connection.sendReady()
 
     # Wait for server to signal game start
-    while True:
-        server_response = json.loads(client.recv(1024).decode('utf-8'))
-        if 'game_start' in server_response and server_response['game_start']:
-            break
+    connection.started.wait()
+    if connection.error is not None:
+        raise connection.error
 
 
     
@@ -46,47 +63,54 @@ def playGame(screenWidth:int, screenHeight:int, playerPaddle:str, client:socket.
     bounceSound = pygame.mixer.Sound("./assets/sounds/bounce.wav")
 
 
-    # Display objects
+    # Display objects. The renderer draws the walls and center line once and from then on only
+    # redraws what moves.
     screen = pygame.display.set_mode((screenWidth, screenHeight))
-    winMessage = pygame.Rect(0,0,0,0)
-    topWall = pygame.Rect(-10,0,screenWidth+20, 10)
-    bottomWall = pygame.Rect(-10, screenHeight-10, screenWidth+20, 10)
-    centerLine = []
-    for i in range(0, screenHeight, 10):
-        centerLine.append(pygame.Rect((screenWidth/2)-5,i,5,5))
-
-    
+    renderer = Renderer(screen, scoreFont, winFont, WHITE)
 
     # Paddle properties and init
-    paddleHeight = 50
-    paddleWidth = 10
+    paddleHeight = PADDLE_HEIGHT
+    paddleWidth = PADDLE_WIDTH
     paddleStartPosY = (screenHeight/2)-(paddleHeight/2)
     leftPaddle = Paddle(pygame.Rect(10,paddleStartPosY, paddleWidth, paddleHeight))
     rightPaddle = Paddle(pygame.Rect(screenWidth-20, paddleStartPosY, paddleWidth, paddleHeight))
 
-    ball = Ball(pygame.Rect(screenWidth/2, screenHeight/2, 5, 5), -5, 0)
+    ball = Ball(pygame.Rect(screenWidth/2, screenHeight/2, BALL_SIZE, BALL_SIZE), -5, 0)
 
     if playerPaddle == "player1":
         opponentPaddleObj = rightPaddle
         playerPaddleObj = leftPaddle
     else:
+        # Spectators end up here too, drawing player2 as playerPaddleObj
         opponentPaddleObj = leftPaddle
         playerPaddleObj = rightPaddle
 
     lScore = 0
     rScore = 0
 
+    # sync numbers our inputs. The server reports the last one it applied with every state, which is
+    # how we know which of our predicted moves it has already accounted for.
     sync = 0
+    predictor = PaddlePredictor(playerPaddleObj, screenHeight)
+    interpolator = SnapshotInterpolator(tickRate, INTERP_DELAY)
+    opponentId = "player2" if playerPaddle == "player1" else "player1"
+    reconciledTick = -1
+    reconnects = 0
+    # Moves predicted but not sent yet; they go out together once there are inputInterval of them
+    unsent = []
+    # Sound counters from the network thread as of the previous frame
+    seenBounces = 0
+    seenPoints = 0
 
     while True:
-        # Wiping the screen
-        screen.fill((0,0,0))
-
         # Getting keypress events
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
+                connection.close()
                 pygame.quit()
                 sys.exit()
+            elif spectating:
+                continue
             elif event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_DOWN:
                     playerPaddleObj.moving = "down"
@@ -98,122 +122,74 @@ def playGame(screenWidth:int, screenHeight:int, playerPaddle:str, client:socket.
                 playerPaddleObj.moving = ""
 
         # =========================================================================================
-        # Your code here to send an update to the server on your paddle's information,
-        # where the ball is and the current score.
-        # Feel free to change when the score is updated to suit your needs/requirements
-
-        try: 
-            paddle_info = {
-                "request": "update_paddle",
-                "y_pos": playerPaddleObj.rect.y,
-                "sync": sync
-            }
-            client.sendall(json.dumps(paddle_info).encode('utf-8'))
-        except Exception as e:
-            print(f"Error updating paddle | {e}")
+        # The server runs the physics, so all we send are our inputs: one per frame the paddle moves.
+        # The paddle moves on screen right away instead of waiting for the server to echo it back.
 
-        # =========================================================================================
+        if connection.error is not None:
+            print(f"Error receiving game state | {connection.error}")
+            pygame.quit()
+            return
 
-        # Update the player paddle and opponent paddle's location on the screen
-        for paddle in [playerPaddleObj, opponentPaddleObj]:
-            if paddle.moving == "down":
-                if paddle.rect.bottomleft[1] < screenHeight-10:
-                    paddle.rect.y += paddle.speed
-            elif paddle.moving == "up":
-                if paddle.rect.topleft[1] > 10:
-                    paddle.rect.y -= paddle.speed
-
-        # If the game is over, display the win message
-        if lScore > 4 or rScore > 4:
-            winText = "Player 1 Wins! " if lScore > 4 else "Player 2 Wins! "
-            textSurface = winFont.render(winText, False, WHITE, (0,0,0))
-            textRect = textSurface.get_rect()
-            textRect.center = ((screenWidth/2), screenHeight/2)
-            winMessage = screen.blit(textSurface, textRect)
-        else:
+        if connection.reconnects != reconnects:
+            # Inputs sent while the link was down never arrived, so stop predicting with them
+            reconnects = connection.reconnects
+            predictor.pending.clear()
+            unsent.clear()
+
+        latest = connection.latest
+        if not spectating and latest is not None and latest[0] != reconciledTick:
+            reconciledTick, state = latest
+            predictor.reconcile(state[INPUT_SEQ[playerPaddle]], state[PADDLE_Y[playerPaddle]])
+
+        if playerPaddleObj.moving:
+            move = DOWN if playerPaddleObj.moving == "down" else UP
+            sync += 1
+            predictor.apply(sync, move)
+            unsent.append(move)
+        # One message per frame while the link is healthy; when the server backs off its state rate it
+        # asks for batches too, and whatever is left goes out as soon as the paddle stops
+        if unsent and (len(unsent) >= connection.inputInterval or not playerPaddleObj.moving):
+            try:
+                connection.sendInputs(sync - len(unsent) + 1, unsent)
+            except Exception as e:
+                print(f"Error sending input | {e}")
+            unsent = []
 
-            # ==== Ball Logic =====================================================================
-            ball.updatePos()
-
-            # If the ball makes it past the edge of the screen, update score, etc.
-            if ball.rect.x > screenWidth:
-                lScore += 1
-                pointSound.play()
-                ball.reset(nowGoing="left")
-            elif ball.rect.x < 0:
-                rScore += 1
-                pointSound.play()
-                ball.reset(nowGoing="right")
-                
-            # If the ball hits a paddle
-            if ball.rect.colliderect(playerPaddleObj.rect):
-                bounceSound.play()
-                ball.hitPaddle(playerPaddleObj.rect.center[1])
-            elif ball.rect.colliderect(opponentPaddleObj.rect):
-                bounceSound.play()
-                ball.hitPaddle(opponentPaddleObj.rect.center[1])
-                
-            # If the ball hits a wall
-            if ball.rect.colliderect(topWall) or ball.rect.colliderect(bottomWall):
-                bounceSound.play()
-                ball.hitWall()
-            
-            pygame.draw.rect(screen, WHITE, ball)
-            # ==== End Ball Logic =================================================================
-
-        # Drawing the dotted line in the center
-        for i in centerLine:
-            pygame.draw.rect(screen, WHITE, i)
-        
-        # Drawing the player's new location
-        for paddle in [playerPaddleObj, opponentPaddleObj]:
-            pygame.draw.rect(screen, WHITE, paddle)
-
-        pygame.draw.rect(screen, WHITE, topWall)
-        pygame.draw.rect(screen, WHITE, bottomWall)
-        scoreRect = updateScore(lScore, rScore, screen, WHITE, scoreFont)
-        pygame.display.update([topWall, bottomWall, ball, leftPaddle, rightPaddle, scoreRect, winMessage])
-        clock.tick(60)
-    
-
-        # This number should be synchronized between you and your opponent.  If your number is larger
-        # then you are ahead of them in time, if theirs is larger, they are ahead of you, and you need to
-        # catch up (use their info)
-        sync += 1
+        # =========================================================================================
 
         # =========================================================================================
-        # Send your server update here at the end of the game loop to sync your game with your
-        # opponent's game
-
-        try: 
-            get_opponent_info= {
-                "request": "get_opponent_paddle"
-            }
-            client.sendall(json.dumps(get_opponent_info).encode('utf-8'))
-
-            data = client.recv(1024)
-            server_response = json.loads(data.decode('utf-8'))
-            opponent_paddle_pos = server_response.get("opponent_y", "Unknown")
-            
-            if opponent_paddle_pos == "Unknown":
-                raise ValueError("unknown opponent paddle position received from server.") 
-
-            opponentPaddleObj.rect.y = opponent_paddle_pos
-
-        except Exception as e:
-            errText = f"Error in receiving opponent paddle info! {e}"
-            textSurface = winFont.render(errText, False, (255, 0, 0), (0,0,0))
-            textrect = textSurface.get_rect()
-            textRect.center = ((screenWidth/2), screenHeight/2)
-            errMessage = screen.blit(textSurface, textRect)
+        # Draw the opponent and the ball interpolated between the states the network thread has
+        # buffered. Nothing here waits on the network.
+
+        shown = interpolator.sample(connection.history, time.monotonic())
+        if shown is not None:
+            opponentPaddleObj.rect.y = shown[PADDLE_Y[opponentId]]
+            if spectating:
+                playerPaddleObj.rect.y = shown[PADDLE_Y["player2"]]
+            (ball.rect.x, ball.rect.y, ball.xVel, ball.yVel, lScore, rScore) = shown[2:8]
+
+        bounces, points = connection.bounces, connection.points
+        if points != seenPoints:
+            pointSound.play()
+        elif bounces != seenBounces:
+            bounceSound.play()
+        seenBounces, seenPoints = bounces, points
 
         # =========================================================================================
 
+        # If the game is over, display the win message, otherwise draw the ball with the paddles
+        if lScore > MAX_SCORE or rScore > MAX_SCORE:
+            winText = "Player 1 Wins! " if lScore > MAX_SCORE else "Player 2 Wins! "
+            renderer.draw([leftPaddle.rect, rightPaddle.rect], lScore, rScore, winText)
+        else:
+            renderer.draw([leftPaddle.rect, rightPaddle.rect, ball.rect], lScore, rScore)
+        clock.tick(60)
+
 # This is where you will connect to the server to get the info required to call the game loop.  Mainly
 # the screen width, height and player paddle (either "left" or "right")
 # If you want to hard code the screen's dimensions into the code, that's fine, but you will need to know
 # which client is which
-def joinServer(ip: str, port: str, username: str, password: str, errorLabel: tk.Label, app: tk.Tk) -> None:
+def joinServer(ip: str, port: str, username: str, password: str, errorLabel: "tk.Label", app: "tk.Tk") -> None:
     # Author:        Kevin Cosby, Oskar Flores
     #
     # Purpose:       Creates an initial connection to the server, receives parameters to initialize the game with,
@@ -249,20 +225,33 @@ def joinServer(ip: str, port: str, username: str, password: str, errorLabel: tk.
         player_info = {
             "username": username,
             "password": password,
-            "request": "get_parameters"
+            "codec": WIRE_CODEC
         }
+        if SPECTATE_ROOM:
+            player_info["spectate"] = int(SPECTATE_ROOM)
         
         # send this data to the server.
-        client.sendall(json.dumps(player_info).encode('utf-8'))
-
-        # Receive server response (json):
-        data = client.recv(1024)
-        server_response = json.loads(data.decode('utf-8'))
+        client.sendall(protocol.encodeJson(protocol.GET_PARAMETERS, player_info))
+
+        # Receive server response (the handshake is always json):
+        decoder = protocol.FrameDecoder()
+        pending = []
+        msgType, payload = protocol.recvFrame(client, decoder, pending)
+        if msgType != protocol.PARAMETERS:
+            raise protocol.ProtocolError(f"expected game parameters, got message type {msgType}")
+        server_response = protocol.decodeJson(payload)
+        if "error" in server_response:
+            errorLabel.config(text=f"Server refused the connection: {server_response['error']}")
+            errorLabel.update()
+            return
         
         # parse the data received from the server
         x_res = server_response.get("x_res", "Unknown")
         y_res = server_response.get("y_res", "Unknown")
         paddle_position = server_response.get("paddle_position", "Unknown")
+        codec = server_response.get("codec", protocol.CODEC_BINARY)
+        tick_rate = server_response.get("tick_rate", 60)
+        transport = server_response.get("transport", "tcp")
         
         # ensure the validity of the data we received
         errors = []
@@ -270,8 +259,16 @@ def joinServer(ip: str, port: str, username: str, password: str, errorLabel: tk.
             errors.append(f"invalid x resolution received from the server. Value: {x_res}")
         if not isinstance(y_res, int):
             errors.append(f"invalid y resolution received from the server. Value: {y_res}")
-        if paddle_position not in ["player1", "player2"]:
+        if paddle_position not in ["player1", "player2", protocol.SPECTATOR]:
             errors.append(f"invalid paddle position received from the server. Value: {paddle_position}")
+        if not isinstance(tick_rate, int) or tick_rate <= 0:
+            errors.append(f"invalid tick rate received from the server. Value: {tick_rate}")
+        if codec not in [protocol.CODEC_BINARY, protocol.CODEC_JSON]:
+            errors.append(f"invalid wire codec received from the server. Value: {codec}")
+        if transport not in ["tcp", "udp"]:
+            errors.append(f"invalid transport received from the server. Value: {transport}")
+        elif transport == "udp" and not (isinstance(server_response.get("udp_port"), int) and isinstance(server_response.get("udp_token"), int)):
+            errors.append("server asked for the udp transport without a valid udp port and token")
         
         # if any errors were received, update the error label to display them and return from this function
         # this should result in the user still being on the startup screen with the error message printed.
@@ -283,7 +280,19 @@ def joinServer(ip: str, port: str, username: str, password: str, errorLabel: tk.
         # Hides the window for settings
         app.withdraw()
         # if we have passed these checks and have valid information, play the game with these params
-        playGame(x_res, y_res, paddle_position, client)
+        # with the udp transport, game state uses datagrams to the same host
+        udpAddr = (client.getpeername()[0], server_response["udp_port"]) if transport == "udp" else None
+        playerId = paddle_position if paddle_position != protocol.SPECTATOR else None
+        # If the link drops mid-match the connection asks for our seat back with this, logged in by the
+        # session the server gave us if it checks logins
+        resumeRequest = None
+        if isinstance(server_response.get("resume"), str):
+            resumeRequest = dict(player_info, resume=server_response["resume"])
+            if "session" in server_response:
+                resumeRequest["session"] = server_response["session"]
+        connection = ClientConnection(client, codec, decoder, pending, playerId, udpAddr, server_response.get("udp_token"),
+                                      resumeRequest, server_response.get("reconnect_grace", 0))
+        playGame(x_res, y_res, paddle_position, connection, tick_rate)
         # kills the window (effectively quitting the program)
         app.quit()
     except Exception as e:
@@ -295,6 +304,8 @@ def joinServer(ip: str, port: str, username: str, password: str, errorLabel: tk.
 
 # This displays the opening screen, you don't need to edit this (but may if you like)
 def startScreen():
+    import tkinter as tk
+
     # initialize TK app
     app = tk.Tk()
     # set window title to "Server Info"
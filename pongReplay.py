@@ -0,0 +1,123 @@
+# =================================================================================================
+# Date:                     2026 October 18
+# Purpose:                  inspects, verifies and plays back matches the server recorded
+# Misc:                     Released under GNU GPL v3.0
+# =================================================================================================
+#
+# Recordings come from running the server with --record-dir. For example
+#
+#     python pongReplay.py recordings/room-1-20231101-120000.pongrec             summary
+#     python pongReplay.py recordings/*.pongrec --verify                         re-simulate and compare
+#     python pongReplay.py recordings/room-1-20231101-120000.pongrec --seek 4000 the world at tick 4000
+#     python pongReplay.py recordings/room-1-20231101-120000.pongrec --watch --start 4000 --speed 4
+#
+# --verify re-runs each match headless as fast as the simulation goes and checks that every keyframe
+# comes out the same, so it doubles as a regression test over a directory of recorded matches.
+
+import argparse
+import sys
+import time
+
+from assets.code import protocol
+from assets.code.recording import Recording, RecordingError
+
+def describe(recording: Recording) -> None:
+    seconds = recording.lastTick / recording.tickRate
+    started = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(recording.startedAt))
+    print(f"{recording.path}: room {recording.roomId}, started {started}, {recording.screenWidth}x{recording.screenHeight} "
+          f"at {recording.tickRate} ticks/s")
+    print(f"  ticks {recording.keyframeTicks[0]}-{recording.lastTick} ({seconds:.1f} s), {len(recording.keyframeTicks)} keyframes"
+          f"{'' if recording.complete else ', not closed cleanly'}")
+
+def verify(recording: Recording) -> bool:
+    started = time.perf_counter()
+    ticks, difference = recording.verify()
+    elapsed = time.perf_counter() - started
+    if difference is not None:
+        expected, actual = difference
+        print(f"{recording.path}: DESYNC at tick {ticks}")
+        print(f"  recorded  {expected.hex()}")
+        print(f"  simulated {actual.hex()}")
+        return False
+    speed = ticks / recording.tickRate / elapsed if elapsed else float("inf")
+    print(f"{recording.path}: {ticks} ticks identical in {elapsed:.3f} s ({speed:.0f}x real time)")
+    return True
+
+def showState(recording: Recording, tick: int) -> None:
+    started = time.perf_counter()
+    world = recording.seek(tick)
+    elapsed = time.perf_counter() - started
+    keyframe = recording.keyframeTicks[recording.keyframeBefore(tick)]
+    print(f"tick {world.tick} (from the keyframe at {keyframe}, {elapsed * 1000:.2f} ms)")
+    for name, value in zip(protocol.STATE_FIELDS, world.state()):
+        print(f"  {name:<14} {value}")
+
+def watch(recording: Recording, start: int, speed: float) -> None:
+    # Plays the match back in a window from tick start, speed times as fast as it was played
+    import pygame
+    from assets.code.renderer import Renderer
+
+    world = recording.seek(max(start, recording.keyframeTicks[0]))
+    inputs = recording.inputs(recording.keyframeOffsets[recording.keyframeBefore(world.tick)])
+    # Inputs queued before the tick seek() stopped at have already been applied
+    upcoming = next(inputs, None)
+    while upcoming is not None and upcoming[0] < world.tick:
+        upcoming = next(inputs, None)
+
+    pygame.init()
+    screen = pygame.display.set_mode((recording.screenWidth, recording.screenHeight))
+    pygame.display.set_caption(f"Replay of room {recording.roomId}")
+    renderer = Renderer(screen, pygame.font.Font("./assets/fonts/pong-score.ttf", 32),
+                        pygame.font.Font("./assets/fonts/visitor.ttf", 48))
+    clock = pygame.time.Clock()
+    last = recording.lastTick
+    while world.tick < last:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                pygame.quit()
+                return
+        while upcoming is not None and upcoming[0] == world.tick:
+            world.queueInputs(*upcoming[1:])
+            upcoming = next(inputs, None)
+        world.step()
+        renderer.draw([world.leftPaddle.rect, world.rightPaddle.rect, world.ball.rect], world.lScore, world.rScore,
+                      "Match over" if world.isOver() else None)
+        clock.tick(recording.tickRate * speed)
+    pygame.quit()
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Inspect, verify and play back recorded pong matches")
+    parser.add_argument("recordings", nargs="+", help="files written by the server's --record-dir")
+    parser.add_argument("--verify", action="store_true", help="re-simulate each match and compare every keyframe")
+    parser.add_argument("--seek", type=int, help="print the world right after this tick")
+    parser.add_argument("--watch", action="store_true", help="play the match back in a window")
+    parser.add_argument("--start", type=int, default=0, help="tick to start watching from")
+    parser.add_argument("--speed", type=float, default=1, help="playback speed for --watch")
+    args = parser.parse_args()
+
+    failed = False
+    for path in args.recordings:
+        try:
+            recording = Recording(path)
+        except (OSError, RecordingError) as e:
+            print(f"{path}: {e}")
+            failed = True
+            continue
+        with recording:
+            try:
+                if args.verify:
+                    failed |= not verify(recording)
+                elif args.seek is not None:
+                    showState(recording, args.seek)
+                elif args.watch:
+                    watch(recording, args.start, args.speed)
+                else:
+                    describe(recording)
+            except RecordingError as e:
+                # e.g. a tick before the first keyframe
+                print(f"{path}: {e}")
+                failed = True
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -1,100 +1,1276 @@
+import argparse
+import asyncio
+import collections
+import dataclasses
+import itertools
+import multiprocessing
+import os
+import secrets
+import signal
 import socket
+import struct
 import threading
-import json
+import time
+import urllib.parse
+from dataclasses import dataclass
 
-def handle_client(client_socket, player_id, opponent_id, clients):
-    global game_state
+from assets.code import protocol
+from assets.code.auth import Authenticator, SessionCache, SqliteCredentialStore
+from assets.code.metrics import MetricsRegistry, CallProfiler, StackSampler, BYTE_BUCKETS
+from assets.code.recording import MatchRecorder, checkSettings
+from assets.code.simulation import GameWorld
 
-    while True:
+@dataclass
+class ServerConfig:
+    host: str = "localhost"
+    port: int = 12321
+    # Accept queue length, large enough to absorb a burst of players connecting at once
+    backlog: int = 1024
+    x_res: int = 640
+    y_res: int = 480
+    # Simulation steps per second. Every tick is followed by a state update to both players, so this trades
+    # bandwidth for latency.
+    tick_rate: int = 60
+    # Send a keyframe instead of a delta once this many ticks have gone out without an acknowledgement
+    keyframe_after: int = 30
+    # "tcp" sends everything over the player's stream. "udp" moves inputs and state updates to datagrams
+    # so one lost packet cannot hold up the ones behind it; the handshake, readiness and score events
+    # stay on the reliable stream.
+    transport: str = "tcp"
+    udp_port: int = 12322
+    # Plain-text metrics at http://metrics_host:metrics_port/metrics (Prometheus format); 0 disables it
+    metrics_host: str = "127.0.0.1"
+    metrics_port: int = 12380
+    # Print a one-line metrics summary every this many seconds; 0 disables it
+    metrics_log_interval: float = 0
+    # Allow /profile and /sample on the metrics endpoint to profile the live server
+    profiling: bool = False
+    # Worker processes, each running its own rooms on its own core; 0 starts one per core. With more than
+    # one, this process only accepts connections and hands them to the workers. Worker i serves UDP on
+    # udp_port + i and metrics on metrics_port + i.
+    workers: int = 1
+    # "object" steps a simulation.GameWorld per room. "batch" keeps every room of a process in one
+    # batchSimulation.BatchWorld and steps them all with a few NumPy operations per tick (needs numpy).
+    physics: str = "object"
+    # Record every match into this directory for pongReplay.py; empty disables recording
+    record_dir: str = ""
+    # Ticks between the full-world keyframes a replay can start from
+    record_keyframe_interval: int = 300
+    # Spectators share one encoding of every state. One whose send buffer holds more than skip bytes
+    # misses ticks until it drains and then resumes from a keyframe; past drop bytes it is disconnected.
+    # Either way the players never wait for a spectator.
+    max_spectators: int = 1000
+    spectator_skip_bytes: int = 16384
+    spectator_drop_bytes: int = 262144
+    # SQLite credential store players log in against (python -m assets.code.auth manages it); empty lets
+    # anyone play under any name
+    auth_db: str = ""
+    # Threads computing password hashes, so a burst of logins costs CPU time but never stalls the ticks
+    auth_workers: int = 4
+    # Session tokens kept for logging in again without the password, and seconds an unused one lasts
+    session_cache_size: int = 100000
+    session_ttl: float = 3600
+    # Seconds a player who dropped out of a running match keeps its seat. The room plays on meanwhile and
+    # the player can reconnect with the resume token from its handshake; 0 ends the match right away.
+    reconnect_grace: float = 10
+    # Adaptive send rate. Every adapt_interval seconds each player's link is judged by its smoothed round
+    # trip and its send buffer. Past congested_rtt_ms or congested_queue_bytes the player gets states half
+    # as often, down to one every max_send_interval ticks, and its client is told to batch inputs to match.
+    # Below half of both it wins back one tick of interval per period. max_send_interval 1 turns it off.
+    adapt_interval: float = 0.5
+    congested_rtt_ms: float = 200
+    congested_queue_bytes: int = 8192
+    max_send_interval: int = 4
+
+class ServerMetrics:
+    def __init__(self, matchmaker) -> None:
+        registry = MetricsRegistry()
+        self.registry = registry
+        self.connections = registry.gauge("pong_connections", "Connected players")
+        self.rooms = registry.gauge("pong_rooms", "Open match rooms", read=lambda: len(matchmaker.rooms))
+        self.messages_in = registry.counter("pong_messages_in_total", "Messages received", ("type",))
+        self.messages_out = registry.counter("pong_messages_out_total", "Messages sent", ("type",))
+        self.bytes_in = registry.counter("pong_bytes_in_total", "Bytes received", ("transport",))
+        self.bytes_out = registry.counter("pong_bytes_out_total", "Bytes sent", ("transport",))
+        self.decode_seconds = registry.histogram("pong_decode_seconds", "Time to split one read into frames")
+        self.handle_seconds = registry.histogram("pong_handle_seconds", "Time to decode and handle the frames of one read")
+        self.tick_seconds = registry.histogram("pong_tick_seconds", "Time to step and send every room for one tick")
+        self.spectators = registry.gauge("pong_spectators", "Connected spectators")
+        self.spectator_skips = registry.counter("pong_spectator_skipped_ticks_total", "States not sent to spectators that were behind")
+        self.spectator_drops = registry.counter("pong_spectators_dropped_total", "Spectators disconnected for falling too far behind")
+        self.logins = registry.counter("pong_logins_total", "Handshakes by how they authenticated", ("result",))
+        self.reconnects = registry.counter("pong_reconnects_total", "Players that dropped out of a match, by outcome", ("result",))
+        self.auth_seconds = registry.histogram("pong_auth_seconds", "Time to authenticate a handshake",
+                                               (0.0001, 0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+        self.rate_changes = registry.counter("pong_send_rate_changes_total", "Changes to a player's state interval", ("direction",))
+        self.send_interval = registry.histogram("pong_send_interval_ticks", "Ticks between states for each player, sampled every second",
+                                                (1, 2, 3, 4, 6, 8, 12, 16))
+        self.send_queue_bytes = registry.histogram("pong_send_queue_bytes", "Bytes waiting in each player's send buffer, sampled every second", BYTE_BUCKETS)
+
+    def sent(self, msg_type: int, size: int, transport: tuple, count: int = 1) -> None:
+        self.messages_out.inc(count, TYPE_LABELS.get(msg_type) or (msg_type,))
+        self.bytes_out.inc(size * count, transport)
+
+    def received(self, msg_type: int) -> None:
+        self.messages_in.inc(1, TYPE_LABELS.get(msg_type) or (msg_type,))
+
+# Label values built once instead of a tuple per message
+TYPE_LABELS = {msg_type: (name,) for msg_type, name in protocol.MESSAGE_NAMES.items()}
+TCP_LABELS = ('tcp',)
+UDP_LABELS = ('udp',)
+
+class PlayerConnection:
+    # One player's seat in a room: its stream writer, the payload codec negotiated in the handshake and the
+    # snapshot baselines used for delta compression. The writer is None while the player is away; a
+    # reconnect attaches a new one to the same seat.
+    __slots__ = ('writer', 'metrics', 'codec', 'room', 'player_id', 'resume_token', 'udp_token', 'udp_transport',
+                 'udp_addr', 'history_ticks', 'history_states', 'acked_tick', 'acked_state', 'last_sent_tick',
+                 'send_interval', 'rtt_ticks')
+
+    def __init__(self, writer: asyncio.StreamWriter, metrics: ServerMetrics) -> None:
+        self.writer = writer
+        self.metrics = metrics
+        self.codec = protocol.CODEC_BINARY
+        self.room = None
+        self.player_id = None
+        self.resume_token = None
+        # Set once the client has said hello over UDP; state updates then go there instead of the stream
+        self.udp_token = None
+        self.udp_transport = None
+        self.udp_addr = None
+        # Tick and state of every snapshot sent but not yet acknowledged, oldest first. Two deques rather than
+        # one of pairs, so sending a state does not allocate a pair.
+        self.history_ticks = collections.deque(maxlen=protocol.MAX_BASELINE_AGE)
+        self.history_states = collections.deque(maxlen=protocol.MAX_BASELINE_AGE)
+        self.acked_tick = -1
+        self.acked_state = None
+        self.last_sent_tick = -1
+        # Ticks between states, raised while the link is congested (see adapt), and the smoothed time from
+        # sending a state to its acknowledgement, in ticks
+        self.send_interval = 1
+        self.rtt_ticks = 0.0
+
+    def write(self, msg_type: int, frame: bytes) -> None:
+        if self.writer is None:
+            return
+        self.writer.write(frame)
+        self.metrics.sent(msg_type, len(frame), TCP_LABELS)
+
+    def write_datagram(self, msg_type: int, frame: bytes) -> None:
+        self.udp_transport.sendto(frame, self.udp_addr)
+        self.metrics.sent(msg_type, len(frame), UDP_LABELS)
+
+    def send(self, msg_type: int, values: tuple = ()) -> None:
+        self.write(msg_type, protocol.encode(msg_type, values, self.codec))
+
+    def send_state(self, tick: int, state: tuple, events: int, keyframe_after: int) -> None:
+        # Sends only the fields that changed since the last state the client acknowledged. A keyframe goes
+        # out when there is no usable baseline: right after joining, after the client reported a missing
+        # baseline, or when acknowledgements stopped arriving.
+        if self.writer is None or self.udp_token is not None and self.udp_addr is None:
+            # Waiting for the client's UDP hello, or for the player to come back, there is nowhere to send
+            # state to yet
+            return
+        if not events and tick - self.last_sent_tick < self.send_interval:
+            # Backed off; ticks with a bounce or point still go out, since those change where the ball heads
+            return
+        base = self.acked_state
+        if base is None or tick - self.acked_tick > protocol.MAX_BASELINE_AGE or self.last_sent_tick - self.acked_tick > keyframe_after:
+            msg_type = protocol.SNAPSHOT
+            frame = protocol.encode(msg_type, (tick,) + state + (events,), self.codec)
+        else:
+            mask = protocol.deltaMask(base, state)
+            if not mask and not events:
+                # The client already holds this exact state, so an idle tick costs nothing
+                return
+            msg_type = protocol.DELTA
+            frame = protocol.encodeDelta(tick, self.acked_tick, events, mask, state, self.codec)
+        if self.udp_addr is not None:
+            self.write_datagram(msg_type, frame)
+        else:
+            self.write(msg_type, frame)
+        self.history_ticks.append(tick)
+        self.history_states.append(state)
+        self.last_sent_tick = tick
+
+    def acknowledge(self, tick: int) -> None:
+        if tick == protocol.NO_BASELINE:
+            self.acked_state = None
+            self.history_ticks.clear()
+            self.history_states.clear()
+            return
+        ticks, states = self.history_ticks, self.history_states
+        while ticks and ticks[0] < tick:
+            ticks.popleft()
+            states.popleft()
+        if ticks and ticks[0] == tick:
+            self.acked_tick = ticks.popleft()
+            self.acked_state = states.popleft()
+            self.rtt_ticks += (self.room.world.tick - tick - self.rtt_ticks) / 8
+
+    def adapt(self, config: ServerConfig) -> None:
+        # Backs the state interval off multiplicatively while the link is congested and brings it back
+        # one tick at a time once it is healthy, telling the client whenever it changes. States still
+        # waiting for an acknowledgement count towards the round trip, so lost acknowledgements show up
+        # as congestion too.
+        if self.writer is None:
+            return
+        tick = self.room.world.tick
+        waiting = tick - self.history_ticks[0] if self.history_ticks else 0
+        rtt_ms = max(self.rtt_ticks, waiting) * 1000 / config.tick_rate
+        queued = self.writer.transport.get_write_buffer_size()
+        if rtt_ms > config.congested_rtt_ms or queued > config.congested_queue_bytes:
+            interval = min(self.send_interval * 2, config.max_send_interval)
+        elif rtt_ms < config.congested_rtt_ms / 2 and queued < config.congested_queue_bytes / 2:
+            interval = max(self.send_interval - 1, 1)
+        else:
+            return
+        if interval != self.send_interval:
+            self.metrics.rate_changes.inc(1, ('backoff',) if interval > self.send_interval else ('recover',))
+            self.send_interval = interval
+            self.send(protocol.RATE, (interval,))
+
+    def handle_state_message(self, msg_type: int, payload: bytes, via_udp: bool = False) -> None:
+        # Messages that may arrive over either transport
+        if msg_type == protocol.INPUT:
+            # Inputs are applied one per tick by the simulation
+            first_seq, moves = protocol.decodeInputs(payload, self.codec)
+            self.room.queue_inputs(self.player_id, first_seq, moves)
+
+        elif msg_type == protocol.ACK:
+            tick, = protocol.decode(msg_type, payload, self.codec)
+            self.acknowledge(tick)
+
+        elif msg_type == protocol.PING:
+            # Answered on the channel the ping came in on, so it measures that channel's round trip
+            pong = protocol.encode(protocol.PONG, protocol.decode(msg_type, payload, self.codec), self.codec)
+            if via_udp:
+                self.write_datagram(protocol.PONG, pong)
+            else:
+                self.write(protocol.PONG, pong)
+
+        else:
+            raise protocol.ProtocolError(f"unexpected message type {msg_type}")
+
+    def attach(self, writer: asyncio.StreamWriter) -> None:
+        # Takes the seat over for a reconnected player, whose client holds none of the states sent before
+        if self.writer is not None:
+            self.writer.close()
+        self.writer = writer
+        self.acked_tick = -1
+        self.acked_state = None
+        self.last_sent_tick = -1
+        self.history_ticks.clear()
+        self.history_states.clear()
+
+    def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+
+class SpectatorConnection:
+    # Someone watching a room. Spectators get the same frames as each other, never a per-connection delta.
+    __slots__ = ('writer', 'metrics', 'codec')
+
+    def __init__(self, writer: asyncio.StreamWriter, metrics: ServerMetrics, codec: str) -> None:
+        self.writer = writer
+        self.metrics = metrics
+        self.codec = codec
+
+    def write(self, msg_type: int, frame: bytes) -> None:
+        self.writer.write(frame)
+        self.metrics.sent(msg_type, len(frame), TCP_LABELS)
+
+    def send(self, msg_type: int, values: tuple = ()) -> None:
+        self.write(msg_type, protocol.encode(msg_type, values, self.codec))
+
+    def queued(self) -> int:
+        return self.writer.transport.get_write_buffer_size()
+
+    def close(self) -> None:
+        self.writer.close()
+
+class StateDatagramProtocol(asyncio.DatagramProtocol):
+    # Receives inputs and acknowledgements over UDP. A client is recognised by the token it was given in
+    # the handshake and from then on by the address its hello came from.
+    def __init__(self, metrics: ServerMetrics) -> None:
+        self.metrics = metrics
+        self.transport = None
+        self.by_token = {}
+        self.by_addr = {}
+
+    def connection_made(self, transport: asyncio.DatagramTransport) -> None:
+        self.transport = transport
+
+    def register(self, connection: PlayerConnection) -> int:
+        token = secrets.randbits(63)
+        connection.udp_token = token
+        connection.udp_transport = self.transport
+        self.by_token[token] = connection
+        return token
+
+    def unregister(self, connection: PlayerConnection) -> None:
+        self.by_token.pop(connection.udp_token, None)
+        if connection.udp_addr is not None and self.by_addr.get(connection.udp_addr) is connection:
+            del self.by_addr[connection.udp_addr]
+
+    def datagram_received(self, data: bytes, addr: tuple) -> None:
+        metrics = self.metrics
+        metrics.bytes_in.inc(len(data), UDP_LABELS)
         try:
-            data = client_socket.recv(1024)
-            if not data:
-                break
+            for msg_type, payload in protocol.parseDatagram(data):
+                metrics.received(msg_type)
+                if msg_type == protocol.UDP_HELLO:
+                    token, = protocol.decode(msg_type, payload)
+                    connection = self.by_token.get(token)
+                    if connection is None:
+                        continue
+                    # A new address for a known token is a NAT rebinding, so follow the client
+                    if connection.udp_addr is not None:
+                        self.by_addr.pop(connection.udp_addr, None)
+                    connection.udp_addr = addr
+                    self.by_addr[addr] = connection
+                    continue
+
+                connection = self.by_addr.get(addr)
+                if connection is None or connection.room.closed:
+                    return
+                connection.handle_state_message(msg_type, payload, via_udp=True)
+        except (protocol.ProtocolError, TypeError, ValueError) as e:
+            # A stray or corrupt datagram only costs that datagram, including JSON ones whose fields hold
+            # the wrong types
+            print(f"Dropped datagram from {addr}: {e}")
+
+class GameRoom:
+    # Holds everything one match needs so that rooms never share state with each other
+    def __init__(self, room_id: int, config: ServerConfig, batch=None) -> None:
+        self.room_id = room_id
+        self.config = config
+        # With batched physics the world is this room's slot in the shared BatchWorld
+        self.batch = batch
+        self.world = batch.add() if batch is not None else GameWorld(config.x_res, config.y_res)
+        self.keyframe_after = config.keyframe_after
+        self.client_ready = {'player1': False, 'player2': False}
+        self.clients = {}
+        self.started = False
+        self.closed = False
+        self.recorder = None
+        self.spectators = []
+        # Spectators that missed a state, or just joined, and need a keyframe before any delta
+        self.catching_up = set()
+        # The last state sent to the spectators that are in step; their deltas are against it
+        self.spectator_tick = -1
+        self.spectator_state = None
+        # Timers ending the match for players who dropped out, by player id
+        self.away = {}
+
+    def add_player(self, connection: PlayerConnection) -> str:
+        player_id = 'player1' if 'player1' not in self.clients else 'player2'
+        self.clients[player_id] = connection
+        return player_id
+
+    def is_full(self) -> bool:
+        return len(self.clients) == 2
+
+    def hold_seat(self, connection: PlayerConnection, grace: float, forfeit) -> None:
+        # Keeps the room playing without the player for grace seconds, then calls forfeit
+        connection.writer = None
+        self.away[connection.player_id] = asyncio.get_running_loop().call_later(grace, forfeit)
+
+    def resume(self, connection: PlayerConnection, writer: asyncio.StreamWriter) -> None:
+        timer = self.away.pop(connection.player_id, None)
+        if timer is not None:
+            timer.cancel()
+        connection.attach(writer)
+
+    def catch_up(self, connection: PlayerConnection) -> None:
+        # Everything a reconnected player needs to carry on, sent right behind its parameters so that it
+        # arrives in the same round trip: the start signal, the score and a keyframe. Deltas follow from
+        # the next tick on.
+        if self.started:
+            connection.send(protocol.GAME_START)
+            connection.send(protocol.SCORE_UPDATE, (self.world.lScore, self.world.rScore))
+            connection.send_state(self.world.tick, self.world.state(), 0, self.keyframe_after)
+
+    def add_spectator(self, spectator: SpectatorConnection) -> None:
+        self.spectators.append(spectator)
+        self.catching_up.add(spectator)
+        if self.started:
+            spectator.send(protocol.GAME_START)
+            spectator.send(protocol.SCORE_UPDATE, (self.world.lScore, self.world.rScore))
+
+    def remove_spectator(self, spectator: SpectatorConnection) -> None:
+        if spectator in self.spectators:
+            self.spectators.remove(spectator)
+        self.catching_up.discard(spectator)
+
+    def broadcast(self, msg_type: int, values: tuple = ()) -> None:
+        for connection in self.clients.values():
+            connection.send(msg_type, values)
+        frames = {}
+        for spectator in self.spectators:
+            frame = frames.get(spectator.codec)
+            if frame is None:
+                frame = frames[spectator.codec] = protocol.encode(msg_type, values, spectator.codec)
+            spectator.write(msg_type, frame)
+
+    def start(self) -> None:
+        self.started = True
+        if self.batch is not None:
+            self.batch.start(self.world)
+        config = self.config
+        if config.record_dir:
+            path = os.path.join(config.record_dir, f"room-{self.room_id}-{time.strftime('%Y%m%d-%H%M%S')}.pongrec")
+            try:
+                os.makedirs(config.record_dir, exist_ok=True)
+                self.recorder = MatchRecorder(path, config.x_res, config.y_res, config.tick_rate,
+                                              config.record_keyframe_interval, self.room_id)
+            except OSError as e:
+                print(f"Room {self.room_id} is not being recorded: {e}")
+            else:
+                self.record(self.recorder.recordTick, self.world)
+        self.broadcast(protocol.GAME_START)
+        self.send_state(0)
+
+    def send_state(self, events: int) -> None:
+        tick = self.world.tick
+        state = self.world.state()
+        for connection in self.clients.values():
+            connection.send_state(tick, state, events, self.keyframe_after)
+        if self.spectators:
+            self.fan_out(tick, state, events)
+
+    def fan_out(self, tick: int, state: tuple, events: int) -> None:
+        # Every spectator in step gets the same delta from the previous spectator state, over a reliable
+        # stream so no acknowledgements are needed. Each frame is encoded at most once per codec per tick
+        # and the same bytes object is written to every spectator.
+        base = self.spectator_state
+        if base is not None and tick - self.spectator_tick > protocol.MAX_BASELINE_AGE:
+            base = None
+        mask = protocol.deltaMask(base, state) if base is not None else 0
+        changed = base is None or mask or events
+        if not changed and not self.catching_up:
+            return
+        # Nothing changed since the spectator state, so late joiners get a keyframe of it under its tick
+        # and can follow the next delta like everyone else
+        keyframe_values = (tick,) + state + (events,) if changed else (self.spectator_tick,) + base + (0,)
+
+        config = self.config
+        frames = {}
+        # How many spectators each frame went to, counted in the metrics once at the end
+        sent = {}
+        metrics = None
+        for spectator in list(self.spectators):
+            if spectator.writer.is_closing():
+                # Gone; its handler removes it once it notices
+                continue
+            queued = spectator.queued()
+            if queued > config.spectator_drop_bytes:
+                spectator.metrics.spectator_drops.inc()
+                self.remove_spectator(spectator)
+                spectator.close()
+                continue
+            keyframe = base is None or spectator in self.catching_up
+            if not keyframe and not changed:
+                continue
+            if queued > config.spectator_skip_bytes:
+                # Let the backlog drain; the spectator picks up again from a keyframe
+                spectator.metrics.spectator_skips.inc()
+                self.catching_up.add(spectator)
+                continue
+            key = (keyframe, spectator.codec)
+            frame = frames.get(key)
+            if frame is None:
+                if keyframe:
+                    frame = protocol.encode(protocol.SNAPSHOT, keyframe_values, spectator.codec)
+                else:
+                    frame = protocol.encodeDelta(tick, self.spectator_tick, events, mask, state, spectator.codec)
+                frames[key] = frame
+                sent[key] = 0
+            spectator.writer.write(frame)
+            sent[key] += 1
+            metrics = spectator.metrics
+            if keyframe:
+                self.catching_up.discard(spectator)
+        for key, count in sent.items():
+            metrics.sent(protocol.SNAPSHOT if key[0] else protocol.DELTA, len(frames[key]), TCP_LABELS, count)
+        if changed:
+            self.spectator_tick, self.spectator_state = tick, state
+
+    def record(self, write, *args) -> None:
+        # Calls one of the recorder's methods. The recording is the first thing to go when its file cannot
+        # be written (a full disk, say); the match itself carries on.
+        try:
+            write(*args)
+        except OSError as e:
+            print(f"Recording of room {self.room_id} stopped: {e}")
+            recorder, self.recorder = self.recorder, None
+            try:
+                recorder.file.close()
+            except OSError:
+                pass
+
+    def stop_recording(self) -> None:
+        if self.recorder is not None:
+            self.record(self.recorder.close, self.world)
+            self.recorder = None
+
+    def queue_inputs(self, player_id: str, first_seq: int, moves: list) -> None:
+        if self.recorder is not None:
+            self.record(self.recorder.recordInputs, self.world.tick, player_id, first_seq, moves)
+        self.world.queueInputs(player_id, first_seq, moves)
+
+    def tick(self) -> None:
+        # Steps the physics once and pushes the result to both players
+        self.publish(self.world.step())
+
+    def publish(self, events: int) -> None:
+        # Sends the outcome of a tick that has already been stepped
+        world = self.world
+        if self.recorder is not None:
+            self.record(self.recorder.recordTick, world)
+        if events & protocol.EVENT_POINT:
+            # Scores also go out as their own event so clients never have to infer them from snapshots
+            self.broadcast(protocol.SCORE_UPDATE, (world.lScore, world.rScore))
+        self.send_state(events)
+
+    def close(self) -> None:
+        # Once either player leaves for good the match is over, so drop the other player as well
+        self.closed = True
+        for timer in self.away.values():
+            timer.cancel()
+        self.away.clear()
+        self.stop_recording()
+        if self.batch is not None:
+            self.batch.remove(self.world)
+            self.batch = None
+        for connection in self.clients.values():
+            connection.close()
+        self.clients.clear()
+        for spectator in self.spectators:
+            spectator.close()
+        self.spectators.clear()
+        self.catching_up.clear()
+
+class Matchmaker:
+    # Pairs incoming players into rooms, filling one room at a time
+    def __init__(self, config: ServerConfig, room_ids: itertools.count = None) -> None:
+        self.config = config
+        self.rooms = {}
+        self.waiting_room = None
+        # Every seated player by resume token. A token starts with the room id so that a front door can
+        # route the reconnect to the worker running the room.
+        self.seats = {}
+        self._room_ids = room_ids or itertools.count(1)
+        self.batch = None
+        if config.physics == "batch":
+            # Imported only when asked for, so numpy stays optional
+            from assets.code.batchSimulation import BatchWorld
+            self.batch = BatchWorld(config.x_res, config.y_res)
+        elif config.physics != "object":
+            raise ValueError(f"unknown physics {config.physics!r}, expected 'object' or 'batch'")
+
+    def join(self, connection: PlayerConnection) -> tuple:
+        if self.waiting_room is None:
+            self.waiting_room = GameRoom(next(self._room_ids), self.config, self.batch)
+            self.rooms[self.waiting_room.room_id] = self.waiting_room
 
-            client_request = json.loads(data.decode('utf-8'))
-
-            if client_request["request"] == "update_paddle":
-                # Update the paddle position for this player
-                game_state[player_id]['y_pos'] = client_request['y_pos']
-
-            elif client_request["request"] == "get_opponent_paddle":
-                # Send the opponent's paddle position to this player
-                response = {'opponent_y': game_state[opponent_id]['y_pos']}
-                client_socket.sendall(json.dumps(response).encode('utf-8'))
-
-            elif client_request["request"] == "get_parameters":
-                # Send game parameters to the player
-                response = {
-                    'x_res': 400,  # Example resolution, adjust as needed
-                    'y_res': 480,
-                    'paddle_position': player_id
-                }
-                client_socket.sendall(json.dumps(response).encode('utf-8'))
-
-        # Handle readiness message
-            if client_request['request'] == 'ready':
-                client_ready[player_id] = True
-                # Check if both clients are ready
-                if all(client_ready.values()):
-                    # Notify clients to start the game
-                    for c in clients:
-                        response = {'game_start': True}
-                        c.sendall(json.dumps(response).encode('utf-8'))
-
-
-            if client_request['request'] == 'score':
-                # Update score for the player
-                game_state[player_id]['score'] += 1
-                # Send score update to both clients
-                score_update = {'player1_score': game_state['player1']['score'], 'player2_score': game_state['player2']['score']}
-                for c in clients:
-                    c.sendall(json.dumps(score_update).encode('utf-8'))
+        room = self.waiting_room
+        player_id = room.add_player(connection)
+        connection.resume_token = f"{room.room_id}-{secrets.token_hex(16)}"
+        self.seats[connection.resume_token] = connection
+        if room.is_full():
+            self.waiting_room = None
+        return room, player_id
 
+    def leave(self, room: GameRoom) -> None:
+        if self.waiting_room is room:
+            self.waiting_room = None
+        self.rooms.pop(room.room_id, None)
+        for connection in room.clients.values():
+            self.seats.pop(connection.resume_token, None)
+        room.close()
+
+# Decoded frames a client may have waiting before the server stops reading from its socket
+MAX_PENDING_FRAMES = 1024
+
+class FrameReader(asyncio.streams.FlowControlMixin, asyncio.BufferedProtocol):
+    # The receiving side of a client's TCP connection. The transport reads straight into the connection's
+    # FrameDecoder buffer instead of into a new bytes object per read, and only whole frames come out.
+    # Writes go through a regular asyncio.StreamWriter, whose drain() relies on FlowControlMixin.
+    def __init__(self, metrics: ServerMetrics, connected=None) -> None:
+        # connected(reader, writer) is started as a task once the connection is made
+        super().__init__()
+        self.metrics = metrics
+        self.connected = connected
+        self.decoder = protocol.FrameDecoder()
+        self.frames = []
+        self.eof = False
+        self.paused = False
+        self.waiter = None
+        self.transport = None
+        self.writer = None
+        self.task = None
+        self.closed = self._loop.create_future()
+
+    def connection_made(self, transport: asyncio.Transport) -> None:
+        self.transport = transport
+        self.writer = asyncio.StreamWriter(transport, self, None, self._loop)
+        if self.connected is not None:
+            self.task = self._loop.create_task(self.connected(self, self.writer))
+
+    def get_buffer(self, sizehint: int) -> memoryview:
+        return self.decoder.receiveBuffer()
+
+    def buffer_updated(self, nbytes: int) -> None:
+        self.metrics.bytes_in.inc(nbytes, TCP_LABELS)
+        started = time.perf_counter()
+        self.frames.extend(self.decoder.received(nbytes))
+        self.metrics.decode_seconds.observe(time.perf_counter() - started)
+        if len(self.frames) > MAX_PENDING_FRAMES and not self.paused:
+            self.paused = True
+            self.transport.pause_reading()
+        self._wake()
+
+    def eof_received(self) -> bool:
+        self.eof = True
+        self._wake()
+        return False
+
+    def connection_lost(self, exc: Exception) -> None:
+        super().connection_lost(exc)
+        self.eof = True
+        self._wake()
+        if not self.closed.done():
+            self.closed.set_result(None)
+
+    def _get_close_waiter(self, stream: asyncio.StreamWriter) -> asyncio.Future:
+        # For StreamWriter.wait_closed()
+        return self.closed
+
+    def _wake(self) -> None:
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(None)
+
+    async def read_frames(self) -> list:
+        # Every frame received since the last call, waiting for at least one; an empty list means the client
+        # went away
+        while not self.frames and not self.eof:
+            self.waiter = self._loop.create_future()
+            await self.waiter
+            self.waiter = None
+        frames, self.frames = self.frames, []
+        if self.paused:
+            self.paused = False
+            self.transport.resume_reading()
+        return frames
+
+def refuse(writer: asyncio.StreamWriter, metrics: ServerMetrics, error: str) -> None:
+    # Answers the handshake with an error instead of game parameters and hangs up
+    frame = protocol.encodeJson(protocol.PARAMETERS, {'error': error})
+    writer.write(frame)
+    metrics.sent(protocol.PARAMETERS, len(frame), TCP_LABELS)
+    writer.close()
+
+async def authenticate(request: dict, auth: Authenticator, metrics: ServerMetrics) -> str:
+    # Returns the connection's session token, or None to refuse it. A valid token from an earlier login
+    # stands in for the password; otherwise the password is checked off the event loop.
+    started = time.perf_counter()
+    token = request.get('session')
+    if auth.resume(token) is not None:
+        result = 'resumed'
+    else:
+        token = await auth.login(request.get('username'), request.get('password'))
+        result = 'failed' if token is None else 'password'
+    metrics.logins.inc(1, (result,))
+    metrics.auth_seconds.observe(time.perf_counter() - started)
+    return token
+
+async def handle_client(reader: FrameReader, writer: asyncio.StreamWriter, matchmaker: Matchmaker, config: ServerConfig, udp: StateDatagramProtocol, auth: Authenticator, metrics: ServerMetrics, settle=None) -> None:
+    # The first frame decides whether this is a player or a spectator, so nobody takes a seat in a room
+    # before saying what they came for, or before logging in when the server checks logins. settle, if
+    # given, is called once the connection has taken its seat or turned out to be a spectator.
+    session = None
+    try:
+        frames = await reader.read_frames()
+        request = protocol.decodeJson(frames[0][1]) if frames and frames[0][0] == protocol.GET_PARAMETERS else {}
+        if auth is not None and frames:
+            session = await authenticate(request, auth, metrics)
+            if session is None:
+                refuse(writer, metrics, "invalid username or password")
+                return
+        if 'spectate' in request:
+            if settle is not None:
+                settle()
+            await handle_spectator(reader, writer, frames, matchmaker, config, session, metrics)
+            return
+    except Exception as e:
+        print(f"Error during handshake with {writer.get_extra_info('peername')}: {e}")
+        frames = []
+    if not frames:
+        writer.close()
+        return
+
+    resuming = 'resume' in request
+    if resuming:
+        # A player coming back to its seat, which may still be held by the connection it lost
+        token = request['resume']
+        connection = matchmaker.seats.get(token) if isinstance(token, str) else None
+        if connection is None or connection.room.closed:
+            metrics.reconnects.inc(1, ('refused',))
+            refuse(writer, metrics, "the match is over")
+            return
+        room, player_id = connection.room, connection.player_id
+        room.resume(connection, writer)
+        metrics.reconnects.inc(1, ('resumed',))
+        print(f"Client {player_id} reconnected from {writer.get_extra_info('peername')} to room {room.room_id}")
+    else:
+        connection = PlayerConnection(writer, metrics)
+        room, player_id = matchmaker.join(connection)
+        connection.room, connection.player_id = room, player_id
+        print(f"Connection from {writer.get_extra_info('peername')} as {player_id} in room {room.room_id}")
+    if settle is not None:
+        settle()
+    metrics.connections.set(metrics.connections.value + 1)
+
+    while not room.closed and connection.writer is writer:
+        try:
+            started = time.perf_counter()
+            if frames is None:
+                frames = await reader.read_frames()
+                if not frames:
+                    break
+                started = time.perf_counter()
+            for msg_type, payload in frames:
+                metrics.received(msg_type)
+                if msg_type == protocol.INPUT or msg_type == protocol.ACK or msg_type == protocol.PING:
+                    connection.handle_state_message(msg_type, payload)
+
+                elif msg_type == protocol.GET_PARAMETERS:
+                    # Send game parameters to the player, agreeing to the payload codec it asked for
+                    request = protocol.decodeJson(payload)
+                    if request.get('codec') == protocol.CODEC_JSON:
+                        connection.codec = protocol.CODEC_JSON
+                    response = {
+                        'x_res': config.x_res,
+                        'y_res': config.y_res,
+                        'tick_rate': config.tick_rate,
+                        'paddle_position': player_id,
+                        'room_id': room.room_id,
+                        'codec': connection.codec,
+                        'transport': 'tcp',
+                        'resume': connection.resume_token,
+                        'reconnect_grace': config.reconnect_grace
+                    }
+                    if session is not None:
+                        response['session'] = session
+                    if udp is not None:
+                        udp.unregister(connection)
+                        connection.udp_addr = None
+                        response['transport'] = 'udp'
+                        response['udp_port'] = config.udp_port
+                        response['udp_token'] = udp.register(connection)
+                    connection.write(protocol.PARAMETERS, protocol.encodeJson(protocol.PARAMETERS, response))
+                    if resuming:
+                        room.catch_up(connection)
+
+                # Handle readiness message
+                elif msg_type == protocol.READY:
+                    room.client_ready[player_id] = True
+                    # Check if both clients are ready
+                    if room.is_full() and all(room.client_ready.values()) and not room.started:
+                        # Notify clients to start the game, the tick loop picks the room up from here
+                        room.start()
+
+                else:
+                    raise protocol.ProtocolError(f"unexpected message type {msg_type}")
+            frames = None
+
+            metrics.handle_seconds.observe(time.perf_counter() - started)
+
+            # Stop reading from a client whose socket buffer is backing up instead of queueing without limit
+            await writer.drain()
 
         except Exception as e:
-            print(f"Error with client {player_id}: {e}")
+            print(f"Error with client {player_id} in room {room.room_id}: {e}")
             break
 
-    # Regularly send game state updates
+    metrics.connections.set(metrics.connections.value - 1)
+    writer.close()
+    if connection.writer is not writer:
+        # A reconnect has taken the seat over
+        return
+    if udp is not None:
+        udp.unregister(connection)
+    if room.closed:
+        # The other player leaving has already closed the room
+        return
+    if room.started and not room.closed and config.reconnect_grace > 0:
+        # Hold the seat and let the match run on; the room only closes if the player does not come back
+        def forfeit() -> None:
+            metrics.reconnects.inc(1, ('forfeited',))
+            matchmaker.leave(room)
+            print(f"Client {player_id} did not come back, room {room.room_id} closed")
+        room.hold_seat(connection, config.reconnect_grace, forfeit)
+        print(f"Client {player_id} dropped out, holding its seat in room {room.room_id} for {config.reconnect_grace:g} s")
+        return
+    matchmaker.leave(room)
+    print(f"Client {player_id} disconnected, room {room.room_id} closed")
+
+async def handle_spectator(reader: FrameReader, writer: asyncio.StreamWriter, frames: list, matchmaker: Matchmaker, config: ServerConfig, session: str, metrics: ServerMetrics) -> None:
+    # Spectators name the room they want to watch in the handshake. From then on they only receive; their
+    # acknowledgements, readiness and inputs mean nothing and are ignored, and pings are answered.
+    request = protocol.decodeJson(frames[0][1])
+    room = matchmaker.rooms.get(request['spectate'])
+    codec = protocol.CODEC_JSON if request.get('codec') == protocol.CODEC_JSON else protocol.CODEC_BINARY
+    spectator = SpectatorConnection(writer, metrics, codec)
+    if room is None or room.closed or len(room.spectators) >= config.max_spectators:
+        refuse(writer, metrics, f"room {request['spectate']} does not exist" if room is None or room.closed else f"room {room.room_id} is full")
+        return
+    response = {
+        'x_res': config.x_res,
+        'y_res': config.y_res,
+        'tick_rate': config.tick_rate,
+        'paddle_position': protocol.SPECTATOR,
+        'room_id': room.room_id,
+        'codec': codec,
+        'transport': 'tcp'
+    }
+    if session is not None:
+        response['session'] = session
+    spectator.write(protocol.PARAMETERS, protocol.encodeJson(protocol.PARAMETERS, response))
+    room.add_spectator(spectator)
+    metrics.spectators.set(metrics.spectators.value + 1)
+    print(f"Spectator from {writer.get_extra_info('peername')} watching room {room.room_id}")
+
+    frames = frames[1:]
+    try:
+        while not room.closed and spectator in room.spectators:
+            for msg_type, payload in frames:
+                metrics.received(msg_type)
+                if msg_type == protocol.PING:
+                    spectator.send(protocol.PONG, protocol.decode(msg_type, payload, codec))
+            frames = await reader.read_frames()
+            if not frames:
+                break
+    except Exception as e:
+        print(f"Error with spectator of room {room.room_id}: {e}")
+    room.remove_spectator(spectator)
+    metrics.spectators.set(metrics.spectators.value - 1)
+    writer.close()
+
+async def tick_loop(matchmaker: Matchmaker, config: ServerConfig, metrics: ServerMetrics) -> None:
+    # One fixed-timestep clock drives every running room. Ticks are scheduled against absolute times so
+    # that a slow tick is made up for by sleeping less afterwards rather than drifting.
+    loop = asyncio.get_running_loop()
+    interval = 1 / config.tick_rate
+    next_tick = loop.time()
+    while True:
+        started = time.perf_counter()
+        batch = matchmaker.batch
+        if batch is not None:
+            events = batch.step().tolist()
+            for room in list(matchmaker.rooms.values()):
+                if room.started and not room.closed:
+                    room.publish(events[room.world.slot])
+        else:
+            for room in list(matchmaker.rooms.values()):
+                if room.started and not room.closed:
+                    room.tick()
+        metrics.tick_seconds.observe(time.perf_counter() - started)
+
+        next_tick += interval
+        delay = next_tick - loop.time()
+        if delay < -interval:
+            # Fell more than a whole tick behind; skip the missed ticks instead of bursting to catch up
+            next_tick = loop.time()
+            delay = 0
+        await asyncio.sleep(max(delay, 0))
+
+async def adapt_loop(matchmaker: Matchmaker, config: ServerConfig) -> None:
+    # Re-judges every player's link and adjusts how often it gets states; kept off the tick path
+    if config.max_send_interval <= 1:
+        return
+    while True:
+        await asyncio.sleep(config.adapt_interval)
+        for room in list(matchmaker.rooms.values()):
+            if room.started and not room.closed:
+                for connection in room.clients.values():
+                    connection.adapt(config)
+
+async def metrics_loop(matchmaker: Matchmaker, config: ServerConfig, metrics: ServerMetrics) -> None:
+    # Once a second: sample how much output is queued for each player, and print the summary line when
+    # periodic logging is on
+    last_log = time.perf_counter()
+    last_in = last_out = 0
+    while True:
+        await asyncio.sleep(1)
+        for room in list(matchmaker.rooms.values()):
+            for connection in room.clients.values():
+                if connection.writer is not None:
+                    metrics.send_queue_bytes.observe(connection.writer.transport.get_write_buffer_size())
+                    metrics.send_interval.observe(connection.send_interval)
+
+        now = time.perf_counter()
+        if config.metrics_log_interval and now - last_log >= config.metrics_log_interval:
+            total_in, total_out = metrics.messages_in.total(), metrics.messages_out.total()
+            elapsed = now - last_log
+            print(f"[metrics] rooms={metrics.rooms.get():g} connections={metrics.connections.get():g} "
+                  f"in={(total_in - last_in) / elapsed:.0f} msg/s out={(total_out - last_out) / elapsed:.0f} msg/s "
+                  f"bytes_out={metrics.bytes_out.total():.0f} tick_p99<={metrics.tick_seconds.quantile(0.99) * 1000:g} ms "
+                  f"send_queue_p99<={metrics.send_queue_bytes.quantile(0.99):g} B")
+            last_log, last_in, last_out = now, total_in, total_out
+
+async def profile_for(seconds: float, sampled: bool) -> str:
+    # cProfile sees only the event loop thread, which is where every handler runs. The sampler watches
+    # that same thread from the outside, so it is safe to leave running for longer windows.
+    if sampled:
+        profiler = StackSampler(threading.get_ident())
+    else:
+        profiler = CallProfiler()
+    profiler.start()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        report = profiler.stop()
+    return report
+
+async def handle_metrics_request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, config: ServerConfig, metrics: ServerMetrics) -> None:
+    # Just enough HTTP for curl and a Prometheus scraper: GET /metrics, and with profiling enabled
+    # GET /profile?seconds=N (cProfile) or /sample?seconds=N (folded stacks for a flame graph)
+    try:
+        request_line = (await reader.readline()).decode('latin-1').split()
+        while (await reader.readline()).strip():
+            pass
+        url = urllib.parse.urlsplit(request_line[1] if len(request_line) > 1 else "/")
+        query = urllib.parse.parse_qs(url.query)
+        status, body = "200 OK", ""
+        if url.path == "/metrics":
+            body = metrics.registry.render()
+        elif url.path in ("/profile", "/sample") and config.profiling:
+            seconds = min(float(query.get("seconds", ["5"])[0]), 300)
+            body = await profile_for(seconds, sampled=url.path == "/sample")
+        else:
+            status, body = "404 Not Found", "not found\n"
+        data = body.encode('utf-8')
+        writer.write(f"HTTP/1.0 {status}\r\nContent-Type: text/plain; version=0.0.4\r\nContent-Length: {len(data)}\r\n\r\n".encode('latin-1') + data)
+        await writer.drain()
+    except Exception as e:
+        print(f"Error serving metrics request: {e}")
+    finally:
+        writer.close()
+
+def raise_fd_limit() -> None:
+    # Every player holds a socket, so allow as many open descriptors as the OS lets us have. Windows has
+    # no resource module and no such limit to raise.
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+# Worker to front door: (new players whose handshake has ended so far, seated or not, open rooms, whether
+# a player is waiting for an opponent)
+WORKER_REPORT = struct.Struct("!QIB")
+# Sent along with each socket handed to a worker: a new player, or a spectator or reconnecting player
+HANDOFF_PLAYER = b"p"
+HANDOFF_OTHER = b"c"
+
+async def report_loop(matchmaker: Matchmaker, channel: socket.socket, settled) -> None:
+    # Tells the front door whenever this worker's load changes. Polling keeps the hot path free of it,
+    # and the front door covers the gap by counting the players it has handed over itself.
+    last = None
     while True:
+        report = (settled(), len(matchmaker.rooms), matchmaker.waiting_room is not None)
+        if report != last:
+            channel.send(WORKER_REPORT.pack(*report))
+            last = report
+        await asyncio.sleep(0.05)
+
+async def serve(config: ServerConfig, channel: socket.socket = None, room_ids: itertools.count = None) -> None:
+    # Serves players on its own listening socket, or when channel is given, the connections a front door
+    # passes over it
+    loop = asyncio.get_running_loop()
+    matchmaker = Matchmaker(config, room_ids)
+    metrics = ServerMetrics(matchmaker)
+    udp = None
+    if config.transport == "udp":
+        _, udp = await loop.create_datagram_endpoint(
+            lambda: StateDatagramProtocol(metrics), local_addr=(config.host, config.udp_port))
+        print(f"Server exchanging game state over UDP on {config.host}:{config.udp_port}")
+    elif config.transport != "tcp":
+        raise ValueError(f"unknown transport {config.transport!r}, expected 'tcp' or 'udp'")
+
+    auth = None
+    if config.auth_db:
+        auth = Authenticator(SqliteCredentialStore(config.auth_db), config.auth_workers,
+                             SessionCache(config.session_cache_size, config.session_ttl))
+
+    background = [asyncio.create_task(tick_loop(matchmaker, config, metrics)),
+                  asyncio.create_task(metrics_loop(matchmaker, config, metrics)),
+                  asyncio.create_task(adapt_loop(matchmaker, config))]
+    if config.metrics_port:
+        metrics_server = await asyncio.start_server(
+            lambda reader, writer: handle_metrics_request(reader, writer, config, metrics),
+            config.metrics_host, config.metrics_port, reuse_address=True)
+        background.append(asyncio.create_task(metrics_server.serve_forever()))
+        print(f"Metrics available at http://{config.metrics_host}:{config.metrics_port}/metrics")
+
+    try:
+        if channel is None:
+            connected = lambda reader, writer: handle_client(reader, writer, matchmaker, config, udp, auth, metrics)
+            server = await loop.create_server(
+                lambda: FrameReader(metrics, connected), config.host, config.port, backlog=config.backlog, reuse_address=True)
+            print(f"Server listening for connections on {config.host}:{config.port}...")
+            async with server:
+                await server.serve_forever()
+        else:
+            await serve_handoffs(channel, matchmaker, config, udp, auth, metrics)
+    finally:
+        for task in background:
+            task.cancel()
+        # Finish the recordings of matches still going so they end with an index like any other
+        for room in list(matchmaker.rooms.values()):
+            room.stop_recording()
+        if auth is not None:
+            auth.close()
+
+async def serve_handoffs(channel: socket.socket, matchmaker: Matchmaker, config: ServerConfig, udp: StateDatagramProtocol, auth: Authenticator, metrics: ServerMetrics) -> None:
+    # Takes over the client sockets the front door sends along with each message on channel, until the
+    # front door goes away
+    loop = asyncio.get_running_loop()
+    closed = loop.create_future()
+    # The event loop only keeps weak references to tasks, and one waiting for a client's first frame can
+    # otherwise be collected along with the client's socket
+    adopted = set()
+    # New players handed over whose handshake has ended, whether they got a seat or gave up, were refused
+    # or turned out to be something else. The front door trusts a report only once this has caught up
+    # with what it handed over.
+    settled = 0
+
+    async def adopt(sock: socket.socket, player: bool) -> None:
+        done = False
+        def settle() -> None:
+            nonlocal settled, done
+            if player and not done:
+                done = True
+                settled += 1
         try:
-            # Send current game state to client
-            client_socket.sendall(json.dumps(game_state).encode('utf-8'))
-            time.sleep(0.1)  # Adjust this to control update frequency
-        except Exception as e:
-            print(f'Error sending game state to {player_id}: {e}')
-            break
+            _, reader = await loop.connect_accepted_socket(lambda: FrameReader(metrics), sock)
+            await handle_client(reader, reader.writer, matchmaker, config, udp, auth, metrics, settle)
+        finally:
+            # A handshake that failed or was refused never settled
+            settle()
 
-    client_socket.close()
-    print(f"Client {player_id} disconnected")
+    def receive() -> None:
+        message, fds, _, _ = socket.recv_fds(channel, 16, 16)
+        if not message:
+            if not closed.done():
+                closed.set_result(None)
+            return
+        for fd in fds:
+            task = asyncio.create_task(adopt(socket.socket(fileno=fd), message == HANDOFF_PLAYER))
+            adopted.add(task)
+            task.add_done_callback(adopted.discard)
 
-client_ready = {'player1': False, 'player2': False}
+    loop.add_reader(channel, receive)
+    reporter = asyncio.create_task(report_loop(matchmaker, channel, lambda: settled))
+    try:
+        await closed
+    finally:
+        loop.remove_reader(channel)
+        reporter.cancel()
 
-def start_server():
-    global game_state
-    game_state = {'player1': {'y_pos': 0, 'score': 0}, 'player2': {'y_pos': 0, 'score': 0}, 'ball': {'x': 320, 'y': 240}}
+def run_worker(config: ServerConfig, index: int, channel: socket.socket, inherited: list = ()) -> None:
+    # Each worker gets its own UDP and metrics ports and hands out room ids no other worker uses. inherited
+    # are the front door's ends of the channels, which the fork copied; a worker only sees its channel
+    # close when the front door goes away if it holds none of them.
+    for sock in inherited:
+        sock.close()
+    config = dataclasses.replace(config, udp_port=config.udp_port + index,
+                                 metrics_port=config.metrics_port + index if config.metrics_port else 0)
+    raise_fd_limit()
+    try:
+        asyncio.run(serve(config, channel, itertools.count(index + 1, config.workers)))
+    except KeyboardInterrupt:
+        pass
 
-    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    server.bind(("localhost", 12321))
-    server.listen(2)
-    print("Server listening for connections...")
+class WorkerHandle:
+    # The front door's view of one worker
+    def __init__(self, index: int, process: multiprocessing.Process, channel: socket.socket) -> None:
+        self.index = index
+        self.process = process
+        self.channel = channel
+        self.alive = True
+        self.handed_over = 0
+        self.rooms = 0
+        self.waiting = False
 
-    clients = []
+    def hand_over(self, client: socket.socket, player: bool = True) -> None:
+        socket.send_fds(self.channel, [HANDOFF_PLAYER if player else HANDOFF_OTHER], [client.fileno()])
+        if not player:
+            # Spectators never join the matchmaker, so they change nothing the worker reports
+            return
+        self.handed_over += 1
+        # Assume the player went where the worker's matchmaker puts it until the worker reports back
+        if self.waiting:
+            self.waiting = False
+        else:
+            self.waiting = True
+            self.rooms += 1
 
-    while len(clients) < 2:
-        client_socket, addr = server.accept()
-        player_id = 'player1' if len(clients) == 0 else 'player2'
-        opponent_id = 'player2' if player_id == 'player1' else 'player1'
-        print(f"Connection from {addr} as {player_id}")
+    def receive_report(self) -> None:
+        data = self.channel.recv(WORKER_REPORT.size)
+        if not data:
+            self.alive = False
+            asyncio.get_running_loop().remove_reader(self.channel)
+            print(f"Worker {self.index} exited")
+            return
+        settled, rooms, waiting = WORKER_REPORT.unpack(data)
+        # A report from before the latest hand-overs would undo our own bookkeeping for them
+        if settled >= self.handed_over:
+            self.rooms, self.waiting = rooms, bool(waiting)
 
-        client_thread = threading.Thread(target=handle_client, args=(client_socket, player_id, opponent_id, clients))
-        client_thread.start()
-        clients.append(client_socket)
+def pick_worker(workers: list) -> WorkerHandle:
+    # A worker holding a player who waits for an opponent comes first so the pair shares a room;
+    # otherwise the new room goes to the worker with the fewest
+    alive = [worker for worker in workers if worker.alive]
+    if not alive:
+        raise RuntimeError("all workers have exited")
+    for worker in alive:
+        if worker.waiting:
+            return worker
+    return min(alive, key=lambda worker: worker.rooms)
 
-    print("Both players connected. Game can start.")
+async def peek_room(client: socket.socket, timeout: float = 5) -> int:
+    # Looks at the client's first frame without consuming it and returns the room a spectator or a
+    # reconnecting player asks for, or None for a new player. The handshake request is small, so it is
+    # waited for here rather than read by the worker.
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while loop.time() < deadline:
+        try:
+            data = client.recv(4096, socket.MSG_PEEK)
+        except BlockingIOError:
+            readable = loop.create_future()
+            loop.add_reader(client, lambda: readable.done() or readable.set_result(None))
+            try:
+                await asyncio.wait_for(readable, deadline - loop.time())
+            except asyncio.TimeoutError:
+                return None
+            finally:
+                loop.remove_reader(client)
+            continue
+        if not data:
+            return None
+        frames = protocol.FrameDecoder().feed(data)
+        if frames:
+            msg_type, payload = frames[0]
+            if msg_type != protocol.GET_PARAMETERS:
+                return None
+            request = protocol.decodeJson(payload)
+            room_id = request.get('spectate')
+            if isinstance(request.get('resume'), str):
+                # Resume tokens start with the room id, see Matchmaker.seats
+                room_id, _, _ = request['resume'].partition('-')
+                room_id = int(room_id) if room_id.isdigit() else None
+            return room_id if isinstance(room_id, int) else None
+        # Only part of the first frame has arrived
+        await asyncio.sleep(0.01)
+    return None
 
-if __name__ == "__main__":
-    start_server()
+async def route_client(client: socket.socket, workers: list) -> None:
+    # New players go where pick_worker says. Room ids are dealt out round robin by worker (see run_worker),
+    # so spectators and reconnecting players go to the worker their room id names.
+    with client:
+        try:
+            room_id = await peek_room(client)
+        except (OSError, protocol.ProtocolError) as e:
+            print(f"Could not read handshake: {e}")
+            return
+        try:
+            if room_id is None:
+                pick_worker(workers).hand_over(client)
+            else:
+                worker = workers[(room_id - 1) % len(workers)]
+                if worker.alive:
+                    worker.hand_over(client, player=False)
+        except (OSError, RuntimeError) as e:
+            print(f"Could not hand over connection: {e}")
+
+async def front_door(config: ServerConfig, workers: list) -> None:
+    # Accepts every player and passes the socket to a worker once its first frame has arrived; the
+    # worker then runs the handshake and the match exactly as a single process server would. The frame
+    # is only peeked at, to send spectators to the worker running the room they want to watch.
+    loop = asyncio.get_running_loop()
+    for worker in workers:
+        loop.add_reader(worker.channel, worker.receive_report)
+
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((config.host, config.port))
+    listener.listen(config.backlog)
+    listener.setblocking(False)
+    print(f"Server listening for connections on {config.host}:{config.port} with {len(workers)} workers...")
+    routing = set()
+    with listener:
+        while True:
+            client, _ = await loop.sock_accept(listener)
+            task = asyncio.create_task(route_client(client, workers))
+            routing.add(task)
+            task.add_done_callback(routing.discard)
 
+def supervise(config: ServerConfig) -> None:
+    # Starts the workers before the front door opens any sockets of its own. Each worker still inherits the
+    # front door's ends of its own and every earlier worker's channel, and closes them as it starts.
+    raise_fd_limit()
+    context = multiprocessing.get_context("fork")
+    workers = []
+    for index in range(config.workers):
+        parent, child = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        inherited = [worker.channel for worker in workers] + [parent]
+        process = context.Process(target=run_worker, args=(config, index, child, inherited),
+                                  name=f"pong-worker-{index}", daemon=True)
+        process.start()
+        child.close()
+        workers.append(WorkerHandle(index, process, parent))
+    try:
+        asyncio.run(front_door(config, workers))
+    finally:
+        for worker in workers:
+            worker.channel.close()
+        for worker in workers:
+            worker.process.join(1)
+            if worker.process.is_alive():
+                worker.process.terminate()
 
+def start_server(config: ServerConfig = None) -> None:
+    config = config or ServerConfig()
+    # Shut down on SIGTERM the way Ctrl-C does, so open recordings are finished. Forked workers inherit it.
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    if config.workers == 0:
+        config = dataclasses.replace(config, workers=os.cpu_count() or 1)
+    if config.record_dir:
+        checkSettings(config.x_res, config.y_res, config.tick_rate, config.record_keyframe_interval)
+    try:
+        if config.workers > 1:
+            supervise(config)
+            return
+        raise_fd_limit()
+        asyncio.run(serve(config))
+    except KeyboardInterrupt:
+        pass
+
+def parse_args() -> ServerConfig:
+    # Every ServerConfig field can be overridden from the command line, e.g. --transport udp
+    parser = argparse.ArgumentParser(description="Multiplayer pong server")
+    for field in dataclasses.fields(ServerConfig):
+        kind = type(field.default)
+        if kind is bool:
+            kind = lambda value: value.lower() in ("1", "true", "yes", "on")
+        parser.add_argument(f"--{field.name.replace('_', '-')}", dest=field.name, type=kind, default=field.default)
+    return ServerConfig(**vars(parser.parse_args()))
+
+if __name__ == "__main__":
+    start_server(parse_args())